@@ -1,6 +1,14 @@
 """
 Plotting script for plotting the .csv data from the HTTP request from the Python web application.
 
+Run with --live to follow the running files, reading only the rows appended since the previous refresh
+and redrawing only the plotted lines:
+    python plotting.py --live
+
+Run with --recent to plot the most recent minutes of samples from the memory-mapped ring buffers kept by the web application,
+without reading the data files:
+    python plotting.py --recent 10
+
 Author: Liam Eime
 Date: 12/12/2023
 """
@@ -10,20 +18,384 @@ from matplotlib import pyplot as plt
 from matplotlib import dates as mdates
 from dotenv import load_dotenv
 from typing import Optional
-import pandas as pd
+import numpy as np
+import argparse
+import json
+import time
 import os
 import sys
 current = os.path.dirname(os.path.realpath(__file__))
 parent = os.path.dirname(current)
 sys.path.append(parent)
 import files
+import payload
+import downsample
+import hotstore
+import storage
+
+class FileTail:
+    """
+    #### Reader of the rows appended to a running .csv or .bin file since it was last read
+
+    Remembers the byte offset read up to, so each read only parses the new rows.\n
+    When the running file is renamed on completion and a new running file started, the rest of the completed file is read first.
+    A .bin running file is compressed to a new .npz file on completion, so the rest of the newest .npz file is read instead.
+    """
+
+    def __init__(self, path: str):
+        """
+        #### Create the reader, reading from the start of the file
+
+        ##### Parameters:
+        - path: str
+            - path to the running .csv or .bin file, named by the temp extension of the storage backend
+        """
+        self.path = path
+        self.backend = storage.get_backend_for_path(path)
+        self.is_binary = self.backend.temp_extension != self.backend.extension
+        self.header = None
+        self.header_bytes = 0
+        self.offset = 0
+        self.file_id = None
+
+    def _file_id(self, stat: os.stat_result):
+        """
+        #### Get the identity of the running file
+
+        A .csv running file is identified by its inode, which it keeps when renamed on completion.
+        A .bin running file is deleted on completion, and the next one may reuse its inode, so it is identified by its first record instead.
+
+        ##### Returns:
+        - file_id: tuple
+            - the identity, None for a .bin file without a record yet
+        """
+        if not self.is_binary:
+            return (stat.st_ino, stat.st_dev)
+        if self.header is None:
+            return None
+        with open(self.path, 'rb') as f:
+            f.seek(self.header_bytes)
+            first_record = f.read(self._record_dtype().itemsize)
+        return (first_record,) if len(first_record) == self._record_dtype().itemsize else None
+
+    def _record_dtype(self):
+        """
+        #### Get the dtype of the records of a .bin running file
+        """
+        return self.backend.record_dtype(len(self.header) - 1)
+
+    def _read_from(
+        self,
+        path: str,
+        offset: int
+    ):
+        """
+        #### Read the complete rows of a file from a byte offset
+
+        ##### Returns:
+        - raw_bytes: bytes
+            - the complete rows read
+        - offset: int
+            - byte offset after the last complete row
+        """
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            raw_bytes = f.read()
+        if offset == 0:
+            if b'\n' not in raw_bytes:
+                return b'', 0
+            header_end = raw_bytes.index(b'\n') + 1
+            header_line = raw_bytes[:header_end].decode().strip()
+            self.header = json.loads(header_line) if self.is_binary else header_line.replace('"', '').split(',')
+            self.header_bytes = header_end
+            raw_bytes, offset = raw_bytes[header_end:], header_end
+        if self.is_binary:
+            raw_bytes = raw_bytes[:len(raw_bytes) - len(raw_bytes) % self._record_dtype().itemsize]
+        else:
+            raw_bytes = raw_bytes[:raw_bytes.rfind(b'\n') + 1]
+        return raw_bytes, offset + len(raw_bytes)
+
+    def _read_completed_rest(self):
+        """
+        #### Read the rows of the completed .npz file the previously read .bin running file was compressed to, after the rows already read
+
+        ##### Returns:
+        - batch: payload.DataBatch
+            - the rows not yet read, None if the completed file was not found
+        """
+        latest_path = files.get_latest_filepath(os.path.dirname(self.path), self.backend.extension)
+        if latest_path is None:
+            return None
+        header, timestamps, channels = self.backend.read(latest_path)
+        num_rows_read = (self.offset - self.header_bytes) // self._record_dtype().itemsize
+        if header != self.header or num_rows_read >= len(timestamps):
+            return None
+        timestamps, channels = timestamps[num_rows_read:], channels[:, num_rows_read:]
+        return payload.DataBatch(header, timestamps, channels, b'', np.zeros(len(timestamps) + 1, dtype=np.int64))
+
+    def _parse(self, raw_bytes: bytes):
+        """
+        #### Parse the complete rows read from the running file
+
+        ##### Returns:
+        - batch: payload.DataBatch
+            - the parsed rows
+        """
+        if not self.is_binary:
+            return payload.parse_payload(raw_bytes, self.header)
+        records = np.frombuffer(raw_bytes, dtype=self._record_dtype())
+        return payload.DataBatch(self.header, records['timestamp'], records['channels'].T.copy(), b'', np.zeros(len(records) + 1, dtype=np.int64))
+
+    def _find_renamed_file(self):
+        """
+        #### Find the completed file the previously read running file was renamed to
+
+        ##### Returns:
+        - path: str
+            - path to the completed file, None if it was not found
+        """
+        with os.scandir(os.path.dirname(self.path)) as it:
+            for entry in it:
+                if entry.path != self.path and entry.is_file() and entry.stat().st_ino == self.file_id[0]:
+                    return entry.path
+        return None
+
+    def read_new_rows(self):
+        """
+        #### Parse the rows appended since the previous read
+
+        ##### Returns:
+        - batch: payload.DataBatch
+            - the new rows, None if there are none
+        """
+        try:  # try get the identity of the running file, it does not exist between high frequency events
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            stat = None
+        file_id = self._file_id(stat) if stat is not None else None
+        batches = []
+        if self.file_id is not None and file_id != self.file_id:
+            # the running file was completed, so read the rest of it before starting on the new running file
+            if self.is_binary:
+                completed_batch = self._read_completed_rest()
+                if completed_batch is not None:
+                    batches.append(completed_batch)
+            else:
+                renamed_path = self._find_renamed_file()
+                if renamed_path is not None:
+                    raw_bytes, _ = self._read_from(renamed_path, self.offset)
+                    batches.append(self._parse(raw_bytes))
+            self.offset = 0
+        self.file_id = file_id
+        if stat is not None:
+            if stat.st_size < self.offset:
+                self.offset = 0
+            raw_bytes, self.offset = self._read_from(self.path, self.offset)
+            if raw_bytes and self.header is not None:
+                batches.append(self._parse(raw_bytes))
+            if self.file_id is None:
+                self.file_id = self._file_id(stat)
+        batches = [batch for batch in batches if batch.num_rows]
+        if not batches:
+            return None
+        return batches[0] if len(batches) == 1 else payload.merge_batches(batches)
+
+class SlidingWindow:
+    """
+    #### Fixed size window of the most recent samples, kept in preallocated arrays
+
+    The arrays are twice the window size, so the window is always a contiguous view
+    and the samples only need moving to the front once each window's worth of samples.
+    """
+
+    def __init__(
+        self,
+        num_channels: int,
+        size: int
+    ):
+        """
+        #### Create the window
+
+        ##### Parameters:
+        - num_channels: int
+            - number of channels of each sample
+        - size: int
+            - number of samples kept
+        """
+        self.size = size
+        self.times = np.empty(2 * size, dtype=np.float64)
+        self.values = np.empty((num_channels, 2 * size), dtype=np.float32)
+        self.start = 0
+        self.end = 0
+
+    def append(
+        self,
+        times: np.ndarray,
+        values: np.ndarray
+    ):
+        """
+        #### Append samples, dropping the oldest samples outside the window
+
+        ##### Parameters:
+        - times: np.ndarray
+            - matplotlib date number of each sample
+        - values: np.ndarray
+            - array of shape (number of channels, number of samples)
+
+        ##### Returns:
+        - None
+        """
+        times = times[-self.size:]
+        values = values[:, -self.size:]
+        num_new = len(times)
+        if self.end + num_new > 2 * self.size:
+            num_kept = min(self.end - self.start, self.size - num_new)
+            self.times[:num_kept] = self.times[self.end - num_kept:self.end]
+            self.values[:, :num_kept] = self.values[:, self.end - num_kept:self.end]
+            self.start, self.end = 0, num_kept
+        self.times[self.end:self.end + num_new] = times
+        self.values[:, self.end:self.end + num_new] = values
+        self.end += num_new
+        self.start = max(self.start, self.end - self.size)
+
+    def view(self):
+        """
+        #### Get the samples in the window, without copying
+
+        ##### Returns:
+        - times: np.ndarray
+            - matplotlib date number of each sample
+        - values: np.ndarray
+            - array of shape (number of channels, number of samples)
+        """
+        return self.times[self.start:self.end], self.values[:, self.start:self.end]
+
+class LivePlot:
+    """
+    #### Figure of the most recent samples of a running file, redrawn with blitting
+
+    Only the lines are redrawn on each refresh, over a saved background of the axes.
+    The whole figure is only redrawn when the samples move outside the axis limits,
+    which are set with room to spare so this happens once every several refreshes.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        title: str,
+        y_label: str,
+        labels: list[str],
+        colors: list[str],
+        window_size: int,
+        marker: Optional[str] = None
+    ):
+        """
+        #### Create the figure and its lines
+
+        ##### Parameters:
+        - path: str
+            - path to the running .csv file
+        - title: str
+            - title of the plot
+        - y_label: str
+            - y axis label
+        - labels: list[str]
+            - names of the channels to plot
+        - colors: list[str]
+            - color of each channel
+        - window_size: int
+            - number of the most recent samples plotted
+        - marker: Optional[str] = None
+            - marker to use for the plot
+        """
+        self.tail = FileTail(path)
+        self.labels = labels
+        self.window = SlidingWindow(len(labels), window_size)
+        self.figure = plt.figure(title)
+        self.axes = self.figure.gca()
+        self.axes.set_title(title)
+        self.axes.set_xlabel('Time')
+        self.axes.set_ylabel(y_label)
+        self.axes.xaxis.set_major_formatter(mdates.DateFormatter('%H:%M:%S'))
+        self.lines = [
+            self.axes.plot([], [], label=label, color=color, marker=marker, animated=True)[0]
+            for label, color in zip(labels, colors)
+        ]
+        self.axes.legend()
+        self.figure.autofmt_xdate()
+        self.background = None
+        self.figure.canvas.mpl_connect('draw_event', self._on_draw)
+
+    def _on_draw(self, event):
+        """
+        #### Save the background of the axes and draw the lines over it, after every full redraw of the figure
+        """
+        self.background = self.figure.canvas.copy_from_bbox(self.axes.bbox)
+        for line in self.lines:
+            self.axes.draw_artist(line)
+
+    def _is_outside_limits(
+        self,
+        times: np.ndarray,
+        values: np.ndarray
+    ):
+        """
+        #### Check whether any samples are outside the axis limits
+
+        ##### Returns:
+        - is_outside_limits: bool
+            - True if the axis limits need to be reset
+        """
+        x_min, x_max = self.axes.get_xlim()
+        y_min, y_max = self.axes.get_ylim()
+        return times[-1] > x_max or times[0] < x_min - (x_max - x_min) or np.nanmin(values) < y_min or np.nanmax(values) > y_max
+
+    def _reset_limits(
+        self,
+        times: np.ndarray,
+        values: np.ndarray
+    ):
+        """
+        #### Set the axis limits around the samples, leaving room on the right for the next samples
+        """
+        span = max(times[-1] - times[0], 1 / (24 * 60 * 60))
+        self.axes.set_xlim(times[0], times[-1] + 0.25 * span)
+        y_min, y_max = np.nanmin(values), np.nanmax(values)
+        margin = max(0.1 * (y_max - y_min), 0.1)
+        self.axes.set_ylim(y_min - margin, y_max + margin)
+
+    def refresh(self):
+        """
+        #### Add the rows appended to the running file since the previous refresh and redraw the lines
+
+        ##### Returns:
+        - None
+        """
+        batch = self.tail.read_new_rows()
+        if batch is None:
+            return
+        values = np.stack([batch.column(label) for label in self.labels])
+        self.window.append(mdates.date2num(batch.timestamps), values)
+        times, values = self.window.view()
+        for line, line_values in zip(self.lines, values):
+            line.set_data(times, line_values)
+        if np.all(np.isnan(values)):
+            return
+        if self.background is None or self._is_outside_limits(times, values):
+            self._reset_limits(times, values)
+            self.figure.canvas.draw()
+        else:
+            self.figure.canvas.restore_region(self.background)
+            for line in self.lines:
+                self.axes.draw_artist(line)
+        self.figure.canvas.blit(self.axes.bbox)
 
 def plot_data(
     title: str, 
     x_label: str, 
     y_label: str, 
-    timestamps: list[str], 
-    data: list[list[float]], 
+    timestamps: np.ndarray, 
+    data: list[np.ndarray], 
     labels: list[str], 
     colors: list[str],
     marker: Optional[str] = None
@@ -38,10 +410,10 @@ def plot_data(
         - x axis label
     - y_label: str
         - y axis label
-    - timestamps: list[str]
-        - list of timestamps
-    - data: list[list[float]]
-        - list of lists of data to plot
+    - timestamps: np.ndarray
+        - datetime64[us] timestamp of each sample
+    - data: list[np.ndarray]
+        - list of arrays of data to plot
     - labels: list[str]
         - list of labels for each data set
     - colors: list[str]
@@ -74,10 +446,9 @@ def plot_high_freq_data(path_to_hf_data_folder: str):
     ##### Returns:
     - None
     """
-    high_freq_df = files.read_latest_csv_to_dataframe(path_to_hf_data_folder)
-    high_freq_timestamps = pd.to_datetime(high_freq_df["Timestamp"].astype(str), format='mixed')
-    data = [high_freq_df[column].astype(float) for column in high_freq_df.columns if column != "Timestamp"]
-    labels = [column for column in high_freq_df.columns if column != "Timestamp"]
+    header, high_freq_timestamps, channels = files.read_latest_data(path_to_hf_data_folder)
+    data = list(channels)
+    labels = header[1:]
     colors = ['red', 'blue', 'green', 'black', 'orange', 'grey']
     plot_data("High Frequency Accelerations", 'Time', "Acceleration (g's)", high_freq_timestamps, data, labels, colors)
 
@@ -92,17 +463,176 @@ def plot_low_freq_data(path_to_lf_data_folder: str):
     ##### Returns:
     - None
     """
-    low_freq_df = files.read_latest_csv_to_dataframe(path_to_lf_data_folder)
-    low_freq_timestamps = pd.to_datetime(low_freq_df["Timestamp"].astype(str), format="%Y-%m-%d %H:%M:%S")
-    data = [low_freq_df["Temperature"].astype(float)]
+    header, low_freq_timestamps, channels = files.read_latest_data(path_to_lf_data_folder)
+    data = [channels[header.index("Temperature") - 1]]
     labels = ["Temperature"]
     colors = ['red']
     plot_data("Low Frequency Temperature", 'Time', "Temperature (deg C)", low_freq_timestamps, data, labels, colors, marker='*')
 
+def plot_history(
+    path_to_data_folder: str,
+    title: str,
+    y_label: str,
+    labels: list[str],
+    colors: list[str],
+    hours: float
+):
+    """
+    #### Plot the most recent hours of data from the downsampling pyramid, without reading the data files
+
+    The coarsest level with at least one bucket for each pixel of the plot is read,
+    and the minimum to maximum of each channel is shaded around its mean, so peaks stay visible.
+
+    ##### Parameters:
+    - path_to_data_folder: str
+        - path to the data folder
+    - title: str
+        - title of the plot
+    - y_label: str
+        - y axis label
+    - labels: list[str]
+        - names of the channels to plot
+    - colors: list[str]
+        - color of each channel
+    - hours: float
+        - number of hours of data to plot
+
+    ##### Returns:
+    - None
+    """
+    pyramid_dir = os.path.join(path_to_data_folder, downsample.PYRAMID_FOLDER)
+    header, records = downsample.read_level(pyramid_dir, max(downsample.LEVEL_WIDTHS_S))
+    if header is None or len(records) == 0:
+        return
+    end = (records['bucket'][-1] + 1) * max(downsample.LEVEL_WIDTHS_S) * 1_000_000
+    end = np.datetime64(int(end), 'us')
+    start = end - np.timedelta64(int(hours * 60 * 60 * 1_000_000), 'us')
+    figure = plt.figure(title)
+    axes = figure.gca()
+    pixels = int(axes.get_window_extent().width)
+    width_s = downsample.choose_level(start, end, pixels) or min(downsample.LEVEL_WIDTHS_S)
+    _, records = downsample.read_level(pyramid_dir, width_s, start, end)
+    timestamps, minimum, maximum, mean, _ = downsample.summarise(records, width_s)
+    times = mdates.date2num(timestamps)
+    axes.set_title(f"{title} ({width_s} s buckets)")
+    axes.set_xlabel('Time')
+    axes.set_ylabel(y_label)
+    for label, color in zip(labels, colors):
+        i = header.index(label) - 1
+        axes.fill_between(times, minimum[i], maximum[i], color=color, alpha=0.3, linewidth=0)
+        axes.plot(times, mean[i], label=label, color=color)
+    axes.legend()
+    figure.autofmt_xdate()
+    axes.xaxis.set_major_formatter(mdates.DateFormatter('%H:%M:%S'))
+
+def plot_recent(
+    path_to_data_folder: str,
+    title: str,
+    y_label: str,
+    labels: list[str],
+    colors: list[str],
+    minutes: float,
+    marker: Optional[str] = None
+):
+    """
+    #### Plot the most recent minutes of samples from the ring buffer of a data folder
+
+    ##### Parameters:
+    - path_to_data_folder: str
+        - path to the data folder
+    - title: str
+        - title of the plot
+    - y_label: str
+        - y axis label
+    - labels: list[str]
+        - names of the channels to plot
+    - colors: list[str]
+        - color of each channel
+    - minutes: float
+        - number of minutes of samples to plot
+    - marker: Optional[str] = None
+        - marker to use for the plot
+
+    ##### Returns:
+    - None
+    """
+    with hotstore.RingReader(path_to_data_folder) as ring_reader:
+        timestamps, _ = ring_reader.tail(1)
+        if len(timestamps) == 0:
+            return
+        timestamps, channels = ring_reader.read(timestamps[-1] - np.timedelta64(int(minutes * 60 * 1_000_000), 'us'))
+        data = [channels[ring_reader.header.index(label) - 1] for label in labels]
+    plot_data(title, 'Time', y_label, timestamps, data, labels, colors, marker)
+
+# number of the most recent samples plotted in live mode, 100 s of 50 Hz high frequency data and 24 hours of 30 s low frequency data
+LIVE_HIGH_FREQ_WINDOW_ROWS = 5000
+LIVE_LOW_FREQ_WINDOW_ROWS = 2880
+
+def live_plot(
+    path_to_hf_data_folder: str,
+    path_to_lf_data_folder: str,
+    pause_time_s: float
+):
+    """
+    #### Follow the running high and low frequency files, plotting the most recent samples
+
+    ##### Parameters:
+    - path_to_hf_data_folder: str
+        - path to high frequency data folder
+    - path_to_lf_data_folder: str
+        - path to low frequency data folder
+    - pause_time_s: float
+        - seconds between refreshes
+
+    ##### Returns:
+    - None
+    """
+    temp_extension = storage.get_backend(os.getenv('STORAGE_BACKEND')).temp_extension
+    hf_path = os.path.join(path_to_hf_data_folder, os.getenv('TEMP_HIGH_FREQ_FILENAME') + temp_extension)
+    lf_path = os.path.join(path_to_lf_data_folder, os.getenv('TEMP_LOW_FREQ_FILENAME') + temp_extension)
+    # the high frequency running file only exists during an event, so only the folder has to exist for it
+    if not os.path.isdir(path_to_hf_data_folder):
+        raise FileNotFoundError(f"The high frequency data folder {path_to_hf_data_folder} does not exist")
+    if not os.path.exists(lf_path):
+        raise FileNotFoundError(f"The running low frequency file {lf_path} does not exist, check STORAGE_BACKEND and TEMP_LOW_FREQ_FILENAME match the web application")
+    plots = [
+        LivePlot(
+            hf_path,
+            "High Frequency Accelerations",
+            "Acceleration (g's)",
+            ["Accelerometer1.X", "Accelerometer1.Y", "Accelerometer1.Z", "Accelerometer2.X", "Accelerometer2.Y", "Accelerometer2.Z"],
+            ['red', 'blue', 'green', 'black', 'orange', 'grey'],
+            LIVE_HIGH_FREQ_WINDOW_ROWS
+        ),
+        LivePlot(
+            lf_path,
+            "Low Frequency Temperature",
+            "Temperature (deg C)",
+            ["Temperature"],
+            ['red'],
+            LIVE_LOW_FREQ_WINDOW_ROWS,
+            marker='*'
+        )
+    ]
+    plt.show(block=False)
+    while plt.get_fignums():
+        for plot in plots:
+            try:
+                plot.refresh()
+            except Exception:
+                pass
+            plot.figure.canvas.flush_events()
+        time.sleep(pause_time_s)
+
 def main():
     """
     #### Main function for plotting script
     """
+    parser = argparse.ArgumentParser(description="Plot the data received by the Python web application")
+    parser.add_argument("--live", action="store_true", help="follow the running files, only reading the new rows on each refresh")
+    parser.add_argument("--history", type=float, metavar="HOURS", help="plot the most recent hours of data from the downsampling pyramid")
+    parser.add_argument("--recent", type=float, metavar="MINUTES", help="plot the most recent minutes of samples from the ring buffers of the web application")
+    args = parser.parse_args()
     # load environment variables
     load_dotenv()
     OUTPUT_DIR = os.getenv('OUTPUT_DIR')
@@ -112,18 +642,51 @@ def main():
     PATH_TO_HF_DATA_FOLDER = os.path.join(OUTPUT_DIR, OUTPUT_FOLDER_HIGH_FREQ)
     PATH_TO_LF_DATA_FOLDER = os.path.join(OUTPUT_DIR, OUTPUT_FOLDER_LOW_FREQ)
     PAUSE_TIME_S = 5
+    LIVE_PAUSE_TIME_S = 1
 
+    if args.history is not None:
+        plot_history(
+            PATH_TO_HF_DATA_FOLDER,
+            "High Frequency Accelerations",
+            "Acceleration (g's)",
+            ["Accelerometer1.X", "Accelerometer1.Y", "Accelerometer1.Z", "Accelerometer2.X", "Accelerometer2.Y", "Accelerometer2.Z"],
+            ['red', 'blue', 'green', 'black', 'orange', 'grey'],
+            args.history
+        )
+        plot_history(PATH_TO_LF_DATA_FOLDER, "Low Frequency Temperature", "Temperature (deg C)", ["Temperature"], ['red'], args.history)
+        plt.show()
+        return
+    if args.live:
+        live_plot(PATH_TO_HF_DATA_FOLDER, PATH_TO_LF_DATA_FOLDER, LIVE_PAUSE_TIME_S)
+        return
     plt.ion()
     plt.show()
     while True:
-        try:
-            plot_high_freq_data(PATH_TO_HF_DATA_FOLDER)
-        except Exception:
-            pass
-        try:
-            plot_low_freq_data(PATH_TO_LF_DATA_FOLDER)
-        except Exception:
-            pass
+        if args.recent is not None:
+            try:
+                plot_recent(
+                    PATH_TO_HF_DATA_FOLDER,
+                    "High Frequency Accelerations",
+                    "Acceleration (g's)",
+                    ["Accelerometer1.X", "Accelerometer1.Y", "Accelerometer1.Z", "Accelerometer2.X", "Accelerometer2.Y", "Accelerometer2.Z"],
+                    ['red', 'blue', 'green', 'black', 'orange', 'grey'],
+                    args.recent
+                )
+            except Exception:
+                pass
+            try:
+                plot_recent(PATH_TO_LF_DATA_FOLDER, "Low Frequency Temperature", "Temperature (deg C)", ["Temperature"], ['red'], args.recent, marker='*')
+            except Exception:
+                pass
+        else:
+            try:
+                plot_high_freq_data(PATH_TO_HF_DATA_FOLDER)
+            except Exception:
+                pass
+            try:
+                plot_low_freq_data(PATH_TO_LF_DATA_FOLDER)
+            except Exception:
+                pass
         plt.pause(PAUSE_TIME_S)
         plt.figure("High Frequency Accelerations").clear()
         plt.figure("Low Frequency Temperature").clear()
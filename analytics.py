@@ -0,0 +1,371 @@
+"""
+Analytics of the high frequency acceleration events, and the catalogue of their results.
+For use with the Python web application for CR1000 data logging.
+
+When an event closes its samples are analysed as whole NumPy arrays, every channel at once, for the peak, RMS,
+crest factor and dominant frequency of each channel and of the vector magnitude of each tri-axial accelerometer.\n
+The results are kept in an sqlite catalogue in the output directory, so events can be filtered and sorted
+without opening any of the event files.
+
+Author: Liam Eime
+Date: 12/12/2023
+"""
+
+# Python imports
+import os
+import sqlite3
+import threading
+import numpy as np
+
+# .py file imports
+import storage
+
+# sort keys of the catalogue query, and the column each sorts by
+SORT_COLUMNS = {
+    "start": "e.start_us",
+    "duration": "e.duration_s",
+    "peak": "peak",
+    "rms": "rms",
+    "crest_factor": "crest_factor",
+    "dominant_freq": "dominant_freq_hz"
+}
+
+def find_accelerometers(header: list[str]):
+    """
+    #### Find the tri-axial accelerometers in a header, from channels named <accelerometer>.X, <accelerometer>.Y and <accelerometer>.Z
+
+    ##### Parameters:
+    - header: list[str]
+        - header of the data, the first column being the timestamp
+
+    ##### Returns:
+    - accelerometers: dict[str, list[int]]
+        - channel index of the X, Y and Z axis of each accelerometer, by accelerometer name
+    """
+    accelerometers = {}
+    for name in dict.fromkeys(channel.rpartition('.')[0] for channel in header[1:]):
+        axes = [f"{name}.{axis}" for axis in ('X', 'Y', 'Z')]
+        if name and all(axis in header for axis in axes):
+            accelerometers[name] = [header.index(axis) - 1 for axis in axes]
+    return accelerometers
+
+def analyse_event(
+    header: list[str],
+    timestamps: np.ndarray,
+    channels: np.ndarray
+):
+    """
+    #### Analyse the samples of an event
+
+    The vector magnitude of each accelerometer is analysed as an extra channel named <accelerometer>.Magnitude.\n
+    Missing values are left out of the peak and RMS, and filled with the channel mean for the FFT.
+
+    ##### Parameters:
+    - header: list[str]
+        - header of the data, the first column being the timestamp
+    - timestamps: np.ndarray
+        - datetime64[us] timestamp of each sample, in time order
+    - channels: np.ndarray
+        - float32 array of shape (number of channels, number of samples)
+
+    ##### Returns:
+    - summary: dict
+        - start_us, end_us, duration_s, num_rows and sample_rate_hz of the event
+    - channel_results: dict[str, dict]
+        - peak, rms, crest_factor and dominant_freq_hz of each channel, by channel name
+    """
+    accelerometers = find_accelerometers(header)
+    names = header[1:] + [f"{name}.Magnitude" for name in accelerometers]
+    if accelerometers:
+        axes = channels[np.concatenate(list(accelerometers.values()))].reshape(len(accelerometers), 3, -1).astype(np.float64)
+        magnitudes = np.sqrt(np.einsum('ijk,ijk->ik', axes, axes))
+        values = np.concatenate((channels.astype(np.float64), magnitudes))
+    else:
+        values = channels.astype(np.float64)
+    microseconds = timestamps.astype(np.int64)
+    duration_s = (microseconds[-1] - microseconds[0]) / 1e6 if len(microseconds) else 0.0
+    sample_period_s = np.median(np.diff(microseconds)) / 1e6 if len(microseconds) > 1 else 0.0
+    sample_rate_hz = 1 / sample_period_s if sample_period_s > 0 else 0.0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        peak = np.nanmax(np.abs(values), axis=1, initial=0.0)
+        rms = np.sqrt(np.nanmean(values * values, axis=1))
+        crest_factor = peak / rms
+        # the dominant frequency is the largest non-zero frequency bin of the spectrum of each channel with its mean removed
+        mean = np.nanmean(values, axis=1, keepdims=True)
+        centred = np.where(np.isnan(values), 0.0, values - mean)
+    if values.shape[1] > 1 and sample_rate_hz > 0:
+        spectrum = np.abs(np.fft.rfft(centred, axis=1))
+        dominant_bin = np.argmax(spectrum[:, 1:], axis=1) + 1
+        dominant_freq_hz = dominant_bin * sample_rate_hz / values.shape[1]
+    else:
+        dominant_freq_hz = np.zeros(len(names))
+    summary = {
+        "start_us": int(microseconds[0]) if len(microseconds) else 0,
+        "end_us": int(microseconds[-1]) if len(microseconds) else 0,
+        "duration_s": float(duration_s),
+        "num_rows": int(len(microseconds)),
+        "sample_rate_hz": float(sample_rate_hz)
+    }
+    channel_results = {
+        name: {
+            "peak": _to_float(peak[i]),
+            "rms": _to_float(rms[i]),
+            "crest_factor": _to_float(crest_factor[i]),
+            "dominant_freq_hz": _to_float(dominant_freq_hz[i])
+        } for i, name in enumerate(names)
+    }
+    return summary, channel_results
+
+def _to_float(value: float):
+    """
+    #### Convert a NumPy value to a float, None if it is not finite
+
+    ##### Parameters:
+    - value: float
+        - value to convert
+
+    ##### Returns:
+    - value: float
+        - the value, None if it is NaN or infinite
+    """
+    return float(value) if np.isfinite(value) else None
+
+class EventCatalogue:
+    """
+    #### Catalogue of the analysed high frequency events
+
+    The events table holds one row for each event file with its time range, duration, number of rows and sample rate,
+    and the event_channels table holds the peak, RMS, crest factor and dominant frequency of each channel of each event.
+    """
+
+    def __init__(self, db_path: str):
+        """
+        #### Open the catalogue, creating it if it does not exist
+
+        ##### Parameters:
+        - db_path: str
+            - path to the sqlite database file
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS events (
+                id INTEGER PRIMARY KEY,
+                folder TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                start_us INTEGER NOT NULL,
+                end_us INTEGER NOT NULL,
+                duration_s REAL NOT NULL,
+                num_rows INTEGER NOT NULL,
+                sample_rate_hz REAL NOT NULL,
+                UNIQUE (folder, filename)
+            );
+            CREATE INDEX IF NOT EXISTS events_by_start ON events (folder, start_us);
+            CREATE TABLE IF NOT EXISTS event_channels (
+                event_id INTEGER NOT NULL REFERENCES events (id) ON DELETE CASCADE,
+                channel TEXT NOT NULL,
+                peak REAL,
+                rms REAL,
+                crest_factor REAL,
+                dominant_freq_hz REAL,
+                PRIMARY KEY (event_id, channel)
+            );
+        """)
+        self._connection.execute("PRAGMA foreign_keys = ON")
+        self._connection.commit()
+
+    def add_event(
+        self,
+        path: str,
+        summary: dict,
+        channel_results: dict[str, dict]
+    ):
+        """
+        #### Add the results of an event to the catalogue, replacing any previous results for it
+
+        ##### Parameters:
+        - path: str
+            - path to the event file
+        - summary: dict
+            - start_us, end_us, duration_s, num_rows and sample_rate_hz of the event
+        - channel_results: dict[str, dict]
+            - peak, rms, crest_factor and dominant_freq_hz of each channel, by channel name
+
+        ##### Returns:
+        - None
+        """
+        folder, filename = os.path.split(path)
+        with self._lock:
+            self._connection.execute("DELETE FROM events WHERE folder = ? AND filename = ?", (folder, filename))
+            event_id = self._connection.execute(
+                "INSERT INTO events (folder, filename, start_us, end_us, duration_s, num_rows, sample_rate_hz) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (folder, filename, summary["start_us"], summary["end_us"], summary["duration_s"], summary["num_rows"], summary["sample_rate_hz"])
+            ).lastrowid
+            self._connection.executemany(
+                "INSERT INTO event_channels VALUES (?, ?, ?, ?, ?, ?)",
+                [(event_id, channel, result["peak"], result["rms"], result["crest_factor"], result["dominant_freq_hz"]) for channel, result in channel_results.items()]
+            )
+            self._connection.commit()
+
+    def analyse_file(self, path: str):
+        """
+        #### Read an event file, analyse it and add the results to the catalogue
+
+        ##### Parameters:
+        - path: str
+            - path to the event file
+
+        ##### Returns:
+        - None
+        """
+        header, timestamps, channels = storage.get_backend_for_path(path).read(path)
+        if len(timestamps) == 0:
+            return
+        self.add_event(path, *analyse_event(header, timestamps, channels))
+
+    def remove_files(self, paths: list[str]):
+        """
+        #### Remove the results of event files replaced by other files, such as events stitched with imported rows
+
+        ##### Parameters:
+        - paths: list[str]
+            - paths to the event files
+
+        ##### Returns:
+        - None
+        """
+        with self._lock:
+            self._connection.executemany("DELETE FROM events WHERE folder = ? AND filename = ?", [os.path.split(path) for path in paths])
+            self._connection.commit()
+
+    def missing_files(
+        self,
+        folder: str,
+        paths: list[str]
+    ):
+        """
+        #### Find the event files of a folder that have not been analysed
+
+        ##### Parameters:
+        - folder: str
+            - folder of the event files
+        - paths: list[str]
+            - paths to the event files in the folder
+
+        ##### Returns:
+        - missing_paths: list[str]
+            - paths to the event files not in the catalogue
+        """
+        with self._lock:
+            analysed = {os.path.join(folder, filename) for filename, in self._connection.execute("SELECT filename FROM events WHERE folder = ?", (folder,))}
+        return [path for path in paths if path not in analysed]
+
+    def find_events(
+        self,
+        folder: str,
+        start_us: int = None,
+        end_us: int = None,
+        channel: str = None,
+        min_peak: float = None,
+        min_rms: float = None,
+        min_duration_s: float = None,
+        max_duration_s: float = None,
+        sort: str = "start",
+        descending: bool = False,
+        limit: int = 100
+    ):
+        """
+        #### Find the events of a folder matching filters, sorted by a result
+
+        The peak, RMS, crest factor and dominant frequency of an event are the highest over its channels,
+        or of the one channel if a channel is given.
+
+        ##### Parameters:
+        - folder: str
+            - folder of the event files
+        - start_us: int = None
+            - only events ending from this time, in epoch micro-seconds, unbounded if None
+        - end_us: int = None
+            - only events starting up to this time, in epoch micro-seconds, unbounded if None
+        - channel: str = None
+            - channel the results are filtered and sorted by, the highest over every channel if None
+        - min_peak: float = None
+            - only events with at least this peak
+        - min_rms: float = None
+            - only events with at least this RMS
+        - min_duration_s: float = None
+            - only events lasting at least this many seconds
+        - max_duration_s: float = None
+            - only events lasting at most this many seconds
+        - sort: str = "start"
+            - one of the keys of SORT_COLUMNS
+        - descending: bool = False
+            - sort from highest to lowest
+        - limit: int = 100
+            - maximum number of events returned
+
+        ##### Returns:
+        - events: list[dict]
+            - path, time range, duration, number of rows, sample rate, the sorted results and the results of each channel of each event
+        """
+        conditions = ["e.folder = ?"]
+        parameters = [folder]
+        for condition, value in (
+            ("e.end_us >= ?", start_us),
+            ("e.start_us <= ?", end_us),
+            ("e.duration_s >= ?", min_duration_s),
+            ("e.duration_s <= ?", max_duration_s)
+        ):
+            if value is not None:
+                conditions.append(condition)
+                parameters.append(value)
+        having = []
+        for condition, value in (("peak >= ?", min_peak), ("rms >= ?", min_rms)):
+            if value is not None:
+                having.append(condition)
+                parameters.append(value)
+        channel_join = "c.event_id = e.id" + (" AND c.channel = ?" if channel is not None else "")
+        sql = (
+            "SELECT e.id, e.folder, e.filename, e.start_us, e.end_us, e.duration_s, e.num_rows, e.sample_rate_hz,"
+            " MAX(c.peak) AS peak, MAX(c.rms) AS rms, MAX(c.crest_factor) AS crest_factor, MAX(c.dominant_freq_hz) AS dominant_freq_hz"
+            f" FROM events e JOIN event_channels c ON {channel_join}"
+            f" WHERE {' AND '.join(conditions)} GROUP BY e.id"
+            + (f" HAVING {' AND '.join(having)}" if having else "")
+            + f" ORDER BY {SORT_COLUMNS[sort]} {'DESC' if descending else 'ASC'}, e.start_us LIMIT ?"
+        )
+        parameters = ([channel] if channel is not None else []) + parameters + [limit]
+        with self._lock:
+            rows = self._connection.execute(sql, parameters).fetchall()
+            ids = [row[0] for row in rows]
+            channel_rows = self._connection.execute(
+                f"SELECT event_id, channel, peak, rms, crest_factor, dominant_freq_hz FROM event_channels WHERE event_id IN ({','.join('?' * len(ids))})",
+                ids
+            ).fetchall()
+        channel_results = {}
+        for event_id, name, peak, rms, crest_factor, dominant_freq_hz in channel_rows:
+            channel_results.setdefault(event_id, {})[name] = {"peak": peak, "rms": rms, "crest_factor": crest_factor, "dominant_freq_hz": dominant_freq_hz}
+        events = [{
+            "path": os.path.join(event_folder, filename),
+            "start_us": event_start_us,
+            "end_us": event_end_us,
+            "duration_s": duration_s,
+            "num_rows": num_rows,
+            "sample_rate_hz": sample_rate_hz,
+            "peak": peak,
+            "rms": rms,
+            "crest_factor": crest_factor,
+            "dominant_freq_hz": dominant_freq_hz,
+            "channels": channel_results.get(event_id, {})
+        } for event_id, event_folder, filename, event_start_us, event_end_us, duration_s, num_rows, sample_rate_hz, peak, rms, crest_factor, dominant_freq_hz in rows]
+        return events
+
+    def close(self):
+        """
+        #### Close the catalogue database
+
+        ##### Returns:
+        - None
+        """
+        with self._lock:
+            self._connection.close()
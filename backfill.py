@@ -0,0 +1,540 @@
+"""
+Bulk import of the table files downloaded from the logger, to backfill the data missed while the network was down.
+For use with the Python web application for CR1000 data logging.
+
+When a HTTPPost fails the CR1000 keeps the records in its LowFreq and HighFreqAccel tables, which are downloaded later as TOA5 or csv table files.
+A table file is parsed in chunks of CHUNK_BYTES with the vectorised payload parser, so memory stays bounded for any size of file.
+Each chunk is sorted, rows with the timestamp of a row already stored are dropped,
+and the rest are written directly to timestamped output files and added to the file index.\n
+Rows after the final sample of the running file are written by the writer of the stream, the same way as the rows posted by the logger.
+Low frequency rows within the time range of an existing file are merged into it, the other rows are written to files of max_rows rows.
+Rows within the time range of an archive are written to new files, which the compactor merges into the archive.
+High frequency rows are stitched into events with each other and with the existing events they continue within the scan rate,
+so the event files are the same as if the bursts had been posted live.
+The gaps of the coverage map the imported rows fall within are split or removed.\n
+Table files are imported through the POST /import/{stream} endpoint of the running web application, so the loggers can keep posting,
+either directly or by running this file:
+    python backfill.py "CR1000_LowFreq.dat" --url http://127.0.0.1:8000
+
+Author: Liam Eime
+Date: 12/12/2023
+"""
+
+# Python imports
+import os
+import json
+import time
+import numpy as np
+from itertools import repeat
+
+# .py file imports
+import payload
+import storage
+import files
+import index
+import timestamp
+import writers
+import downsample
+
+# bytes of a table file parsed at a time
+CHUNK_BYTES = 8 * 1024 * 1024
+
+# number of header lines of a TOA5 file, the file details, then the name, units and processing of each column
+TOA5_HEADER_LINES = 4
+
+# stream of each table of the CRBasic program, named in the first header line of a TOA5 file
+TABLE_STREAMS = {"LowFreq": "low", "HighFreqAccel": "high"}
+
+# the record number column the logger tables have after the timestamp, which is not stored
+RECORD_COLUMN = b"RECORD"
+
+def remove_record_field(chunk: bytes):
+    """
+    #### Remove the second field, the record number, from each row of a chunk
+
+    Rows with fewer than three fields are left as they are, to be dropped as malformed rows.
+
+    ##### Parameters:
+    - chunk: bytes
+        - rows separated by \\n
+
+    ##### Returns:
+    - chunk: bytes
+        - the rows without their record numbers
+    """
+    rows = map(bytes.split, chunk.split(b'\n'), repeat(b','), repeat(2))
+    return b'\n'.join([fields[0] + b',' + fields[2] if len(fields) == 3 else b','.join(fields) for fields in rows])
+
+class TableReader:
+    """
+    #### Incremental parser of a TOA5 or csv table file, fed the bytes of the file as they arrive
+
+    The header lines of a TOA5 file, or the column names of a csv file, are skipped,
+    and the record number column is removed if the file has one.
+    """
+
+    def __init__(
+        self,
+        header: list[str],
+        chunk_bytes: int = CHUNK_BYTES
+    ):
+        """
+        #### Create the reader
+
+        ##### Parameters:
+        - header: list[str]
+            - header of the data, the table must have the same columns after the record number
+        - chunk_bytes: int = CHUNK_BYTES
+            - bytes held before they are parsed
+        """
+        self.header = header
+        self.chunk_bytes = chunk_bytes
+        self.table_name = None
+        self._buffer = bytearray()
+        self._has_record_column = None
+
+    def feed(self, data: bytes):
+        """
+        #### Add the next bytes of the file, parsing the complete rows once chunk_bytes are held
+
+        ##### Parameters:
+        - data: bytes
+            - the next bytes of the file
+
+        ##### Returns:
+        - batch: payload.DataBatch
+            - parsed rows, None if not enough bytes are held yet
+        """
+        self._buffer += data
+        if len(self._buffer) < self.chunk_bytes:
+            return None
+        end = self._buffer.rfind(b'\n') + 1
+        if end == 0:
+            return None
+        chunk = bytes(self._buffer[:end])
+        del self._buffer[:end]
+        return self._parse(chunk)
+
+    def close(self):
+        """
+        #### Parse the rows left at the end of the file
+
+        ##### Returns:
+        - batch: payload.DataBatch
+            - parsed rows
+        """
+        chunk = bytes(self._buffer)
+        self._buffer.clear()
+        return self._parse(chunk)
+
+    def _parse(self, chunk: bytes):
+        """
+        #### Parse a chunk of complete rows, skipping the header lines if it is the first chunk
+
+        ##### Returns:
+        - batch: payload.DataBatch
+            - parsed rows
+        """
+        if self._has_record_column is None:
+            chunk = self._skip_header(chunk)
+        if self._has_record_column:
+            chunk = remove_record_field(chunk)
+        return payload.parse_payload(chunk, self.header)
+
+    def _skip_header(self, chunk: bytes):
+        """
+        #### Skip the header lines at the start of the file, finding from them, or from the first row, whether the rows have a record number
+
+        ##### Returns:
+        - chunk: bytes
+            - the chunk without the header lines
+        """
+        lines = chunk.split(b'\n', TOA5_HEADER_LINES)
+        fields = [line.translate(None, b'"\r').split(b',') for line in lines[:TOA5_HEADER_LINES]]
+        column_names = None
+        num_header_lines = 0
+        if fields[0][0] == b"TOA5":
+            self.table_name = fields[0][-1].decode(errors='replace')
+            column_names = fields[1] if len(fields) > 1 else []
+            num_header_lines = TOA5_HEADER_LINES
+        elif fields[0][0] and not fields[0][0][:1].isdigit():
+            column_names = fields[0]
+            num_header_lines = 1
+        if column_names is not None:
+            self._has_record_column = len(column_names) > 1 and column_names[1].strip().upper() == RECORD_COLUMN
+        else:
+            self._has_record_column = len(fields[0]) == len(self.header) + 1
+        return b'\n'.join(lines[num_header_lines:])
+
+class Importer:
+    """
+    #### Importer of the parsed chunks of a table file into the output folder of a stream
+
+    Only used from the writer thread of the stream, so the running file is not written to while rows are merged into it.\n
+    The rows after the last file written from a chunk are held until the next chunk, as the next chunk may continue them.
+    """
+
+    def __init__(
+        self,
+        writer: writers.DataFileWriter,
+        max_rows: int = 0,
+        max_gap_us: int = 0,
+        pyramid: downsample.Pyramid = None,
+        sync: bool = False
+    ):
+        """
+        #### Create the importer
+
+        ##### Parameters:
+        - writer: writers.DataFileWriter
+            - writer of the stream, its running file, file index, folder, filenames and backend are used
+        - max_rows: int = 0
+            - number of rows written to each new low frequency file
+        - max_gap_us: int = 0
+            - for high frequency data, the maximum time between rows, in micro-seconds, for them to be stitched into one event
+        - pyramid: downsample.Pyramid = None
+            - downsampling pyramid updated with the imported rows, not updated if None
+        - sync: bool = False
+            - flush each file written and its directory to disk before the files it replaces are deleted
+        """
+        self.writer = writer
+        self.max_rows = max_rows
+        self.max_gap_us = max_gap_us
+        self.pyramid = pyramid
+        self.sync = sync
+        self.num_rows_read = 0
+        self.num_malformed = 0
+        self.num_duplicates = 0
+        self.num_rows_imported = 0
+        self.written_paths = []
+        self.replaced_paths = []
+        self._pending = None
+        self._imported = []
+
+    def add(self, batch: payload.DataBatch):
+        """
+        #### Import a parsed chunk of the table file
+
+        ##### Parameters:
+        - batch: payload.DataBatch
+            - parsed rows, in any order
+
+        ##### Returns:
+        - completed_paths: list[str]
+            - paths to the files written or rewritten
+        """
+        self.num_rows_read += batch.num_rows
+        self.num_malformed += batch.num_malformed
+        if self._pending is not None:
+            batch = payload.merge_batches([self._pending, batch])
+            self._pending = None
+        completed_paths = self._import(batch, is_last=False)
+        self._record_imported()
+        return completed_paths
+
+    def close(self):
+        """
+        #### Import the rows held from the last chunk
+
+        ##### Returns:
+        - completed_paths: list[str]
+            - paths to the files written or rewritten
+        """
+        batch, self._pending = self._pending, None
+        if batch is None:
+            return []
+        completed_paths = self._import(batch, is_last=True)
+        self._record_imported()
+        return completed_paths
+
+    def summary(self):
+        """
+        #### Get the counts of the rows imported
+
+        ##### Returns:
+        - summary: dict
+            - rows read, malformed rows dropped, duplicate rows dropped, rows imported, and the number of files written and replaced
+        """
+        return {
+            "rows_read": self.num_rows_read,
+            "malformed_rows": self.num_malformed,
+            "duplicate_rows": self.num_duplicates,
+            "rows_imported": self.num_rows_imported,
+            "files_written": len(set(self.written_paths)),
+            "files_replaced": len(set(self.replaced_paths) - set(self.written_paths))
+        }
+
+    def _record_imported(self):
+        """
+        #### Add the rows imported from a chunk to the downsampling pyramid in one update, rather than one update for each file written,
+        and fill the gaps of the coverage map they were imported into
+        """
+        imported, self._imported = self._imported, []
+        if not imported:
+            return
+        timestamps = np.concatenate([batch.timestamps for batch in imported])
+        if self.pyramid is not None:
+            self.pyramid.update(timestamps, np.concatenate([batch.channels for batch in imported], axis=1))
+        if self.writer.continuity_tracker is not None:
+            self.writer.continuity_tracker.fill(timestamps.astype(np.int64))
+
+    def _import(
+        self,
+        batch: payload.DataBatch,
+        is_last: bool
+    ):
+        """
+        #### Sort a chunk, drop the rows already stored and write the rest
+        """
+        if batch.num_rows == 0:
+            return []
+        if np.any(batch.timestamps[1:] < batch.timestamps[:-1]):
+            batch = batch.take(np.argsort(batch.timestamps, kind='stable'))
+        microseconds = batch.timestamps.astype(np.int64)
+        is_new = np.r_[True, microseconds[1:] != microseconds[:-1]]
+        existing = self._read_existing(int(microseconds[0]) - self.max_gap_us, int(microseconds[-1]) + self.max_gap_us)
+        if existing:
+            is_new &= ~np.isin(microseconds, np.concatenate([existing_batch.timestamps.astype(np.int64) for existing_batch in existing.values()]))
+        self.num_duplicates += int(np.count_nonzero(~is_new))
+        if not np.all(is_new):
+            batch = batch.take(np.flatnonzero(is_new))
+        if batch.num_rows == 0:
+            return []
+        completed_paths = []
+        if self.writer.num_rows > 0 and batch.timestamps[-1] > np.datetime64(self.writer.final_us, 'us'):
+            # rows after the running file are written the same way as the rows posted by the logger
+            newer = int(np.searchsorted(batch.timestamps.astype(np.int64), self.writer.final_us, side='right'))
+            completed_paths.extend(self._write_newer(batch.slice(newer, batch.num_rows)))
+            batch = batch.slice(0, newer)
+            if batch.num_rows == 0:
+                return completed_paths
+        # archives are only used to find duplicates, rows within their time range are written to new files for the compactor to merge
+        existing = {path: existing_batch for path, existing_batch in existing.items() if not files.is_archive(path)}
+        if self.max_gap_us:
+            completed_paths.extend(self._import_events(batch, existing, is_last))
+        else:
+            completed_paths.extend(self._import_rows(batch, existing, is_last))
+        return completed_paths
+
+    def _write_newer(self, batch: payload.DataBatch):
+        """
+        #### Write rows after the final sample of the running file with the writer, one event at a time for the high frequency data
+
+        ##### Returns:
+        - completed_paths: list[str]
+            - paths to the files the running file was rolled over to
+        """
+        if self.max_gap_us:
+            event_starts = np.flatnonzero(np.diff(batch.timestamps.astype(np.int64)) > self.max_gap_us) + 1
+            events = [batch.slice(first, last) for first, last in zip(np.r_[0, event_starts], np.r_[event_starts, batch.num_rows])]
+        else:
+            events = [batch]
+        completed_paths = []
+        for event in events:
+            completed_paths.extend(self.writer.write(event))
+        self.written_paths.extend(completed_paths)
+        self.num_rows_imported += batch.num_rows
+        self._imported.append(batch)
+        return completed_paths
+
+    def _read_existing(
+        self,
+        start_us: int,
+        end_us: int
+    ):
+        """
+        #### Read the stored files, including the running file, overlapping a time range
+
+        ##### Returns:
+        - existing: dict[str, payload.DataBatch]
+            - samples of each file by path, in time order of the files
+        """
+        existing = {}
+        for path in self.writer.file_index.find_files(self.writer.dir, np.datetime64(start_us, 'us'), np.datetime64(end_us, 'us')):
+            try:  # try read the file, it may have been removed by retention
+                existing_batch = storage.get_backend_for_path(path).read_batch(path)
+            except FileNotFoundError:
+                continue
+            if existing_batch.header == self.writer.header and existing_batch.num_rows > 0:
+                existing[path] = existing_batch
+        if self.writer.num_rows > 0 and self.writer.initial_us <= end_us and self.writer.final_us >= start_us:
+            self.writer.flush()
+            existing[self.writer.temp_path] = self.writer.backend.read_batch(self.writer.temp_path)
+        return existing
+
+    def _import_rows(
+        self,
+        batch: payload.DataBatch,
+        existing: dict[str, payload.DataBatch],
+        is_last: bool
+    ):
+        """
+        #### Merge the low frequency rows within the time range of a stored file into it, and write the others to files of max_rows rows
+
+        The rows between two stored files are never written to the same file, so the files do not overlap.
+        """
+        microseconds = batch.timestamps.astype(np.int64)
+        file_starts = np.sort([timestamp.to_microseconds(existing_batch.timestamps[0]) for existing_batch in existing.values()]).astype(np.int64)
+        is_merged = np.zeros(batch.num_rows, dtype=bool)
+        completed_paths = []
+        for path, existing_batch in list(existing.items()):
+            first = np.searchsorted(microseconds, timestamp.to_microseconds(existing_batch.timestamps[0]), side='left')
+            last = np.searchsorted(microseconds, timestamp.to_microseconds(existing_batch.timestamps[-1]), side='right')
+            indices = np.arange(first, last)[~is_merged[first:last]]
+            if len(indices):
+                is_merged[indices] = True
+                completed_paths.extend(self._write_group(batch.take(indices), [path], existing))
+        free = np.flatnonzero(~is_merged)
+        if len(free) == 0:
+            return completed_paths
+        # rows between the same two stored files are in the same gap
+        gaps = np.searchsorted(file_starts, microseconds[free], side='right')
+        for run in np.split(free, np.flatnonzero(np.diff(gaps)) + 1):
+            for first in range(0, len(run), self.max_rows):
+                indices = run[first:first + self.max_rows]
+                if not is_last and len(indices) < self.max_rows and indices[-1] == batch.num_rows - 1:
+                    self._pending = batch.take(indices)
+                    continue
+                completed_paths.extend(self._write_group(batch.take(indices), [], existing))
+        return completed_paths
+
+    def _import_events(
+        self,
+        batch: payload.DataBatch,
+        existing: dict[str, payload.DataBatch],
+        is_last: bool
+    ):
+        """
+        #### Stitch the high frequency rows into events with each other and with the stored events they continue, and write each event
+        """
+        paths = list(existing)
+        # label each row by its index, and each row of a stored event by the number of rows plus the index of the event
+        microseconds = np.concatenate([batch.timestamps.astype(np.int64)] + [existing[path].timestamps.astype(np.int64) for path in paths])
+        labels = np.concatenate([np.arange(batch.num_rows)] + [np.full(existing[path].num_rows, batch.num_rows + i) for i, path in enumerate(paths)])
+        order = np.argsort(microseconds, kind='stable')
+        microseconds, labels = microseconds[order], labels[order]
+        bounds = np.r_[np.flatnonzero(np.r_[True, np.diff(microseconds) > self.max_gap_us]), len(microseconds)]
+        completed_paths = []
+        for event_number, (first, last) in enumerate(zip(bounds[:-1], bounds[1:])):
+            event_labels = labels[first:last]
+            indices = np.sort(event_labels[event_labels < batch.num_rows])
+            if len(indices) == 0:
+                continue
+            if not is_last and event_number == len(bounds) - 2:
+                self._pending = batch.take(indices)
+                continue
+            event_paths = [paths[i - batch.num_rows] for i in np.unique(event_labels[event_labels >= batch.num_rows])]
+            completed_paths.extend(self._write_group(batch.take(indices), event_paths, existing))
+        return completed_paths
+
+    def _write_group(
+        self,
+        batch: payload.DataBatch,
+        paths: list[str],
+        existing: dict[str, payload.DataBatch]
+    ):
+        """
+        #### Merge rows with stored files into one file, replacing the stored files
+
+        Rows merged with the running file are inserted into it.
+
+        ##### Returns:
+        - completed_paths: list[str]
+            - path to the file written, or to the file the running file was rolled over to, if any
+        """
+        writer = self.writer
+        stored_paths = [path for path in paths if path != writer.temp_path]
+        merged = payload.merge_batches([existing[path] for path in stored_paths] + [batch])
+        completed_paths = []
+        if writer.temp_path in paths:
+            writer.insert(merged)
+            self._remove_replaced(stored_paths)
+            if self.max_rows and writer.num_rows >= self.max_rows:
+                completed_paths.append(writer.roll_over())
+        else:
+            path = files.create_timestamped_filepath(
+                timestamp.format_microseconds(timestamp.to_microseconds(merged.timestamps[0])),
+                timestamp.format_microseconds(timestamp.to_microseconds(merged.timestamps[-1])),
+                writer.output_filename,
+                writer.dir,
+                writer.backend.extension
+            )
+            mtimes = [os.path.getmtime(stored_path) for stored_path in stored_paths if os.path.exists(stored_path)]
+            writer.backend.write_batch(path, merged, self.sync)
+            # age the file by its data for the retention limits, rather than by when it was imported,
+            # keeping the time the newest replaced file was written, or else the time of its final sample
+            mtime = max(mtimes) if mtimes else min(timestamp.to_microseconds(merged.timestamps[-1]) / 1_000_000, time.time())
+            os.utime(path, (mtime, mtime))
+            channel_min, channel_max = index.channel_range(merged.channels)
+            writer.file_index.add_file(path, writer.header, merged.timestamps[0], merged.timestamps[-1], merged.num_rows, channel_min, channel_max)
+            self._remove_replaced([stored_path for stored_path in stored_paths if stored_path != path])
+            self.written_paths.append(path)
+            completed_paths.append(path)
+        for stored_path in stored_paths:
+            existing.pop(stored_path)
+        self.replaced_paths.extend(stored_paths)
+        self.num_rows_imported += batch.num_rows
+        self._imported.append(batch)
+        return completed_paths
+
+    def _remove_replaced(self, replaced_paths: list[str]):
+        """
+        #### Remove the stored files merged into another file from the file index and delete them
+        """
+        if not replaced_paths:
+            return
+        self.writer.file_index.remove_files(replaced_paths)
+        for replaced_path in replaced_paths:
+            try:  # try delete the replaced file, it may already have been removed
+                os.remove(replaced_path)
+            except FileNotFoundError:
+                pass
+
+def find_stream(path: str):
+    """
+    #### Find the stream of a TOA5 table file from the table name in its first header line
+
+    ##### Parameters:
+    - path: str
+        - path to the table file
+
+    ##### Returns:
+    - stream: str
+        - either low or high, None if the file is not a TOA5 file of a known table
+    """
+    with open(path, 'rb') as f:
+        fields = f.readline().translate(None, b'"\r\n').decode(errors='replace').split(',')
+    if fields[0] != "TOA5":
+        return None
+    return TABLE_STREAMS.get(fields[-1])
+
+def main():
+    """
+    #### Import table files through the POST /import/{stream} endpoint of the running web application
+    """
+    # only the command line needs these, so the web application does not import them
+    import argparse
+    import urllib.parse
+    import urllib.request
+    parser = argparse.ArgumentParser(description="Import TOA5 or csv table files downloaded from the logger into the running web application")
+    parser.add_argument("paths", nargs="+", help="table files to import")
+    parser.add_argument("--stream", choices=("low", "high"), help="stream of the tables, found from the table name of TOA5 files if not given")
+    parser.add_argument("--logger", default="", help="logger id, the default logger if not given")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="address of the web application")
+    args = parser.parse_args()
+    for path in args.paths:
+        stream = args.stream or find_stream(path)
+        if stream is None:
+            parser.error(f"The stream of {path} could not be found from its table name, give it with --stream")
+        url = f"{args.url.rstrip('/')}/import/{stream}?{urllib.parse.urlencode({'logger': args.logger})}"
+        start = time.perf_counter()
+        with open(path, 'rb') as f:
+            request = urllib.request.Request(url, data=f, method="POST", headers={"Content-Type": "text/csv", "Content-Length": str(os.path.getsize(path))})
+            with urllib.request.urlopen(request) as response:
+                summary = json.load(response)
+        print(f"{path}: imported {summary['rows_imported']} of {summary['rows_read']} rows in {time.perf_counter() - start:.1f} s, "
+              f"{summary['duplicate_rows']} duplicate and {summary['malformed_rows']} malformed rows dropped, "
+              f"{summary['files_written']} files written and {summary['files_replaced']} replaced")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+Microbenchmark for analysing the high frequency acceleration events.
+Times analytics.analyse_event on events of 1k to 30k rows, 30k rows being a 10 minute event sampled every 20 ms.
+
+Run from the repository folder:
+    python benchmarks/analytics_bench.py
+
+Author: Liam Eime
+Date: 12/12/2023
+"""
+
+# import libraries
+import numpy as np
+import timeit
+import json
+import os
+import sys
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+import analytics
+
+HIGH_FREQ_HEADER = ["Timestamp", "Accelerometer1.X", "Accelerometer1.Y", "Accelerometer1.Z", "Accelerometer2.X", "Accelerometer2.Y", "Accelerometer2.Z"]
+EVENT_SIZES = [1_000, 10_000, 30_000]
+
+def make_event(num_rows: int):
+    """
+    #### Make the samples of a high frequency event, sampled every 20 ms
+
+    ##### Parameters:
+    - num_rows: int
+        - number of rows in the event
+
+    ##### Returns:
+    - timestamps: np.ndarray
+        - datetime64[us] timestamp of each sample
+    - channels: np.ndarray
+        - float32 array of shape (6, number of rows)
+    """
+    rng = np.random.default_rng(0)
+    timestamps = np.datetime64('2023-12-12T11:00:00', 'us') + np.arange(num_rows) * np.timedelta64(20_000, 'us')
+    channels = rng.normal(0, 0.05, (6, num_rows)).astype(np.float32)
+    return timestamps, channels
+
+def main():
+    """
+    #### Main function for the analytics benchmark
+    """
+    results = []
+    for num_rows in EVENT_SIZES:
+        timestamps, channels = make_event(num_rows)
+        number = max(1, 100_000 // num_rows)
+        best = min(timeit.repeat(lambda: analytics.analyse_event(HIGH_FREQ_HEADER, timestamps, channels), number=number, repeat=5)) / number
+        results.append({"rows": num_rows, "analyse_ms": round(best * 1000, 3)})
+        print("%7d rows: %8.2f ms" % (num_rows, best * 1000))
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+"""
+Benchmark for importing a month of logger table files through POST /import/{stream}.
+Tables are generated in the TOA5 format downloaded from the logger, from LOW_FREQ_HEADER and HIGH_FREQ_HEADER in .env.
+
+The scenarios are:
+    - low: a month of low frequency samples, 30 s apart
+    - high: a month of high frequency events of EVENT_ROWS rows, one each hour
+Each table is imported into an empty output folder, then imported again, when every row is a duplicate of a stored row.
+The seconds, rows/sec and files written of each import are printed and saved as json.
+
+The app is run in-process through its ASGI interface, with the settings in .env, overridden by environment variables,
+and the output written to a temporary folder.
+Run from the repository folder:
+    python benchmarks/backfill_bench.py --days 30 --output backfill.json
+
+Author: Liam Eime
+Date: 12/12/2023
+"""
+
+# import libraries
+import numpy as np
+import argparse
+import tempfile
+import asyncio
+import logging
+import shutil
+import httpx
+import time
+import json
+import os
+import sys
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+import main
+
+LOW_FREQ_INTERVAL_US = 30_000_000
+EVENT_ROWS = 500
+START_TIME = np.datetime64('2023-12-12T00:00:00', 'us')
+
+def make_table(
+    table_name: str,
+    header: list[str],
+    timestamps: np.ndarray,
+    unit: str
+):
+    """
+    #### Make a TOA5 table file as downloaded from the CR1000 logger
+
+    ##### Parameters:
+    - table_name: str
+        - name of the table in the logger program
+    - header: list[str]
+        - header of the data, the timestamp followed by the channels
+    - timestamps: np.ndarray
+        - datetime64[us] timestamp of each row
+    - unit: str
+        - datetime unit the timestamps are formatted to, s for low frequency and ms for high frequency
+
+    ##### Returns:
+    - raw_bytes: bytes
+        - table file bytes
+    """
+    rng = np.random.default_rng(0)
+    columns = ["TIMESTAMP", "RECORD"] + header[1:]
+    toa5_header = [
+        f'"TOA5","CR1000","CR1000","1","CR1000.Std.32","CPU:bench.CR1","1","{table_name}"',
+        ",".join(f'"{column}"' for column in columns),
+        '"TS","RN"' + ',""' * (len(header) - 1),
+        '"",""' + ',"Smp"' * (len(header) - 1)
+    ]
+    lines = np.char.add(np.char.add('"', np.char.replace(np.datetime_as_string(timestamps, unit=unit), 'T', ' ')), '"')
+    lines = np.char.add(np.char.add(lines, ','), np.arange(len(timestamps)).astype(str))
+    values = np.char.mod('%.5g', rng.normal(0, 0.05, (len(header) - 1, len(timestamps))).astype(np.float32))
+    for column in values:
+        lines = np.char.add(np.char.add(lines, ','), column)
+    return ('\r\n'.join(toa5_header + lines.tolist()) + '\r\n').encode()
+
+def make_scenarios(days: int):
+    """
+    #### Make the stream and table file of each scenario
+
+    ##### Parameters:
+    - days: int
+        - days of data in each table
+
+    ##### Returns:
+    - scenarios: dict[str, tuple[str, bytes]]
+        - the stream and the table file bytes, by scenario name
+    """
+    settings = main.get_settings()
+    num_samples = days * 24 * 60 * 60 * 1_000_000 // LOW_FREQ_INTERVAL_US
+    low_timestamps = START_TIME + np.arange(num_samples) * np.timedelta64(LOW_FREQ_INTERVAL_US, 'us')
+    event_starts = START_TIME + np.arange(days * 24) * np.timedelta64(1, 'h')
+    high_timestamps = (event_starts[:, None] + np.arange(EVENT_ROWS) * np.timedelta64(settings.scan_rate_micro_s, 'us')).ravel()
+    return {
+        "low": ("low", make_table("LowFreq", json.loads(settings.low_freq_header), low_timestamps, 's')),
+        "high": ("high", make_table("HighFreqAccel", json.loads(settings.high_freq_header), high_timestamps, 'ms'))
+    }
+
+async def import_twice(
+    stream: str,
+    raw_bytes: bytes
+):
+    """
+    #### Import a table into the app in-process, then import it again
+
+    ##### Returns:
+    - imports: list[tuple[float, dict]]
+        - seconds taken and summary of each import
+    """
+    imports = []
+    async with main.lifespan(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            for _ in range(2):
+                start = time.perf_counter()
+                response = await client.post(f"/import/{stream}", content=raw_bytes)
+                elapsed = time.perf_counter() - start
+                response.raise_for_status()
+                imports.append((elapsed, response.json()))
+    return imports
+
+def run_scenario(
+    name: str,
+    stream: str,
+    raw_bytes: bytes
+):
+    """
+    #### Run a scenario in an empty output folder
+
+    ##### Returns:
+    - results: list[dict]
+        - the measurements of the first import and of the import of the duplicates
+    """
+    output_dir = tempfile.mkdtemp(prefix="backfill_bench_")
+    os.environ["OUTPUT_DIR"] = output_dir
+    main.get_settings.cache_clear()
+    try:  # try run the scenario, always removing the output folder
+        imports = asyncio.run(import_twice(stream, raw_bytes))
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+    results = []
+    for run, (elapsed, summary) in zip(("import", "duplicates"), imports):
+        results.append({
+            "scenario": name,
+            "run": run,
+            "rows": summary["rows_read"],
+            "table_bytes": len(raw_bytes),
+            "seconds": round(elapsed, 4),
+            "rows_per_s": round(summary["rows_read"] / elapsed, 1),
+            "rows_imported": summary["rows_imported"],
+            "files_written": summary["files_written"]
+        })
+    return results
+
+def main_bench():
+    """
+    #### Main function for the backfill benchmark
+    """
+    parser = argparse.ArgumentParser(description="Benchmark importing a month of logger table files")
+    parser.add_argument("--days", type=int, default=30, help="days of data in each table")
+    parser.add_argument("--output", help="path to save the results to as json")
+    args = parser.parse_args()
+    logging.getLogger("main").setLevel(logging.WARNING)
+
+    results = []
+    for name, (stream, raw_bytes) in make_scenarios(args.days).items():
+        for result in run_scenario(name, stream, raw_bytes):
+            results.append(result)
+            print("%-5s %-10s %8d rows %8.2f s %10.0f rows/s %6d files written" % (
+                result["scenario"],
+                result["run"],
+                result["rows"],
+                result["seconds"],
+                result["rows_per_s"],
+                result["files_written"]
+            ))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"days": args.days, "results": results}, f, indent=2)
+
+if __name__ == '__main__':
+    main_bench()
@@ -0,0 +1,385 @@
+"""
+End to end ingest benchmark, with simulated CR1000 loggers posting to the upload endpoints.
+Payloads are generated from LOW_FREQ_HEADER and HIGH_FREQ_HEADER in .env, in the format sent by HTTPPost in the CRBasic program.
+
+Each simulated logger posts its requests one after another under its own logger id, with every logger posting at once.
+The scenarios are:
+    - low: single low frequency samples, 30 s apart
+    - high_event: bursts continuing one high frequency event, appended to the open event file
+    - high_burst_N: separate high frequency events of N rows, for N of 1 to 100k
+
+The app is run in-process through its ASGI interface, and over localhost in a Uvicorn server process.
+For each scenario the requests/sec, p50 and p99 latency, bytes of data files written
+and read and write syscalls of the server for each request are printed and saved as json,
+so the results of two commits can be compared with --compare.
+Syscalls are counted from /proc/<pid>/io, so are only reported on Linux, and include the client in-process.
+
+The settings in .env are used, overridden by environment variables, with the output written to a temporary folder.
+Run from the repository folder:
+    python benchmarks/ingest_bench.py --loggers 4 --output ingest.json
+    DURABILITY_MODE=batch python benchmarks/ingest_bench.py --compare ingest.json
+
+Author: Liam Eime
+Date: 12/12/2023
+"""
+
+# import libraries
+import numpy as np
+import subprocess
+import argparse
+import tempfile
+import asyncio
+import logging
+import socket
+import shutil
+import httpx
+import time
+import json
+import os
+import sys
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+import main
+
+BURST_SIZES = [1, 1_000, 10_000, 100_000]
+# rows each logger sends in the high_burst scenarios, so the large bursts are only sent a few times
+BURST_ROWS_PER_LOGGER = 200_000
+LOW_FREQ_INTERVAL_US = 30_000_000
+START_TIME = np.datetime64('2023-12-12T00:00:00', 'us')
+
+def make_payload(
+    timestamps: np.ndarray,
+    num_channels: int,
+    rng: np.random.Generator,
+    unit: str
+):
+    """
+    #### Make a payload as sent by the CR1000 logger
+
+    ##### Parameters:
+    - timestamps: np.ndarray
+        - datetime64[us] timestamp of each row
+    - num_channels: int
+        - number of channels after the timestamp
+    - rng: np.random.Generator
+        - generator of the channel values
+    - unit: str
+        - datetime unit the timestamps are formatted to, s for low frequency and ms for high frequency
+
+    ##### Returns:
+    - raw_bytes: bytes
+        - payload bytes
+    """
+    lines = np.char.add(np.char.add('"', np.char.replace(np.datetime_as_string(timestamps, unit=unit), 'T', ' ')), '"')
+    values = np.char.mod('%.5g', rng.normal(0, 0.05, (num_channels, len(timestamps))).astype(np.float32))
+    for column in values:
+        lines = np.char.add(np.char.add(lines, ','), column)
+    return ('\r\n'.join(lines.tolist()) + '\r\n').encode()
+
+def make_scenarios(
+    num_requests: int,
+    event_rows: int
+):
+    """
+    #### Make the path and payloads each logger sends for each scenario
+
+    ##### Parameters:
+    - num_requests: int
+        - number of requests each logger sends in the low and high_event scenarios
+    - event_rows: int
+        - number of rows of each burst in the high_event scenario
+
+    ##### Returns:
+    - scenarios: dict[str, tuple[str, list[bytes]]]
+        - the upload path and the payloads of each request, by scenario name
+    """
+    settings = main.get_settings()
+    low_freq_channels = len(json.loads(settings.low_freq_header)) - 1
+    high_freq_channels = len(json.loads(settings.high_freq_header)) - 1
+    scan_rate_us = settings.scan_rate_micro_s
+    rng = np.random.default_rng(0)
+    scenarios = {}
+    scenarios["low"] = ("uploadLowFreq", [
+        make_payload(START_TIME + np.array([i * LOW_FREQ_INTERVAL_US], dtype='timedelta64[us]'), low_freq_channels, rng, 's')
+        for i in range(num_requests)
+    ])
+    # each burst starts one scan after the final row of the previous burst, so it continues the open event
+    scenarios["high_event"] = ("uploadHighFreqAccel", [
+        make_payload(START_TIME + (i * event_rows + np.arange(event_rows)) * np.timedelta64(scan_rate_us, 'us'), high_freq_channels, rng, 'ms')
+        for i in range(num_requests)
+    ])
+    for num_rows in BURST_SIZES:
+        # an hour between bursts, so each burst is its own event
+        scenarios[f"high_burst_{num_rows}"] = ("uploadHighFreqAccel", [
+            make_payload(START_TIME + np.timedelta64(i, 'h') + np.arange(num_rows) * np.timedelta64(scan_rate_us, 'us'), high_freq_channels, rng, 'ms')
+            for i in range(max(2, min(num_requests, BURST_ROWS_PER_LOGGER // num_rows)))
+        ])
+    return scenarios
+
+def count_syscalls(pid: int):
+    """
+    #### Get the number of read and write syscalls made by a process
+
+    ##### Parameters:
+    - pid: int
+        - id of the process
+
+    ##### Returns:
+    - num_syscalls: int
+        - number of read and write syscalls, None if they are not counted on this platform
+    """
+    try:  # try read the io counters, only available on Linux
+        with open(f"/proc/{pid}/io") as f:
+            counters = dict(line.split(": ") for line in f.read().splitlines())
+    except OSError:
+        return None
+    return int(counters["syscr"]) + int(counters["syscw"])
+
+def folder_size(dir: str):
+    """
+    #### Get the total size of the files in a folder and its subfolders
+
+    ##### Returns:
+    - num_bytes: int
+        - total size in bytes
+    """
+    return sum(os.path.getsize(os.path.join(root, filename)) for root, _, filenames in os.walk(dir) for filename in filenames)
+
+async def send_requests(
+    client: httpx.AsyncClient,
+    path: str,
+    logger_ids: list[str],
+    payloads: list[bytes]
+):
+    """
+    #### Send the payloads from each logger at once, each logger sending its requests one after another
+
+    ##### Returns:
+    - latencies: list[float]
+        - seconds taken by each request
+    - elapsed: float
+        - seconds taken by every request
+    """
+    latencies = []
+
+    async def simulate_logger(logger_id: str):
+        for raw_bytes in payloads:
+            request_start = time.perf_counter()
+            response = await client.post(f"/{path}/{logger_id}/bench.dat", content=raw_bytes)
+            latencies.append(time.perf_counter() - request_start)
+            response.raise_for_status()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(simulate_logger(logger_id) for logger_id in logger_ids))
+    return latencies, time.perf_counter() - start
+
+async def run_in_process(
+    path: str,
+    logger_ids: list[str],
+    payloads: list[bytes]
+):
+    """
+    #### Send a scenario to the app in-process, through its ASGI interface
+
+    ##### Returns:
+    - latencies: list[float]
+        - seconds taken by each request
+    - elapsed: float
+        - seconds taken by every request
+    - num_syscalls: int
+        - read and write syscalls made while sending, None if not counted
+    """
+    async with main.lifespan(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            syscalls_before = count_syscalls(os.getpid())
+            latencies, elapsed = await send_requests(client, path, logger_ids, payloads)
+            syscalls_after = count_syscalls(os.getpid())
+    return latencies, elapsed, None if syscalls_before is None else syscalls_after - syscalls_before
+
+async def run_localhost(
+    path: str,
+    logger_ids: list[str],
+    payloads: list[bytes]
+):
+    """
+    #### Send a scenario to the app over localhost, in a Uvicorn server process started for it
+
+    ##### Returns:
+    - latencies: list[float]
+        - seconds taken by each request
+    - elapsed: float
+        - seconds taken by every request
+    - num_syscalls: int
+        - read and write syscalls made by the server while sending, None if not counted
+    """
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = subprocess.Popen([sys.executable, os.path.realpath(__file__), "--serve", str(port)])
+    try:  # try send the scenario, always stopping the server
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=None) as client:
+            for _ in range(300):
+                try:  # try connect until the server has started
+                    await client.get("/events")
+                    break
+                except httpx.TransportError:
+                    await asyncio.sleep(0.1)
+            else:
+                raise RuntimeError("The Uvicorn server did not start")
+            syscalls_before = count_syscalls(server.pid)
+            latencies, elapsed = await send_requests(client, path, logger_ids, payloads)
+            syscalls_after = count_syscalls(server.pid)
+    finally:
+        server.terminate()
+        server.wait()
+    return latencies, elapsed, None if syscalls_before is None else syscalls_after - syscalls_before
+
+def run_scenario(
+    mode: str,
+    name: str,
+    path: str,
+    payloads: list[bytes],
+    num_loggers: int
+):
+    """
+    #### Run a scenario with a new output folder, measuring the requests
+
+    ##### Parameters:
+    - mode: str
+        - either in-process or localhost
+    - name: str
+        - name of the scenario
+    - path: str
+        - upload path the payloads are posted to
+    - payloads: list[bytes]
+        - payloads each logger sends
+    - num_loggers: int
+        - number of simulated loggers
+
+    ##### Returns:
+    - result: dict
+        - the measurements of the scenario
+    """
+    output_dir = tempfile.mkdtemp(prefix="ingest_bench_")
+    os.environ["OUTPUT_DIR"] = output_dir
+    main.get_settings.cache_clear()
+    logger_ids = [f"logger{i}" for i in range(num_loggers)]
+    try:  # try run the scenario, always removing the output folder
+        runner = run_in_process if mode == "in-process" else run_localhost
+        latencies, elapsed, num_syscalls = asyncio.run(runner(path, logger_ids, payloads))
+        bytes_written = folder_size(output_dir)
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+    num_requests = len(latencies)
+    return {
+        "mode": mode,
+        "scenario": name,
+        "loggers": num_loggers,
+        "requests": num_requests,
+        "rows": num_loggers * sum(raw_bytes.count(b'\n') for raw_bytes in payloads),
+        "payload_bytes": num_loggers * sum(len(raw_bytes) for raw_bytes in payloads),
+        "seconds": round(elapsed, 4),
+        "requests_per_s": round(num_requests / elapsed, 1),
+        "p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 3),
+        "p99_ms": round(float(np.percentile(latencies, 99)) * 1000, 3),
+        "bytes_written": bytes_written,
+        "syscalls_per_request": None if num_syscalls is None else round(num_syscalls / num_requests, 1)
+    }
+
+def git_commit():
+    """
+    #### Get the commit the benchmark is run on
+
+    ##### Returns:
+    - commit: str
+        - short commit hash, None if not in a git repository
+    """
+    try:  # try ask git for the commit
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=parent, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(
+    results: list[dict],
+    previous_path: str
+):
+    """
+    #### Print the change of each scenario from a previous run
+
+    ##### Parameters:
+    - results: list[dict]
+        - results of this run
+    - previous_path: str
+        - path to the json of a previous run
+    """
+    with open(previous_path) as f:
+        previous = json.load(f)
+    previous_results = {(result["mode"], result["scenario"]): result for result in previous["results"]}
+    print(f"Compared with {previous.get('commit')}:")
+    for result in results:
+        old = previous_results.get((result["mode"], result["scenario"]))
+        if old is None:
+            continue
+        print("%-10s %-18s requests/s %6.2fx, p99 %6.2fx, bytes written %6.2fx" % (
+            result["mode"],
+            result["scenario"],
+            result["requests_per_s"] / old["requests_per_s"],
+            result["p99_ms"] / old["p99_ms"],
+            result["bytes_written"] / old["bytes_written"] if old["bytes_written"] else float('nan')
+        ))
+
+def serve(port: int):
+    """
+    #### Run the app in a Uvicorn server on localhost, for the localhost mode
+    """
+    import uvicorn
+    main.logger.setLevel(logging.WARNING)
+    uvicorn.run(main.app, host="127.0.0.1", port=port, log_level="warning")
+
+def main_bench():
+    """
+    #### Main function for the ingest benchmark
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the upload endpoints with simulated CR1000 loggers")
+    parser.add_argument("--mode", choices=["in-process", "localhost", "both"], default="both", help="how the app is run")
+    parser.add_argument("--loggers", type=int, default=4, help="number of simulated loggers posting at once")
+    parser.add_argument("--requests", type=int, default=200, help="requests each logger sends in the low and high_event scenarios")
+    parser.add_argument("--event-rows", type=int, default=500, help="rows of each burst in the high_event scenario")
+    parser.add_argument("--scenarios", help="comma separated scenarios to run, all if not given")
+    parser.add_argument("--output", default="ingest_bench.json", help="path the json results are saved to")
+    parser.add_argument("--compare", help="path to the json results of a previous run to compare with")
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve is not None:
+        serve(args.serve)
+        return
+    main.logger.setLevel(logging.WARNING)
+    scenarios = make_scenarios(args.requests, args.event_rows)
+    names = args.scenarios.split(",") if args.scenarios else list(scenarios)
+    modes = ["in-process", "localhost"] if args.mode == "both" else [args.mode]
+    results = []
+    for mode in modes:
+        for name in names:
+            path, payloads = scenarios[name]
+            result = run_scenario(mode, name, path, payloads, args.loggers)
+            results.append(result)
+            print("%-10s %-18s %8.1f requests/s, p50 %9.3f ms, p99 %9.3f ms, %11d bytes written, %s syscalls/request" % (
+                mode, name, result["requests_per_s"], result["p50_ms"], result["p99_ms"], result["bytes_written"], result["syscalls_per_request"]
+            ))
+    settings = main.get_settings()
+    with open(args.output, 'w') as f:
+        json.dump({
+            "commit": git_commit(),
+            "python": sys.version.split()[0],
+            "storage_backend": settings.storage_backend,
+            "durability_mode": settings.durability_mode,
+            "results": results
+        }, f, indent=2)
+    print(f"Saved the results to {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == '__main__':
+    main_bench()
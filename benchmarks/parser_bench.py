@@ -0,0 +1,99 @@
+"""
+Microbenchmark for parsing the high frequency HTTPPost payloads.
+Compares rows/sec of payload.parse_payload against the previous string splitting parser, for bursts of 1k to 100k rows.
+
+Run from the repository folder:
+    python benchmarks/parser_bench.py
+
+Author: Liam Eime
+Date: 12/12/2023
+"""
+
+# import libraries
+import numpy as np
+import timeit
+import json
+import os
+import sys
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+import payload
+
+HIGH_FREQ_HEADER = ["Timestamp", "Accelerometer1.X", "Accelerometer1.Y", "Accelerometer1.Z", "Accelerometer2.X", "Accelerometer2.Y", "Accelerometer2.Z"]
+BURST_SIZES = [1_000, 10_000, 100_000]
+
+def make_payload(num_rows: int):
+    """
+    #### Make a high frequency payload as sent by the CR1000 logger, sampled every 20 ms
+
+    ##### Parameters:
+    - num_rows: int
+        - number of rows in the payload
+
+    ##### Returns:
+    - raw_bytes: bytes
+        - payload bytes
+    """
+    rng = np.random.default_rng(0)
+    timestamps = np.datetime64('2023-12-12T11:00:00', 'us') + np.arange(num_rows) * np.timedelta64(20_000, 'us')
+    values = rng.normal(0, 0.05, (num_rows, 6)).round(5)
+    lines = []
+    for ts, row in zip(timestamps, values):
+        iso = str(ts).replace('T', ' ').rstrip('0').rstrip('.')
+        lines.append('"%s",%s' % (iso, ','.join(repr(float(v)) for v in row)))
+    return ('\r\n'.join(lines) + '\r\n').encode()
+
+def legacy_parse(raw_bytes: bytes, header: list[str]):
+    """
+    #### Parse a payload the way the high frequency handler did before payload.parse_payload
+
+    ##### Parameters:
+    - raw_bytes: bytes
+        - payload bytes
+    - header: list[str]
+        - header of the data
+
+    ##### Returns:
+    - high_freq_data: list[dict]
+        - one dictionary for each row, as passed to csv.DictWriter
+    """
+    decoded_data = raw_bytes.decode("utf-8").replace('"', '').replace('\r\n', 'x,').split(",")
+    indicies = [(i+1) for i, x in enumerate(decoded_data) if x.endswith('x')]
+    decoded_data = [each_split.tolist() for each_split in np.split(decoded_data, indicies) if len(each_split)]
+    high_freq_data_lists = [[item.replace('x', '') for item in lst] for lst in decoded_data]
+    high_freq_data = [dict(zip(header, hf_list)) for hf_list in high_freq_data_lists]
+    return high_freq_data
+
+def rows_per_second(func, raw_bytes: bytes, num_rows: int):
+    """
+    #### Time a parser on a payload, taking the best of several repeats
+
+    ##### Returns:
+    - rate: float
+        - rows parsed per second
+    """
+    number = max(1, 20_000 // num_rows)
+    best = min(timeit.repeat(lambda: func(raw_bytes, HIGH_FREQ_HEADER), number=number, repeat=5)) / number
+    return num_rows / best
+
+def main():
+    """
+    #### Main function for the parser benchmark
+    """
+    results = []
+    for num_rows in BURST_SIZES:
+        raw_bytes = make_payload(num_rows)
+        legacy_rate = rows_per_second(legacy_parse, raw_bytes, num_rows)
+        vectorized_rate = rows_per_second(payload.parse_payload, raw_bytes, num_rows)
+        results.append({
+            "rows": num_rows,
+            "legacy_rows_per_s": round(legacy_rate),
+            "parse_payload_rows_per_s": round(vectorized_rate),
+            "speedup": round(vectorized_rate / legacy_rate, 2)
+        })
+        print("%7d rows: legacy %12.0f rows/s, parse_payload %12.0f rows/s, %.1fx" % (num_rows, legacy_rate, vectorized_rate, vectorized_rate / legacy_rate))
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+"""
+Startup benchmark for the web application, timing the cold start of a worker as after a restart or crash.
+
+For each scenario the following are measured in new Python processes, each repeated and the median printed and saved as json:
+    - import_ms: time to import main, with the largest imports by -X importtime
+    - first_request_ms: time from starting a Uvicorn server process until it accepts its first low frequency upload,
+      polling as the logger's HTTPPost retries would
+The scenarios are:
+    - empty: an empty output folder
+    - populated: an output folder of several loggers holding days of imported low and high frequency data,
+      so startup recovers the running files and syncs the file index and event catalogue of each logger
+Heavy optional modules loaded by importing main, such as pandas and matplotlib, are listed in the results.
+
+The settings in .env are used, overridden by environment variables, with the output written to a temporary folder.
+Run from the repository folder:
+    python benchmarks/startup_bench.py --loggers 4 --days 7 --output startup.json
+
+Author: Liam Eime
+Date: 12/12/2023
+"""
+
+# import libraries
+import numpy as np
+import subprocess
+import statistics
+import argparse
+import tempfile
+import logging
+import socket
+import shutil
+import httpx
+import time
+import json
+import os
+import sys
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+import main
+import backfill
+
+# modules that should only be loaded by the optional features that use them
+HEAVY_MODULES = ["pandas", "matplotlib", "scipy", "uvicorn"]
+LOW_FREQ_INTERVAL_US = 30_000_000
+EVENT_ROWS = 500
+START_TIME = np.datetime64('2023-12-12T00:00:00', 'us')
+
+def measure_import(env: dict):
+    """
+    #### Import main in a new Python process
+
+    ##### Parameters:
+    - env: dict
+        - environment variables of the process
+
+    ##### Returns:
+    - import_ms: float
+        - milliseconds taken to import main
+    - largest: list[tuple[str, float]]
+        - the largest imports made by main and their cumulative milliseconds
+    - heavy_modules: list[str]
+        - the HEAVY_MODULES loaded by importing main
+    """
+    code = (
+        "import sys, time, json; start = time.perf_counter(); import main; "
+        f"print(json.dumps([(time.perf_counter() - start) * 1000, [name for name in {HEAVY_MODULES!r} if name in sys.modules]]))"
+    )
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=parent, env=env, capture_output=True, text=True, check=True)
+    import_ms, heavy_modules = json.loads(completed.stdout.strip().splitlines()[-1])
+    largest = []
+    children = []
+    for line in completed.stderr.splitlines():
+        # lines are "import time: self [us] | cumulative | imported package", indented by two spaces for each level,
+        # with the imports made by a module listed before it
+        fields = line.split("|")
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        if not fields[2].startswith("  "):
+            if fields[2].strip() == "main":
+                largest = children
+            children = []
+        elif not fields[2].startswith("    "):
+            children.append((fields[2].strip(), int(fields[1]) / 1000))
+    largest = sorted(largest, key=lambda item: -item[1])[:5]
+    return import_ms, largest, heavy_modules
+
+def measure_first_request(env: dict):
+    """
+    #### Start a Uvicorn server process and time how long until it accepts a low frequency upload
+
+    ##### Parameters:
+    - env: dict
+        - environment variables of the server process
+
+    ##### Returns:
+    - first_request_ms: float
+        - milliseconds from starting the process until the first upload was accepted
+    """
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    header = json.loads(main.get_settings().low_freq_header)
+    sample = ('"2023-12-12 00:00:00",' + ",".join(["0"] * (len(header) - 1)) + "\r\n").encode()
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=parent,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    try:  # try post until the server accepts, always stopping the server
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=5) as client:
+            while True:
+                try:  # try post the sample, the server may not be listening yet
+                    if client.post("/uploadLowFreq/bench.dat", content=sample).status_code == 200:
+                        return (time.perf_counter() - start) * 1000
+                except httpx.TransportError:
+                    pass
+                if server.poll() is not None:
+                    raise RuntimeError("The Uvicorn server exited before accepting an upload")
+                time.sleep(0.005)
+    finally:
+        server.terminate()
+        server.wait()
+
+def populate(
+    num_loggers: int,
+    days: int
+):
+    """
+    #### Import days of low frequency samples and high frequency events for each logger into the output folder
+
+    ##### Parameters:
+    - num_loggers: int
+        - number of loggers
+    - days: int
+        - days of data of each logger, with a high frequency event each hour
+
+    ##### Returns:
+    - None
+    """
+    main.get_settings.cache_clear()
+    settings = main.get_settings()
+    rng = np.random.default_rng(0)
+    low_timestamps = START_TIME + np.arange(days * 24 * 60 * 60 * 1_000_000 // LOW_FREQ_INTERVAL_US) * np.timedelta64(LOW_FREQ_INTERVAL_US, 'us')
+    event_starts = START_TIME + np.arange(days * 24) * np.timedelta64(1, 'h')
+    high_timestamps = (event_starts[:, None] + np.arange(EVENT_ROWS) * np.timedelta64(settings.scan_rate_micro_s, 'us')).ravel()
+    for logger_number in range(num_loggers):
+        for stream, timestamps in (("low", low_timestamps), ("high", high_timestamps)):
+            writer = main.create_writer(f"logger{logger_number}", stream)
+            channels = rng.normal(0, 0.05, (len(writer.header) - 1, len(timestamps))).astype(np.float32)
+            importer = backfill.Importer(
+                writer,
+                max_rows=writer.max_rows if stream == "low" else 0,
+                max_gap_us=writer.max_gap_us if stream == "high" else 0,
+                pyramid=main.create_pyramid(f"logger{logger_number}", stream)
+            )
+            importer.add(backfill.payload.from_columns(writer.header, timestamps, channels))
+            importer.close()
+            writer.close()
+    main.get_file_index().close()
+    main.get_file_index.cache_clear()
+
+def run_scenario(
+    name: str,
+    num_loggers: int,
+    days: int,
+    repeat: int
+):
+    """
+    #### Time the import and first request of a scenario in a new output folder
+
+    ##### Returns:
+    - result: dict
+        - the measurements of the scenario
+    """
+    output_dir = tempfile.mkdtemp(prefix="startup_bench_")
+    os.environ["OUTPUT_DIR"] = output_dir
+    env = dict(os.environ)
+    try:  # try run the scenario, always removing the output folder
+        if num_loggers:
+            populate(num_loggers, days)
+        imports = [measure_import(env) for _ in range(repeat)]
+        first_requests = [measure_first_request(env) for _ in range(repeat)]
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+    return {
+        "scenario": name,
+        "loggers": num_loggers,
+        "days": days,
+        "import_ms": round(statistics.median(import_ms for import_ms, _, _ in imports), 1),
+        "first_request_ms": round(statistics.median(first_requests), 1),
+        "largest_imports_ms": [(module, round(ms, 1)) for module, ms in imports[0][1]],
+        "heavy_modules": imports[0][2]
+    }
+
+def main_bench():
+    """
+    #### Main function for the startup benchmark
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the import time and time to first accepted request of the web application")
+    parser.add_argument("--loggers", type=int, default=4, help="number of loggers in the populated scenario")
+    parser.add_argument("--days", type=int, default=7, help="days of data of each logger in the populated scenario")
+    parser.add_argument("--repeat", type=int, default=5, help="number of times each measurement is repeated")
+    parser.add_argument("--output", default="startup_bench.json", help="path the json results are saved to")
+    args = parser.parse_args()
+    main.logger.setLevel(logging.WARNING)
+    results = []
+    for name, num_loggers in (("empty", 0), ("populated", args.loggers)):
+        result = run_scenario(name, num_loggers, args.days, args.repeat)
+        results.append(result)
+        print("%-10s import %8.1f ms, first request %8.1f ms, largest imports %s, heavy modules %s" % (
+            name,
+            result["import_ms"],
+            result["first_request_ms"],
+            ", ".join(f"{module} {ms:.0f} ms" for module, ms in result["largest_imports_ms"]),
+            result["heavy_modules"] or "none"
+        ))
+    with open(args.output, 'w') as f:
+        json.dump({"python": sys.version.split()[0], "results": results}, f, indent=2)
+    print(f"Saved the results to {args.output}")
+
+if __name__ == '__main__':
+    main_bench()
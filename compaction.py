@@ -0,0 +1,273 @@
+"""
+Background compaction of the completed data files into hourly or daily compressed archives.
+For use with the Python web application for CR1000 data logging.
+
+The completed files of each hour or day, once the newest data in the folder is compact_after_s past the end of that hour or day,
+are merged in time order into one compressed .npz archive, named with the output filename followed by ARCHIVE_SUFFIX and its total timestamp.\n
+The archive is added to the file index and the merged files are removed, so long time windows are read from a few large files.
+A file completed late for an hour or day already archived is merged into a new archive along with the existing one.\n
+Compaction runs on a low priority thread and is limited to an I/O budget of bytes read and written per second.
+
+Author: Liam Eime
+Date: 12/12/2023
+"""
+
+# Python imports
+import os
+import time
+import logging
+import threading
+import numpy as np
+
+# .py file imports
+import files
+import index
+import storage
+import timestamp
+
+logger = logging.getLogger(__name__)
+
+# width in seconds of the hour and day archives
+PERIODS_S = {"hour": 60 * 60, "day": 24 * 60 * 60}
+
+def lower_thread_priority():
+    """
+    #### Lower the scheduling priority of the calling thread, used as the initializer of the compaction thread
+
+    Only thread priorities on Linux are supported, elsewhere the priority is left unchanged.
+
+    ##### Returns:
+    - None
+    """
+    try:  # try set the niceness of the thread, which Linux applies to each thread
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+    except (AttributeError, OSError):
+        pass
+
+def plan_archives(
+    entries: list[dict],
+    period_s: int,
+    before_us: int
+):
+    """
+    #### Group the index entries of a folder into the archives to write
+
+    Files are grouped by the hour or day of their initial timestamp.
+    Only hours or days ending at or before before_us, with at least one file not yet archived, are archived.
+
+    ##### Parameters:
+    - entries: list[dict]
+        - index entries of the files in the folder
+    - period_s: int
+        - width in seconds of each archive
+    - before_us: int
+        - hours or days ending after this time, in integer epoch micro-seconds, are left alone
+
+    ##### Returns:
+    - groups: list[list[dict]]
+        - the index entries merged into each archive, oldest archive first
+    """
+    period_us = period_s * 1_000_000
+    groups = {}
+    for entry in entries:
+        bucket = entry["start_us"] // period_us
+        if (bucket + 1) * period_us <= before_us:
+            groups.setdefault(bucket, []).append(entry)
+    return [group for _, group in sorted(groups.items()) if any(not files.is_archive(entry["path"]) for entry in group)]
+
+class IoBudget:
+    """
+    #### Limit on the bytes read and written per second, sleeping once more than the budget has been used
+    """
+
+    def __init__(
+        self,
+        bytes_per_s: float,
+        stop_event: threading.Event
+    ):
+        """
+        #### Start the budget
+
+        ##### Parameters:
+        - bytes_per_s: float
+            - bytes allowed per second, 0 for no limit
+        - stop_event: threading.Event
+            - cuts a sleep short when set
+        """
+        self.bytes_per_s = bytes_per_s
+        self.stop_event = stop_event
+        self._start = time.monotonic()
+        self._num_bytes = 0
+
+    def use(self, num_bytes: int):
+        """
+        #### Use part of the budget, sleeping until the bytes used so far are within the budget
+
+        ##### Parameters:
+        - num_bytes: int
+            - bytes read or written
+
+        ##### Returns:
+        - None
+        """
+        if self.bytes_per_s <= 0:
+            return
+        self._num_bytes += num_bytes
+        ahead_s = self._num_bytes / self.bytes_per_s - (time.monotonic() - self._start)
+        if ahead_s > 0:
+            self.stop_event.wait(ahead_s)
+
+class Compactor:
+    """
+    #### Compactor of the completed data files of the output folders
+
+    Only used from one thread at a time.
+    """
+
+    def __init__(
+        self,
+        file_index: index.FileIndex,
+        period: str,
+        compact_after_s: float,
+        io_budget_bytes_per_s: float = 0,
+        sync: bool = False
+    ):
+        """
+        #### Create the compactor
+
+        ##### Parameters:
+        - file_index: index.FileIndex
+            - index the files to archive are found in, updated with each archive
+        - period: str
+            - either hour or day, the time covered by each archive
+        - compact_after_s: float
+            - seconds the newest data in a folder must be past the end of an hour or day before it is archived
+        - io_budget_bytes_per_s: float = 0
+            - bytes read and written per second while compacting, 0 for no limit
+        - sync: bool = False
+            - flush each archive and its directory to disk before the merged files are deleted
+
+        ##### Raises:
+        - ValueError
+            - if the period is not hour or day
+        """
+        if period not in PERIODS_S:
+            raise ValueError(f"Unknown compaction period {period!r}, expected one of {list(PERIODS_S)}")
+        self.file_index = file_index
+        self.period_s = PERIODS_S[period]
+        self.compact_after_us = int(compact_after_s * 1_000_000)
+        self.io_budget_bytes_per_s = io_budget_bytes_per_s
+        self.sync = sync
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        """
+        #### Stop compacting after the current archive, from any thread
+
+        ##### Returns:
+        - None
+        """
+        self._stop_event.set()
+
+    def compact_folder(self, folder: str):
+        """
+        #### Merge the completed files of each hour or day old enough into an archive
+
+        ##### Parameters:
+        - folder: str
+            - folder of the data files
+
+        ##### Returns:
+        - archive_paths: list[str]
+            - paths to the archives written
+        - removed_paths: list[str]
+            - paths to the files merged into the archives and removed
+        """
+        entries = self.file_index.file_info(folder)
+        if not entries:
+            return [], []
+        before_us = max(entry["end_us"] for entry in entries) - self.compact_after_us
+        io_budget = IoBudget(self.io_budget_bytes_per_s, self._stop_event)
+        archive_paths = []
+        removed_paths = []
+        for group in plan_archives(entries, self.period_s, before_us):
+            if self._stop_event.is_set():
+                break
+            try:  # try write the archive, leaving the files as they are if it fails
+                archive_path, merged_paths = self._write_archive(folder, group, io_budget)
+            except Exception:
+                logger.error("There was an error archiving %d files of %s", len(group), folder, exc_info=True)
+                continue
+            if archive_path is not None:
+                archive_paths.append(archive_path)
+            removed_paths.extend(merged_paths)
+        return archive_paths, removed_paths
+
+    def _write_archive(
+        self,
+        folder: str,
+        group: list[dict],
+        io_budget: IoBudget
+    ):
+        """
+        #### Merge a group of files into an archive in time order, index it and delete the merged files
+
+        Files with a different header to the first file are left out, to be archived once the header matches again.
+
+        ##### Returns:
+        - archive_path: str
+            - path to the archive, None if no archive was written
+        - merged_paths: list[str]
+            - paths to the merged files, not including the archive if it was written over
+        """
+        header = group[0]["header"]
+        group = [entry for entry in group if entry["header"] == header]
+        if all(files.is_archive(entry["path"]) for entry in group):
+            return None, []
+        timestamps = []
+        channels = []
+        merged_paths = []
+        mtime = 0
+        for entry in group:
+            path = entry["path"]
+            try:  # try read the file, it may have been removed by retention
+                stat = os.stat(path)
+                _, file_timestamps, file_channels = storage.get_backend_for_path(path).read(path)
+            except FileNotFoundError:
+                merged_paths.append(path)
+                continue
+            io_budget.use(stat.st_size)
+            mtime = max(mtime, stat.st_mtime)
+            timestamps.append(file_timestamps)
+            channels.append(file_channels)
+            merged_paths.append(path)
+        timestamps = np.concatenate(timestamps) if timestamps else np.empty(0, dtype='datetime64[us]')
+        channels = np.concatenate(channels, axis=1) if channels else np.empty((len(header) - 1, 0), dtype=np.float32)
+        if len(timestamps) == 0:
+            self.file_index.remove_files(merged_paths)
+            return None, merged_paths
+        if np.any(timestamps[1:] < timestamps[:-1]):
+            order = np.argsort(timestamps, kind='stable')
+            timestamps, channels = timestamps[order], channels[:, order]
+        output_filename = os.path.basename(next(entry["path"] for entry in group if not files.is_archive(entry["path"]))).rsplit(' ', 1)[0]
+        archive_path = files.create_timestamped_filepath(
+            timestamp.format_microseconds(timestamp.to_microseconds(timestamps[0])),
+            timestamp.format_microseconds(timestamp.to_microseconds(timestamps[-1])),
+            output_filename + files.ARCHIVE_SUFFIX,
+            folder,
+            storage.NpzBackend.extension
+        )
+        storage.BACKENDS["npz"].write(archive_path, header, timestamps, channels, self.sync)
+        io_budget.use(os.path.getsize(archive_path))
+        # keep the time the newest merged file was written, so retention ages the archive by its data rather than by when it was merged
+        os.utime(archive_path, (mtime, mtime))
+        channel_min, channel_max = index.channel_range(channels)
+        self.file_index.add_file(archive_path, header, timestamps[0], timestamps[-1], len(timestamps), channel_min, channel_max)
+        merged_paths = [path for path in merged_paths if path != archive_path]
+        self.file_index.remove_files(merged_paths)
+        for path in merged_paths:
+            try:  # try delete the merged file, it may already have been removed
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        return archive_path, merged_paths
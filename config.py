@@ -19,7 +19,26 @@ class Settings(BaseSettings):
     output_high_freq_filename: str
     max_low_freq_data_rows: int
     max_num_of_files: int
+    max_file_age_days: float
+    max_folder_size_mb: float
+    compact_after_hours: float
+    compaction_period: str
+    compaction_io_budget_mb_s: float
     scan_rate_micro_s: int
+    low_freq_interval_micro_s: int
+    high_freq_event_timeout_s: float
+    ingest_queue_size: int
+    durability_mode: str
+    durability_batch_rows: int
+    durability_batch_ms: float
     low_freq_header: str
     high_freq_header: str
+    storage_backend: str
+    index_filename: str
+    event_catalogue_filename: str
+    workers: int
+    live_buffer_rows: int
+    hotstore_hours: float
+    coverage_filename: str
+    continuity_policy: str
     model_config = SettingsConfigDict(env_file=".env")
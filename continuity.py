@@ -0,0 +1,406 @@
+"""
+Continuity tracking of the samples of each stream, and the coverage map of the gaps between them.
+For use with the Python web application for CR1000 data logging.
+
+Each writer keeps a ContinuityTracker holding the timestamp of the last sample written, as integer epoch micro-seconds.
+Every batch is checked against it in whole NumPy arrays before it is written, finding the rows that repeat a timestamp already written,
+such as from a HTTPPost the logger retried, the rows older than the last sample, and the gaps of more than max_gap_us between samples.\n
+Duplicate rows are always dropped. Rows older than the last sample are dropped, or with the reorder policy merged into the running file in time order.\n
+The gaps are kept in an sqlite coverage map in the output directory, so the holes in the data of a time window are found without reading the data files.
+Samples stored later within a gap, such as rows imported from a table file, split the gap or remove it.
+
+Author: Liam Eime
+Date: 12/12/2023
+"""
+
+# Python imports
+import sqlite3
+import threading
+import numpy as np
+
+# .py file imports
+import payload
+import metrics
+
+# policies for the rows older than the last sample written
+#   drop: the rows are dropped
+#   reorder: the rows within the running file are merged into it in time order, older rows are dropped
+CONTINUITY_POLICIES = ("drop", "reorder")
+
+# number of the most recent timestamps written kept by each tracker, so a retried upload is found to be duplicate rows rather than out of order rows
+RECENT_ROWS = 4096
+
+# number of the most recent timestamps shared with the other processes writing the same stream, written with the state on each upload,
+# enough for a retried low frequency upload or the end of a retried burst, the late rows of a longer retry are still dropped as duplicates
+# when merged into the running file, or dropped as out of order rows with the drop policy
+SHARED_RECENT_ROWS = 64
+
+class CoverageMap:
+    """
+    #### Map of the gaps in the data of each output folder
+
+    The gaps table holds one row for each gap, from the last sample before it to the first sample after it,
+    with the number of samples expected within it.
+    """
+
+    def __init__(self, db_path: str):
+        """
+        #### Open the coverage map, creating it if it does not exist
+
+        ##### Parameters:
+        - db_path: str
+            - path to the sqlite database file
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS gaps (
+                folder TEXT NOT NULL,
+                start_us INTEGER NOT NULL,
+                end_us INTEGER NOT NULL,
+                num_missing INTEGER NOT NULL,
+                PRIMARY KEY (folder, start_us)
+            );
+        """)
+        self._connection.commit()
+
+    def add_gaps(
+        self,
+        folder: str,
+        starts_us: np.ndarray,
+        ends_us: np.ndarray,
+        interval_us: int
+    ):
+        """
+        #### Add gaps to the map, replacing any gap from the same sample
+
+        ##### Parameters:
+        - folder: str
+            - output folder of the stream
+        - starts_us: np.ndarray
+            - timestamp of the last sample before each gap, in integer epoch micro-seconds
+        - ends_us: np.ndarray
+            - timestamp of the first sample after each gap, in integer epoch micro-seconds
+        - interval_us: int
+            - expected time between samples, in micro-seconds
+
+        ##### Returns:
+        - None
+        """
+        num_missing = np.maximum(np.rint((ends_us - starts_us) / interval_us).astype(np.int64) - 1, 0)
+        rows = [(folder, int(start_us), int(end_us), int(missing)) for start_us, end_us, missing in zip(starts_us, ends_us, num_missing)]
+        with self._lock:
+            self._connection.executemany("INSERT OR REPLACE INTO gaps VALUES (?, ?, ?, ?)", rows)
+            self._connection.commit()
+
+    def fill(
+        self,
+        folder: str,
+        microseconds: np.ndarray,
+        max_gap_us: int,
+        interval_us: int
+    ):
+        """
+        #### Split or remove the gaps holding samples stored after the gaps were found
+
+        ##### Parameters:
+        - folder: str
+            - output folder of the stream
+        - microseconds: np.ndarray
+            - sorted timestamps of the stored samples, in integer epoch micro-seconds
+        - max_gap_us: int
+            - time between samples, in micro-seconds, above which they are a gap
+        - interval_us: int
+            - expected time between samples, in micro-seconds
+
+        ##### Returns:
+        - None
+        """
+        if len(microseconds) == 0:
+            return
+        with self._lock:
+            gaps = self._connection.execute(
+                "SELECT start_us, end_us FROM gaps WHERE folder = ? AND end_us > ? AND start_us < ?",
+                (folder, int(microseconds[0]), int(microseconds[-1]))
+            ).fetchall()
+        starts_us = []
+        ends_us = []
+        filled = []
+        for start_us, end_us in gaps:
+            within = microseconds[np.searchsorted(microseconds, start_us, side='right'):np.searchsorted(microseconds, end_us, side='left')]
+            if len(within) == 0:
+                continue
+            filled.append((folder, start_us))
+            samples = np.r_[start_us, within, end_us]
+            is_gap = np.diff(samples) > max_gap_us
+            starts_us.append(samples[:-1][is_gap])
+            ends_us.append(samples[1:][is_gap])
+        if not filled:
+            return
+        with self._lock:
+            self._connection.executemany("DELETE FROM gaps WHERE folder = ? AND start_us = ?", filled)
+            self._connection.commit()
+        self.add_gaps(folder, np.concatenate(starts_us), np.concatenate(ends_us), interval_us)
+
+    def find_gaps(
+        self,
+        folder: str,
+        start_us: int = None,
+        end_us: int = None
+    ):
+        """
+        #### Find the gaps of a folder overlapping a time window
+
+        ##### Parameters:
+        - folder: str
+            - output folder of the stream
+        - start_us: int = None
+            - start of the time window, in epoch micro-seconds, unbounded if None
+        - end_us: int = None
+            - end of the time window, in epoch micro-seconds, unbounded if None
+
+        ##### Returns:
+        - gaps: list[dict]
+            - the last sample before and first sample after each gap, its duration and the number of samples expected within it, oldest first
+        """
+        conditions = ["folder = ?"]
+        parameters = [folder]
+        if start_us is not None:
+            conditions.append("end_us > ?")
+            parameters.append(start_us)
+        if end_us is not None:
+            conditions.append("start_us < ?")
+            parameters.append(end_us)
+        with self._lock:
+            rows = self._connection.execute(
+                f"SELECT start_us, end_us, num_missing FROM gaps WHERE {' AND '.join(conditions)} ORDER BY start_us",
+                parameters
+            ).fetchall()
+        return [
+            {"start_us": start_us, "end_us": end_us, "duration_s": (end_us - start_us) / 1_000_000, "num_missing": num_missing}
+            for start_us, end_us, num_missing in rows
+        ]
+
+    def remove_before(
+        self,
+        folder: str,
+        before_us: int
+    ):
+        """
+        #### Remove the gaps ending before a time, such as before the oldest file kept by the retention limits
+
+        ##### Parameters:
+        - folder: str
+            - output folder of the stream
+        - before_us: int
+            - gaps ending before this time, in epoch micro-seconds, are removed
+
+        ##### Returns:
+        - None
+        """
+        with self._lock:
+            self._connection.execute("DELETE FROM gaps WHERE folder = ? AND end_us < ?", (folder, before_us))
+            self._connection.commit()
+
+    def close(self):
+        """
+        #### Close the coverage map database
+
+        ##### Returns:
+        - None
+        """
+        with self._lock:
+            self._connection.close()
+
+def coverage(
+    gaps: list[dict],
+    start_us: int,
+    end_us: int
+):
+    """
+    #### Get the fraction of a time window not within a gap
+
+    ##### Parameters:
+    - gaps: list[dict]
+        - gaps from CoverageMap.find_gaps, which do not overlap
+    - start_us: int
+        - start of the time window, in epoch micro-seconds
+    - end_us: int
+        - end of the time window, in epoch micro-seconds
+
+    ##### Returns:
+    - fraction: float
+        - fraction of the window covered by samples, None if the window is empty
+    """
+    if end_us <= start_us:
+        return None
+    missing_us = sum(max(0, min(gap["end_us"], end_us) - max(gap["start_us"], start_us)) for gap in gaps)
+    return 1 - missing_us / (end_us - start_us)
+
+class ContinuityTracker:
+    """
+    #### Tracker of the last sample written to a stream, checking each batch for duplicate and out of order rows and gaps
+
+    Only used from the writer thread of the stream.
+    """
+
+    def __init__(
+        self,
+        interval_us: int,
+        max_gap_us: int = None,
+        policy: str = "drop",
+        coverage_map: CoverageMap = None,
+        folder: str = "",
+        stream: str = ""
+    ):
+        """
+        #### Create the tracker, with no last sample
+
+        ##### Parameters:
+        - interval_us: int
+            - expected time between samples, in micro-seconds
+        - max_gap_us: int = None
+            - time between samples, in micro-seconds, above which they are a gap, gaps are not tracked if None,
+              such as between the high frequency events which are only sent when triggered
+        - policy: str = "drop"
+            - one of CONTINUITY_POLICIES
+        - coverage_map: CoverageMap = None
+            - map the gaps are added to, not kept if None
+        - folder: str = ""
+            - output folder of the stream, the gaps are kept under
+        - stream: str = ""
+            - name of the stream, used to label the metrics
+
+        ##### Raises:
+        - ValueError
+            - if the policy is not one of CONTINUITY_POLICIES
+        """
+        if policy not in CONTINUITY_POLICIES:
+            raise ValueError(f"Unknown continuity policy {policy!r}, expected one of {CONTINUITY_POLICIES}")
+        self.interval_us = interval_us
+        self.max_gap_us = max_gap_us
+        self.policy = policy
+        self.coverage_map = coverage_map
+        self.folder = folder
+        self.stream = stream
+        self.last_us = None
+        self._recent_us = np.empty(0, dtype=np.int64)
+
+    def check(self, batch: payload.DataBatch):
+        """
+        #### Split a batch into the rows after the last sample, to be written, and the rows older than it, dropping duplicate rows
+
+        With the drop policy the rows are kept in the order they arrived, dropping each row not after every row before it.
+        With the reorder policy the rows are sorted, and the rows older than the last sample are returned to be merged into the running file.\n
+        The gaps before and between the rows to be written are added to the coverage map, and the last sample moved to the newest row.
+
+        ##### Parameters:
+        - batch: payload.DataBatch
+            - parsed samples, in the order they arrived
+
+        ##### Returns:
+        - batch: payload.DataBatch
+            - rows after the last sample, in time order
+        - late: payload.DataBatch
+            - rows older than the last sample and not a duplicate, in time order, always empty with the drop policy
+        """
+        if batch.num_rows == 0:
+            return batch, batch
+        microseconds = batch.timestamps.astype(np.int64)
+        last_us = self.last_us if self.last_us is not None else np.iinfo(np.int64).min
+        # a row repeating the timestamp of the last sample, of a recently written row or of an earlier row of the batch is a duplicate
+        is_duplicate = microseconds == last_us
+        if len(self._recent_us):
+            positions = np.minimum(np.searchsorted(self._recent_us, microseconds), len(self._recent_us) - 1)
+            is_duplicate |= self._recent_us[positions] == microseconds
+        order = np.argsort(microseconds, kind='stable')
+        sorted_us = microseconds[order]
+        is_duplicate[order[1:]] |= sorted_us[1:] == sorted_us[:-1]
+        # a row older than any row before it, or than the last sample, is out of order
+        previous_max = np.maximum.accumulate(np.r_[last_us, microseconds[:-1]])
+        is_out_of_order = ~is_duplicate & (microseconds < previous_max)
+        num_duplicates = int(np.count_nonzero(is_duplicate))
+        num_out_of_order = int(np.count_nonzero(is_out_of_order))
+        if num_duplicates:
+            metrics.DUPLICATE_ROWS.inc(num_duplicates, stream=self.stream)
+        late = payload.empty_batch(batch.header)
+        if self.policy == "drop":
+            if num_out_of_order:
+                metrics.OUT_OF_ORDER_ROWS.inc(num_out_of_order, stream=self.stream, action="dropped")
+            if num_duplicates or num_out_of_order:
+                batch = batch.take(np.flatnonzero(~is_duplicate & ~is_out_of_order))
+        elif num_duplicates or num_out_of_order:
+            order = order[~is_duplicate[order]]
+            is_late = microseconds[order] < last_us
+            late = batch.take(order[is_late])
+            batch = batch.take(order[~is_late])
+            # the late rows are counted once they are merged into the running file or dropped
+            if num_out_of_order > late.num_rows:
+                metrics.OUT_OF_ORDER_ROWS.inc(num_out_of_order - late.num_rows, stream=self.stream, action="reordered")
+        self._advance(batch.timestamps.astype(np.int64))
+        return batch, late
+
+    def dump_state(self):
+        """
+        #### Get the last sample and the SHARED_RECENT_ROWS most recent timestamps written, to share them with other processes writing the same stream
+
+        ##### Returns:
+        - state: dict
+            - json serialisable state
+        """
+        return {"last_us": self.last_us, "recent_us": self._recent_us[-SHARED_RECENT_ROWS:].tolist()}
+
+    def load_state(self, state: dict):
+        """
+        #### Replace the last sample with the one written by another process, and add the recent timestamps it wrote
+
+        ##### Parameters:
+        - state: dict
+            - state from dump_state
+
+        ##### Returns:
+        - None
+        """
+        self.last_us = state["last_us"]
+        self._recent_us = np.union1d(self._recent_us, np.array(state["recent_us"], dtype=np.int64))[-RECENT_ROWS:]
+
+    def fill(self, microseconds: np.ndarray):
+        """
+        #### Record samples stored other than through check, such as late rows merged into the running file or rows imported from a table file
+
+        The gaps holding samples older than the last sample are split or removed, and the last sample is moved to the newest sample.
+
+        ##### Parameters:
+        - microseconds: np.ndarray
+            - timestamps of the stored samples, in integer epoch micro-seconds
+
+        ##### Returns:
+        - None
+        """
+        microseconds = np.unique(microseconds)
+        if len(microseconds) == 0:
+            return
+        newer = np.searchsorted(microseconds, self.last_us, side='right') if self.last_us is not None else 0
+        if self.coverage_map is not None and self.max_gap_us is not None and newer > 0:
+            self.coverage_map.fill(self.folder, microseconds[:newer], self.max_gap_us, self.interval_us)
+        self._advance(microseconds[newer:])
+
+    def _advance(self, microseconds: np.ndarray):
+        """
+        #### Add the gaps before and between sorted samples after the last sample, and move the last sample to the newest of them
+        """
+        if len(microseconds) == 0:
+            return
+        self._recent_us = np.concatenate([self._recent_us, microseconds])[-RECENT_ROWS:]
+        if self.max_gap_us is None:
+            self.last_us = int(microseconds[-1])
+            return
+        samples = np.r_[self.last_us, microseconds] if self.last_us is not None else microseconds
+        is_gap = np.diff(samples) > self.max_gap_us
+        num_gaps = int(np.count_nonzero(is_gap))
+        if num_gaps:
+            metrics.GAPS.inc(num_gaps, stream=self.stream)
+            if self.coverage_map is not None:
+                self.coverage_map.add_gaps(self.folder, samples[:-1][is_gap], samples[1:][is_gap], self.interval_us)
+        self.last_us = int(microseconds[-1])
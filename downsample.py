@@ -0,0 +1,593 @@
+"""
+Multi-resolution pyramid of the minimum, maximum, mean and RMS of each channel, for plotting and querying long time windows.
+For use with the Python web application for CR1000 data logging.
+
+Each level holds one record for each bucket of its width, 1 s, 10 s, 1 min and 10 min, updated from each batch as it is written.
+The minimum and maximum are kept, so peaks stay visible at every level.\n
+Each level is an append-only file of fixed size binary records in the .pyramid folder of the stream's output folder,
+a json header line followed by the bucket and the count, minimum, maximum, sum and sum of squares of each channel.
+Completed buckets are appended as later data arrives, and the bucket still filling is kept in memory.
+The records of a level file are kept in bucket order, so a time window is read by memory-mapping the file and searching for the window.
+Records older than the last record of the level, such as from late rows or an import, are appended to a .late.bin file of the level instead,
+which is memory-mapped and filtered to the window when read, and merged back into the level file once it holds MAX_LATE_RECORDS records,
+when the pyramid is closed, and when the level is trimmed to the data kept by the retention limits.
+A bucket written more than once, such as by several workers or after a restart, is merged when read.
+
+Author: Liam Eime
+Date: 12/12/2023
+"""
+
+# Python imports
+import os
+import json
+import mmap
+import numpy as np
+
+PYRAMID_FOLDER = ".pyramid"
+
+# width in seconds of the buckets of each level, finest first
+LEVEL_WIDTHS_S = (1, 10, 60, 600)
+
+# number of late records of a level above which they are merged back into the level file, so reading them stays cheap
+MAX_LATE_RECORDS = 4096
+
+def record_dtype(num_channels: int):
+    """
+    #### Get the dtype of the bucket records
+
+    ##### Parameters:
+    - num_channels: int
+        - number of channels after the timestamp
+
+    ##### Returns:
+    - dtype: np.dtype
+        - structured dtype of a record
+    """
+    return np.dtype([
+        ('bucket', '<i8'),
+        ('count', '<u4', (num_channels,)),
+        ('min', '<f4', (num_channels,)),
+        ('max', '<f4', (num_channels,)),
+        ('sum', '<f8', (num_channels,)),
+        ('sumsq', '<f8', (num_channels,))
+    ])
+
+def level_path(
+    dir: str,
+    width_s: int
+):
+    """
+    #### Get the path to the file of a level
+
+    ##### Parameters:
+    - dir: str
+        - path to the .pyramid folder
+    - width_s: int
+        - width in seconds of the buckets of the level
+
+    ##### Returns:
+    - path: str
+        - path to the level file
+    """
+    return os.path.join(dir, f"{width_s}s.bin")
+
+def late_path(
+    dir: str,
+    width_s: int
+):
+    """
+    #### Get the path to the file of the records of a level older than the last record of its level file
+
+    ##### Parameters:
+    - dir: str
+        - path to the .pyramid folder
+    - width_s: int
+        - width in seconds of the buckets of the level
+
+    ##### Returns:
+    - path: str
+        - path to the late records file, of records without a header line
+    """
+    return os.path.join(dir, f"{width_s}s.late.bin")
+
+def aggregate(
+    timestamps: np.ndarray,
+    channels: np.ndarray,
+    width_s: int
+):
+    """
+    #### Aggregate samples into bucket records of a width
+
+    ##### Parameters:
+    - timestamps: np.ndarray
+        - datetime64[us] timestamp of each sample
+    - channels: np.ndarray
+        - float32 array of shape (number of channels, number of samples)
+    - width_s: int
+        - width in seconds of the buckets
+
+    ##### Returns:
+    - records: np.ndarray
+        - one record for each bucket with samples, in bucket order
+    """
+    buckets = timestamps.astype(np.int64) // (width_s * 1_000_000)
+    if np.any(buckets[1:] < buckets[:-1]):
+        order = np.argsort(buckets, kind='stable')
+        buckets, channels = buckets[order], channels[:, order]
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    is_valid = ~np.isnan(channels)
+    filled = np.where(is_valid, channels, 0).astype(np.float64)
+    records = np.empty(len(starts), dtype=record_dtype(channels.shape[0]))
+    records['bucket'] = buckets[starts]
+    records['count'] = np.add.reduceat(is_valid, starts, axis=1).T
+    records['min'] = np.fmin.reduceat(channels, starts, axis=1).T
+    records['max'] = np.fmax.reduceat(channels, starts, axis=1).T
+    records['sum'] = np.add.reduceat(filled, starts, axis=1).T
+    records['sumsq'] = np.add.reduceat(filled * filled, starts, axis=1).T
+    return records
+
+def merge_records(records: np.ndarray):
+    """
+    #### Merge the records of the same bucket into one record
+
+    ##### Parameters:
+    - records: np.ndarray
+        - bucket records in any order
+
+    ##### Returns:
+    - merged_records: np.ndarray
+        - one record for each bucket, in bucket order
+    """
+    if len(records) == 0:
+        return records
+    if np.any(records['bucket'][1:] <= records['bucket'][:-1]):
+        records = records[np.argsort(records['bucket'], kind='stable')]
+    else:
+        return records
+    starts = np.flatnonzero(np.r_[True, records['bucket'][1:] != records['bucket'][:-1]])
+    merged_records = np.empty(len(starts), dtype=records.dtype)
+    merged_records['bucket'] = records['bucket'][starts]
+    merged_records['count'] = np.add.reduceat(records['count'], starts, axis=0)
+    merged_records['min'] = np.fmin.reduceat(records['min'], starts, axis=0)
+    merged_records['max'] = np.fmax.reduceat(records['max'], starts, axis=0)
+    merged_records['sum'] = np.add.reduceat(records['sum'], starts, axis=0)
+    merged_records['sumsq'] = np.add.reduceat(records['sumsq'], starts, axis=0)
+    return merged_records
+
+def read_level(
+    dir: str,
+    width_s: int,
+    start: np.datetime64 = None,
+    end: np.datetime64 = None
+):
+    """
+    #### Read the records of a level overlapping a time window
+
+    The level file is memory-mapped and only the records of the window are copied, found by a binary search of the buckets,
+    and the late records of the level are merged in. A partly written final record is ignored.
+
+    ##### Parameters:
+    - dir: str
+        - path to the .pyramid folder
+    - width_s: int
+        - width in seconds of the buckets of the level
+    - start: np.datetime64 = None
+        - start of the time window, unbounded if None
+    - end: np.datetime64 = None
+        - end of the time window, unbounded if None
+
+    ##### Returns:
+    - header: list[str]
+        - header of the data, None if the level has not been written
+    - records: np.ndarray
+        - one record for each bucket overlapping the window, in bucket order
+    """
+    width_us = width_s * 1_000_000
+    first_bucket = np.datetime64(start, 'us').astype(np.int64) // width_us if start is not None else None
+    last_bucket = np.datetime64(end, 'us').astype(np.int64) // width_us if end is not None else None
+    try:  # try read the level, it does not exist until its first bucket is complete
+        with open(level_path(dir, width_s), 'rb') as f:
+            header = json.loads(f.readline())
+            dtype = record_dtype(len(header) - 1)
+            offset = f.tell()
+            num_records = (os.fstat(f.fileno()).st_size - offset) // dtype.itemsize
+            records = np.empty(0, dtype=dtype)
+            if num_records > 0:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapping:
+                    mapped = np.frombuffer(mapping, dtype=dtype, count=num_records, offset=offset)
+                    first = np.searchsorted(mapped['bucket'], first_bucket, side='left') if start is not None else 0
+                    last = np.searchsorted(mapped['bucket'], last_bucket, side='right') if end is not None else num_records
+                    records = mapped[first:last].copy()
+                    # release the view of the mapping so it can be closed
+                    del mapped
+    except FileNotFoundError:
+        return None, np.empty(0, dtype=record_dtype(0))
+    late_records = read_late(dir, width_s, dtype, first_bucket, last_bucket)
+    return header, select_window(np.concatenate((records, late_records)), width_s, start, end)
+
+def read_late(
+    dir: str,
+    width_s: int,
+    dtype: np.dtype,
+    first_bucket: int = None,
+    last_bucket: int = None
+):
+    """
+    #### Read the records of a level older than the last record of its level file, within a range of buckets
+
+    The late records file is memory-mapped and only the records within the range are copied.
+
+    ##### Parameters:
+    - dir: str
+        - path to the .pyramid folder
+    - width_s: int
+        - width in seconds of the buckets of the level
+    - dtype: np.dtype
+        - dtype of the records of the level
+    - first_bucket: int = None
+        - first bucket of the range, unbounded if None
+    - last_bucket: int = None
+        - last bucket of the range, unbounded if None
+
+    ##### Returns:
+    - records: np.ndarray
+        - the late records within the range in the order they were written, empty if there are none
+    """
+    try:  # try read the late records, the file only exists once a record was written out of order
+        with open(late_path(dir, width_s), 'rb') as f:
+            num_records = os.fstat(f.fileno()).st_size // dtype.itemsize
+            if num_records == 0:
+                return np.empty(0, dtype=dtype)
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapping:
+                mapped = np.frombuffer(mapping, dtype=dtype, count=num_records)
+                is_selected = np.ones(num_records, dtype=bool)
+                if first_bucket is not None:
+                    is_selected &= mapped['bucket'] >= first_bucket
+                if last_bucket is not None:
+                    is_selected &= mapped['bucket'] <= last_bucket
+                records = mapped[is_selected]
+                # release the view of the mapping so it can be closed
+                del mapped
+    except FileNotFoundError:
+        return np.empty(0, dtype=dtype)
+    return records
+
+def select_window(
+    records: np.ndarray,
+    width_s: int,
+    start: np.datetime64 = None,
+    end: np.datetime64 = None
+):
+    """
+    #### Merge records and select the buckets overlapping a time window
+
+    ##### Parameters:
+    - records: np.ndarray
+        - bucket records in any order
+    - width_s: int
+        - width in seconds of the buckets
+    - start: np.datetime64 = None
+        - start of the time window, unbounded if None
+    - end: np.datetime64 = None
+        - end of the time window, unbounded if None
+
+    ##### Returns:
+    - records: np.ndarray
+        - one record for each bucket overlapping the window, in bucket order
+    """
+    width_us = width_s * 1_000_000
+    is_selected = np.ones(len(records), dtype=bool)
+    if start is not None:
+        is_selected &= records['bucket'] >= np.datetime64(start, 'us').astype(np.int64) // width_us
+    if end is not None:
+        is_selected &= records['bucket'] <= np.datetime64(end, 'us').astype(np.int64) // width_us
+    return merge_records(records[is_selected])
+
+def choose_level(
+    start: np.datetime64,
+    end: np.datetime64,
+    pixels: int
+):
+    """
+    #### Choose the coarsest level that still has a bucket for each pixel of a time window
+
+    ##### Parameters:
+    - start: np.datetime64
+        - start of the time window
+    - end: np.datetime64
+        - end of the time window
+    - pixels: int
+        - width in pixels the window is plotted over
+
+    ##### Returns:
+    - width_s: int
+        - width in seconds of the buckets of the level, None if even the finest level is too coarse and the raw samples are needed
+    """
+    window_s = (np.datetime64(end, 'us') - np.datetime64(start, 'us')) / np.timedelta64(1, 's')
+    fitting_widths = [width_s for width_s in LEVEL_WIDTHS_S if window_s / width_s >= pixels]
+    return max(fitting_widths) if fitting_widths else None
+
+def summarise(
+    records: np.ndarray,
+    width_s: int
+):
+    """
+    #### Get the timestamp and the minimum, maximum, mean and RMS of each channel of bucket records
+
+    ##### Parameters:
+    - records: np.ndarray
+        - one record for each bucket, in bucket order
+    - width_s: int
+        - width in seconds of the buckets
+
+    ##### Returns:
+    - timestamps: np.ndarray
+        - datetime64[us] start of each bucket
+    - minimum: np.ndarray
+        - float32 array of shape (number of channels, number of buckets), NaN for a channel with no values in a bucket
+    - maximum: np.ndarray
+        - float32 array of shape (number of channels, number of buckets)
+    - mean: np.ndarray
+        - float32 array of shape (number of channels, number of buckets)
+    - rms: np.ndarray
+        - float32 array of shape (number of channels, number of buckets)
+    """
+    timestamps = (records['bucket'] * (width_s * 1_000_000)).astype('datetime64[us]')
+    count = records['count'].T.astype(np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = (records['sum'].T / count).astype(np.float32)
+        rms = np.sqrt(records['sumsq'].T / count).astype(np.float32)
+    return timestamps, records['min'].T, records['max'].T, mean, rms
+
+class Pyramid:
+    """
+    #### Writer of the levels of a stream, updated from each batch as it is written
+
+    Only used from the writer thread of the stream.
+    """
+
+    def __init__(
+        self,
+        dir: str,
+        header: list[str]
+    ):
+        """
+        #### Create the writer, creating the .pyramid folder if it does not exist
+
+        ##### Parameters:
+        - dir: str
+            - path to the .pyramid folder
+        - header: list[str]
+            - header of the data
+        """
+        self.dir = dir
+        self.header = header
+        os.makedirs(dir, exist_ok=True)
+        self._files = {}
+        self._late_files = {}
+        self._open_records = {width_s: np.empty(0, dtype=record_dtype(len(header) - 1)) for width_s in LEVEL_WIDTHS_S}
+
+    def _open(self, width_s: int):
+        """
+        #### Open the file of a level for appending, writing the header if the file is new and dropping a partly written final record
+
+        A level file replaced by another process trimming it is reopened.
+
+        ##### Returns:
+        - f: BufferedRandom
+            - the level file
+        - header_bytes: int
+            - length of the header line
+        """
+        path = level_path(self.dir, width_s)
+        if width_s in self._files:
+            f, header_bytes = self._files[width_s]
+            try:  # try check the open file is still the level file
+                if os.stat(path).st_ino == os.fstat(f.fileno()).st_ino:
+                    return f, header_bytes
+            except FileNotFoundError:
+                pass
+            f.close()
+            del self._files[width_s]
+        f = open(path, 'a+b')
+        f.seek(0)
+        header_line = f.readline()
+        if not header_line:
+            header_line = (json.dumps(self.header) + '\n').encode()
+            f.write(header_line)
+            f.flush()
+        dtype = self._open_records[width_s].dtype
+        size = os.fstat(f.fileno()).st_size
+        whole_size = size - (size - len(header_line)) % dtype.itemsize
+        if whole_size != size:
+            f.truncate(whole_size)
+        self._files[width_s] = (f, len(header_line))
+        return self._files[width_s]
+
+    def _open_late(self, width_s: int):
+        """
+        #### Open the late records file of a level for appending
+
+        A late records file removed by another process merging it into the level file is reopened,
+        so the records are not written to the removed file.
+
+        ##### Returns:
+        - f: BufferedWriter
+            - the late records file
+        """
+        path = late_path(self.dir, width_s)
+        if width_s in self._late_files:
+            f = self._late_files[width_s]
+            try:  # try check the open file is still the late records file
+                if os.stat(path).st_ino == os.fstat(f.fileno()).st_ino:
+                    return f
+            except FileNotFoundError:
+                pass
+            f.close()
+            del self._late_files[width_s]
+        self._late_files[width_s] = open(path, 'ab')
+        return self._late_files[width_s]
+
+    def _write(
+        self,
+        width_s: int,
+        records: np.ndarray
+    ):
+        """
+        #### Append completed bucket records to the file of a level, and the records older than its last record to its late records file
+        """
+        if len(records) == 0:
+            return
+        f, header_bytes = self._open(width_s)
+        dtype = records.dtype
+        size = os.fstat(f.fileno()).st_size
+        num_late = 0
+        if size > header_bytes:
+            # the file is opened in append mode, so reading the last record does not move where the records are written
+            f.seek(size - dtype.itemsize)
+            last_bucket = np.frombuffer(f.read(dtype.itemsize), dtype=dtype)['bucket'][0]
+            num_late = int(np.searchsorted(records['bucket'], last_bucket, side='left'))
+        if num_late < len(records):
+            f.write(records[num_late:].tobytes())
+            f.flush()
+        if num_late > 0:
+            late_file = self._open_late(width_s)
+            late_file.write(records[:num_late].tobytes())
+            late_file.flush()
+            if os.fstat(late_file.fileno()).st_size // dtype.itemsize > MAX_LATE_RECORDS:
+                self._merge_late(width_s)
+
+    def _merge_late(self, width_s: int):
+        """
+        #### Merge the late records of a level back into its level file, then remove the late records file
+
+        Only the records of the level file from the oldest late bucket are rewritten, in place and in bucket order.
+        Records of the same bucket are kept side by side rather than merged, so the level file never shrinks under a reader that has mapped it.
+        """
+        dtype = self._open_records[width_s].dtype
+        late_records = read_late(self.dir, width_s, dtype)
+        if len(late_records) == 0:
+            return
+        f, header_bytes = self._open(width_s)
+        num_records = (os.fstat(f.fileno()).st_size - header_bytes) // dtype.itemsize
+        buckets = np.empty(0, dtype=np.int64)
+        if num_records > 0:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapping:
+                buckets = np.frombuffer(mapping, dtype=dtype, count=num_records, offset=header_bytes)['bucket'].copy()
+        first = int(np.searchsorted(buckets, late_records['bucket'].min(), side='left'))
+        f.seek(header_bytes + first * dtype.itemsize)
+        tail = np.frombuffer(f.read((num_records - first) * dtype.itemsize), dtype=dtype)
+        merged = np.concatenate((tail, late_records))
+        merged = merged[np.argsort(merged['bucket'], kind='stable')]
+        # the level file is opened in append mode, so the records are rewritten through a second handle
+        with open(level_path(self.dir, width_s), 'r+b') as level_file:
+            level_file.seek(header_bytes + first * dtype.itemsize)
+            level_file.write(merged.tobytes())
+        if width_s in self._late_files:
+            self._late_files.pop(width_s).close()
+        try:  # try remove the late records merged into the level file
+            os.remove(late_path(self.dir, width_s))
+        except FileNotFoundError:
+            pass
+
+    def trim(self, before: np.datetime64):
+        """
+        #### Rewrite each level without the buckets before a time, such as before the oldest data kept by the retention limits,
+        merging its late records back into the level file
+
+        Each level is written to a new file renamed over the level file, so readers see either the old or the new level.
+
+        ##### Parameters:
+        - before: np.datetime64
+            - buckets ending before this time are removed
+
+        ##### Returns:
+        - None
+        """
+        for width_s in LEVEL_WIDTHS_S:
+            path = level_path(self.dir, width_s)
+            header, records = read_level(self.dir, width_s, before)
+            if header is None:
+                continue
+            self._close_files(width_s)
+            part_path = path + '.part'
+            with open(part_path, 'wb') as f:
+                f.write((json.dumps(header) + '\n').encode())
+                f.write(records.tobytes())
+            os.replace(part_path, path)
+            try:  # try remove the late records merged into the level file
+                os.remove(late_path(self.dir, width_s))
+            except FileNotFoundError:
+                pass
+
+    def _close_files(self, width_s: int):
+        """
+        #### Close the level file and the late records file of a level
+        """
+        if width_s in self._files:
+            self._files.pop(width_s)[0].close()
+        if width_s in self._late_files:
+            self._late_files.pop(width_s).close()
+
+    def update(
+        self,
+        timestamps: np.ndarray,
+        channels: np.ndarray
+    ):
+        """
+        #### Add samples to every level, writing the buckets completed by them
+
+        ##### Parameters:
+        - timestamps: np.ndarray
+            - datetime64[us] timestamp of each sample
+        - channels: np.ndarray
+            - float32 array of shape (number of channels, number of samples)
+
+        ##### Returns:
+        - None
+        """
+        if len(timestamps) == 0:
+            return
+        for width_s in LEVEL_WIDTHS_S:
+            records = merge_records(np.concatenate((self._open_records[width_s], aggregate(timestamps, channels, width_s))))
+            self._write(width_s, records[:-1])
+            self._open_records[width_s] = records[-1:]
+
+    def read(
+        self,
+        width_s: int,
+        start: np.datetime64 = None,
+        end: np.datetime64 = None
+    ):
+        """
+        #### Read the records of a level overlapping a time window, including the bucket still filling
+
+        ##### Parameters:
+        - width_s: int
+            - width in seconds of the buckets of the level
+        - start: np.datetime64 = None
+            - start of the time window, unbounded if None
+        - end: np.datetime64 = None
+            - end of the time window, unbounded if None
+
+        ##### Returns:
+        - records: np.ndarray
+            - one record for each bucket overlapping the window, in bucket order
+        """
+        _, records = read_level(self.dir, width_s, start, end)
+        if len(records) == 0:
+            records = np.empty(0, dtype=self._open_records[width_s].dtype)
+        return select_window(np.concatenate((records, self._open_records[width_s])), width_s, start, end)
+
+    def close(self):
+        """
+        #### Write the buckets still filling, merge the late records back into the level files and close them
+
+        ##### Returns:
+        - None
+        """
+        for width_s, records in self._open_records.items():
+            self._write(width_s, records)
+            self._open_records[width_s] = records[:0]
+            self._merge_late(width_s)
+            self._close_files(width_s)
@@ -1,41 +1,25 @@
 """
 Functions for handling files.
 For use with the Python web application for CR1000 data logging.
-Hard codes files as .csv along with main.py
 
 Author: Liam Eime
 Date: 12/12/2023
 """
 
-import pandas as pd
 import os
 
-def set_num_file_limit(
-    dir: str,
-    max_num_of_files: int
-):
-    """
-    #### Set a limit to the number of files allowed in the directory
+# .py file imports
+import storage
 
-    ##### Parameters:
-    - dir: str
-        - directory in which to set the file count limit 
-    - max_num_of_files: int
-        - number of files to limit directory to
-
-    ##### Returns:
-    - None
-    """
-    list_of_files = [os.path.abspath(name) for name in os.listdir(dir) if os.path.isfile(os.path.join(dir, name))]
-    if len(list_of_files) > max_num_of_files:
-        oldest_file = sorted([os.path.join(dir, f) for f in os.listdir(dir)], key=os.path.getctime)[0]
-        os.remove(oldest_file)
+# added to the output filename of the archives merged by the compactor
+ARCHIVE_SUFFIX = "_archive"
 
 def create_timestamped_filepath(
     initial_timestamp: str,
     final_timestamp: str,
     filename_to_timestamp: str,
-    dir: str
+    dir: str,
+    extension: str = '.csv'
 ):
     """
     #### Add timestamp to file and combine with directory to created timestamped file
@@ -49,35 +33,98 @@ def create_timestamped_filepath(
         - filename to add timestamp to
     - dir: str
         - directory to join filename to make path
+    - extension: str = '.csv'
+        - file extension of the storage backend
 
     ##### Returns:
         - new_path: str
             - path to timestamped file    
     """
     total_timestamp = f"{initial_timestamp}-{final_timestamp}"
-    new_filename = filename_to_timestamp + ' %s.csv' % total_timestamp
+    new_filename = filename_to_timestamp + ' %s%s' % (total_timestamp, extension)
     new_path = os.path.join(dir, new_filename)
     return new_path
 
-def read_latest_csv_to_dataframe(
+def is_archive(path: str):
+    """
+    #### Check whether a data file is an archive merged by the compactor
+
+    ##### Parameters:
+    - path: str
+        - path to the data file
+
+    ##### Returns:
+    - is_archive: bool
+        - True if the file is an archive
+    """
+    return f"{ARCHIVE_SUFFIX} " in os.path.basename(path)
+
+def get_latest_filepath(
+    path_to_folder: str,
+    extension: str = ''
+):
+    """
+    #### Get the path to the latest file in folder
+
+    ##### Parameters:
+    - path_to_folder: str
+        - path to the folder to get the latest file from
+    - extension: str = ''
+        - only consider files with this extension, all files if empty, hidden files such as the .hotstore ring buffer and archives are never considered
+
+    ##### Returns:
+    - latest_path: str
+        - path to the latest file
+    - returns None if there are no files in the folder
+    """
+    list_of_files = [os.path.join(path_to_folder, name) for name in os.listdir(path_to_folder) if name.endswith(extension) and not name.startswith('.') and not is_archive(name) and os.path.isfile(os.path.join(path_to_folder, name))]
+    if not list_of_files:
+        return None
+    latest_path = max(list_of_files, key=os.path.getctime)
+    return latest_path
+
+def count_data_rows(
+    file_path: str
+):
+    """
+    #### Count the number of data rows in a csv file, not including the header
+
+    ##### Parameters:
+    - file_path: str
+        - path to the csv file
+
+    ##### Returns:
+    - num_rows: int
+        - number of data rows in the file
+    """
+    num_lines = 0
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            num_lines += block.count(b'\n')
+    num_rows = max(num_lines - 1, 0)
+    return num_rows
+
+def read_latest_data(
     path_to_folder: str
 ):
     """
-    #### Read latest file from folder and read as csv to data frame object
+    #### Read latest file from folder to arrays, through the storage backend that wrote it
 
     ##### Parameters:
     - path_to_folder: str
         - path to the folder to read the latest file from
 
     ##### Returns:
-    - df: Dataframe
-        - dataframe object for csv file
+    - header: list[str]
+        - header of the data
+    - timestamps: np.ndarray
+        - datetime64[us] timestamp of each sample
+    - channels: np.ndarray
+        - float32 array of shape (number of channels, number of samples)
     - returns None on error
     """
-    try:  # try read latest file from folder and read as csv to data frame object
-        list_of_files = [os.path.abspath(name) for name in os.listdir(path_to_folder) if os.path.isfile(os.path.join(path_to_folder, name))]
-        newest = sorted([os.path.join(path_to_folder, f) for f in os.listdir(path_to_folder)], key=os.path.getctime)[len(list_of_files) - 1]
-        df = pd.read_csv(newest)
-        return df
+    try:  # try read latest file from folder to arrays
+        newest = get_latest_filepath(path_to_folder)
+        return storage.get_backend_for_path(newest).read(newest)
     except Exception:
-        pass
\ No newline at end of file
+        pass
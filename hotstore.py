@@ -0,0 +1,337 @@
+"""
+Memory-mapped ring buffer of the most recent samples of each logger and stream, shared with other processes.
+For use with the Python web application for CR1000 data logging.
+
+The ingest server appends each batch to a fixed size file in the stream's output folder,
+holding a header followed by a ring of records of the timestamp, as integer epoch micro-seconds, and the float32 channels.\n
+Analysis processes map the file read-only with RingReader and copy out a time window with no parsing and no locks.
+The writer increments a sequence counter before and after each append, so the counter is odd while an append is in progress,
+and a reader that sees the counter change while copying discards the copy and tries again.
+
+Author: Liam Eime
+Date: 12/12/2023
+"""
+
+# Python imports
+import os
+import mmap
+import json
+import time
+import numpy as np
+
+# .py file imports
+import locks
+
+HOTSTORE_FILENAME = ".hotstore"
+MAGIC = b"DLRING01"
+
+# fixed fields at the start of the file, followed by the json header of the data and the records from header_size bytes
+META_DTYPE = np.dtype([
+    ('magic', 'S8'),
+    ('header_size', '<u8'),
+    ('capacity', '<u8'),
+    ('num_channels', '<u8'),
+    ('sequence', '<u8'),
+    ('total', '<u8'),
+    ('header_length', '<u8')
+])
+HEADER_OFFSET = 64
+PAGE_SIZE = 4096
+
+def record_dtype(num_channels: int):
+    """
+    #### Get the dtype of the ring records
+
+    ##### Parameters:
+    - num_channels: int
+        - number of channels after the timestamp
+
+    ##### Returns:
+    - dtype: np.dtype
+        - structured dtype of a record
+    """
+    return np.dtype([('timestamp', '<i8'), ('channels', '<f4', (num_channels,))])
+
+def hotstore_path(dir: str):
+    """
+    #### Get the path to the ring buffer of a stream
+
+    ##### Parameters:
+    - dir: str
+        - output folder of the stream
+
+    ##### Returns:
+    - path: str
+        - path to the ring buffer file
+    """
+    return os.path.join(dir, HOTSTORE_FILENAME)
+
+def _map(
+    path: str,
+    is_writable: bool
+):
+    """
+    #### Map a ring buffer file and get views of its fields, header and records
+
+    ##### Returns:
+    - mapping: mmap.mmap
+        - the mapping, to be closed once the views are no longer used
+    - meta: np.ndarray
+        - view of the fixed fields
+    - header: list[str]
+        - header of the data
+    - records: np.ndarray
+        - view of the records, in ring order
+    """
+    with open(path, 'r+b' if is_writable else 'rb') as f:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_WRITE if is_writable else mmap.ACCESS_READ)
+    meta = np.ndarray((), dtype=META_DTYPE, buffer=mapping)
+    if bytes(meta['magic']) != MAGIC:
+        del meta
+        mapping.close()
+        raise ValueError(f"{path} is not a ring buffer file")
+    header = json.loads(mapping[HEADER_OFFSET:HEADER_OFFSET + int(meta['header_length'])])
+    records = np.ndarray(int(meta['capacity']), dtype=record_dtype(int(meta['num_channels'])), buffer=mapping, offset=int(meta['header_size']))
+    return mapping, meta, header, records
+
+class RingWriter:
+    """
+    #### Writer of the ring buffer of a stream, only used from the writer thread of the stream
+
+    With several worker processes, the appends are made while holding the stream's shared state lock, so there is only one writer at a time.
+    """
+
+    def __init__(
+        self,
+        dir: str,
+        header: list[str],
+        capacity: int
+    ):
+        """
+        #### Map the ring buffer of a stream, creating it if it does not exist or has a different header or capacity
+
+        The samples already in a matching ring buffer are kept, so they survive a restart.
+
+        ##### Parameters:
+        - dir: str
+            - output folder of the stream
+        - header: list[str]
+            - header of the data
+        - capacity: int
+            - number of the most recent samples kept
+        """
+        self.path = hotstore_path(dir)
+        self.header = header
+        self.capacity = capacity
+        with locks.FileLock(self.path + ".lock"):
+            if not self._is_matching():
+                self._create()
+            self._mapping, self._meta, _, self._records = _map(self.path, is_writable=True)
+
+    def _is_matching(self):
+        """
+        #### Check the existing ring buffer file has the same header and capacity
+        """
+        try:  # try read the existing ring buffer
+            mapping, meta, header, records = _map(self.path, is_writable=False)
+        except (OSError, ValueError):
+            return False
+        is_matching = header == self.header and int(meta['capacity']) == self.capacity
+        del meta, records
+        mapping.close()
+        return is_matching
+
+    def _create(self):
+        """
+        #### Create an empty ring buffer file, replacing any existing file
+        """
+        header_bytes = json.dumps(self.header).encode()
+        header_size = -(-(HEADER_OFFSET + len(header_bytes)) // PAGE_SIZE) * PAGE_SIZE
+        meta = np.zeros((), dtype=META_DTYPE)
+        meta['magic'] = MAGIC
+        meta['header_size'] = header_size
+        meta['capacity'] = self.capacity
+        meta['num_channels'] = len(self.header) - 1
+        meta['header_length'] = len(header_bytes)
+        temp_path = self.path + ".part"
+        with open(temp_path, 'wb') as f:
+            f.write(meta.tobytes().ljust(HEADER_OFFSET, b'\0'))
+            f.write(header_bytes)
+            f.truncate(header_size + self.capacity * record_dtype(len(self.header) - 1).itemsize)
+        os.replace(temp_path, self.path)
+
+    def append(
+        self,
+        timestamps: np.ndarray,
+        channels: np.ndarray
+    ):
+        """
+        #### Append samples, overwriting the oldest samples once full
+
+        ##### Parameters:
+        - timestamps: np.ndarray
+            - datetime64[us] timestamp of each sample
+        - channels: np.ndarray
+            - float32 array of shape (number of channels, number of samples)
+
+        ##### Returns:
+        - None
+        """
+        if self.capacity == 0 or len(timestamps) == 0:
+            return
+        timestamps = timestamps[-self.capacity:]
+        channels = channels[:, -self.capacity:]
+        num_new = len(timestamps)
+        total = int(self._meta['total'])
+        end = total % self.capacity
+        first = min(num_new, self.capacity - end)
+        # an odd sequence tells readers an append is in progress
+        self._meta['sequence'] += 1
+        self._records['timestamp'][end:end + first] = timestamps[:first].astype(np.int64)
+        self._records['channels'][end:end + first] = channels[:, :first].T
+        self._records['timestamp'][:num_new - first] = timestamps[first:].astype(np.int64)
+        self._records['channels'][:num_new - first] = channels[:, first:].T
+        self._meta['total'] = total + num_new
+        self._meta['sequence'] += 1
+
+    def close(self):
+        """
+        #### Unmap the ring buffer, leaving its samples in the file
+
+        ##### Returns:
+        - None
+        """
+        del self._meta, self._records
+        self._mapping.close()
+
+class RingReader:
+    """
+    #### Read-only mapping of the ring buffer of a stream, for analysis processes
+
+    Reads never block the ingest server. A ring buffer recreated by the server with a different header or capacity needs a new reader.
+    Can be used as a context manager to close the mapping.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_retries: int = 1000
+    ):
+        """
+        #### Map a ring buffer read-only
+
+        ##### Parameters:
+        - path: str
+            - path to the ring buffer file, or to the output folder of the stream
+        - max_retries: int = 1000
+            - number of times a copy is tried again when an append happens during it
+        """
+        if os.path.isdir(path):
+            path = hotstore_path(path)
+        self.path = path
+        self.max_retries = max_retries
+        self._mapping, self._meta, self.header, self._records = _map(path, is_writable=False)
+        self.capacity = len(self._records)
+
+    def _copy(self, select):
+        """
+        #### Copy the records chosen by a function of the oldest and newest positions, retrying until no append happened during the copy
+
+        ##### Returns:
+        - timestamps: np.ndarray
+            - datetime64[us] timestamp of each sample
+        - channels: np.ndarray
+            - float32 array of shape (number of channels, number of samples)
+        """
+        for _ in range(self.max_retries):
+            sequence = int(self._meta['sequence'])
+            if sequence % 2:
+                time.sleep(0)
+                continue
+            total = int(self._meta['total'])
+            oldest = max(0, total - self.capacity)
+            first, last = select(oldest, total)
+            positions = np.arange(max(first, oldest), min(last, total)) % self.capacity if self.capacity else np.arange(0)
+            records = self._records[positions]
+            if int(self._meta['sequence']) == sequence:
+                return records['timestamp'].astype('datetime64[us]'), records['channels'].T.copy()
+            time.sleep(0)
+        raise TimeoutError(f"The ring buffer {self.path} was appended to during each of {self.max_retries} copies")
+
+    def _search(
+        self,
+        oldest: int,
+        total: int,
+        value: np.datetime64,
+        side: str
+    ):
+        """
+        #### Find the position of a timestamp among the samples in the ring, which are in time order
+        """
+        value = np.datetime64(value, 'us').astype(np.int64)
+        end = total % self.capacity
+        if total - oldest < self.capacity or end == 0:
+            return oldest + int(np.searchsorted(self._records['timestamp'][oldest % self.capacity:end or self.capacity], value, side=side))
+        # the ring has wrapped, the oldest samples are after the end position
+        older = np.searchsorted(self._records['timestamp'][end:], value, side=side)
+        if older < self.capacity - end:
+            return oldest + int(older)
+        return oldest + self.capacity - end + int(np.searchsorted(self._records['timestamp'][:end], value, side=side))
+
+    def read(
+        self,
+        start: np.datetime64 = None,
+        end: np.datetime64 = None
+    ):
+        """
+        #### Copy the samples in a time window
+
+        ##### Parameters:
+        - start: np.datetime64 = None
+            - start of the time window, from the oldest sample if None
+        - end: np.datetime64 = None
+            - end of the time window, to the newest sample if None
+
+        ##### Returns:
+        - timestamps: np.ndarray
+            - datetime64[us] timestamp of each sample
+        - channels: np.ndarray
+            - float32 array of shape (number of channels, number of samples)
+        """
+        def select(oldest: int, total: int):
+            first = oldest if start is None or total == oldest else self._search(oldest, total, start, 'left')
+            last = total if end is None or total == oldest else self._search(oldest, total, end, 'right')
+            return first, last
+        return self._copy(select)
+
+    def tail(self, num_rows: int):
+        """
+        #### Copy the most recent samples
+
+        ##### Parameters:
+        - num_rows: int
+            - number of samples to copy
+
+        ##### Returns:
+        - timestamps: np.ndarray
+            - datetime64[us] timestamp of each sample
+        - channels: np.ndarray
+            - float32 array of shape (number of channels, number of samples)
+        """
+        return self._copy(lambda oldest, total: (total - num_rows, total))
+
+    def close(self):
+        """
+        #### Unmap the ring buffer
+
+        ##### Returns:
+        - None
+        """
+        del self._meta, self._records
+        self._mapping.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,334 @@
+"""
+Persistent index of the time range and channel statistics of each data file.
+For use with the Python web application for CR1000 data logging.
+
+The index is kept in an sqlite database in the output directory, updated by the writers as each file is completed,
+so finding the files for a time window does not need a directory scan or any filenames to be parsed.\n
+It can be rebuilt from a directory scan by running this file:
+    python index.py
+
+Author: Liam Eime
+Date: 12/12/2023
+"""
+
+# Python imports
+import os
+import json
+import sqlite3
+import threading
+import numpy as np
+
+# .py file imports
+import storage
+import timestamp
+import metrics
+
+class FileIndex:
+    """
+    #### Index of the data files in the output folders
+
+    Each row holds the folder and filename of a data file, its initial and final timestamps as integer epoch micro-seconds,
+    its number of rows, and the minimum and maximum of each channel.
+    """
+
+    def __init__(self, db_path: str):
+        """
+        #### Open the index, creating it if it does not exist
+
+        ##### Parameters:
+        - db_path: str
+            - path to the sqlite database file
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                folder TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                start_us INTEGER NOT NULL,
+                end_us INTEGER NOT NULL,
+                num_rows INTEGER NOT NULL,
+                header TEXT NOT NULL,
+                channel_min TEXT NOT NULL,
+                channel_max TEXT NOT NULL,
+                PRIMARY KEY (folder, filename)
+            );
+            CREATE INDEX IF NOT EXISTS files_by_start ON files (folder, start_us);
+        """)
+        self._connection.commit()
+
+    def add_file(
+        self,
+        path: str,
+        header: list[str],
+        initial_timestamp: np.datetime64,
+        final_timestamp: np.datetime64,
+        num_rows: int,
+        channel_min: np.ndarray,
+        channel_max: np.ndarray
+    ):
+        """
+        #### Add a completed data file to the index, replacing any previous entry for it
+
+        ##### Parameters:
+        - path: str
+            - path to the data file
+        - header: list[str]
+            - header of the data
+        - initial_timestamp: np.datetime64
+            - initial timestamp of the file
+        - final_timestamp: np.datetime64
+            - final timestamp of the file
+        - num_rows: int
+            - number of rows in the file
+        - channel_min: np.ndarray
+            - minimum of each channel, NaN if a channel has no values
+        - channel_max: np.ndarray
+            - maximum of each channel, NaN if a channel has no values
+
+        ##### Returns:
+        - None
+        """
+        folder, filename = os.path.split(path)
+        row = (
+            folder,
+            filename,
+            timestamp.to_microseconds(initial_timestamp),
+            timestamp.to_microseconds(final_timestamp),
+            int(num_rows),
+            json.dumps(header),
+            json.dumps([None if np.isnan(value) else float(value) for value in channel_min]),
+            json.dumps([None if np.isnan(value) else float(value) for value in channel_max])
+        )
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)", row)
+            self._connection.commit()
+
+    def add_file_from_disk(self, path: str):
+        """
+        #### Read a data file and add it to the index
+
+        ##### Parameters:
+        - path: str
+            - path to the data file
+
+        ##### Returns:
+        - None
+        """
+        header, timestamps, channels = storage.get_backend_for_path(path).read(path)
+        if len(timestamps) == 0:
+            return
+        channel_min, channel_max = channel_range(channels)
+        self.add_file(path, header, timestamps[0], timestamps[-1], len(timestamps), channel_min, channel_max)
+
+    def remove_files(self, paths: list[str]):
+        """
+        #### Remove data files from the index
+
+        ##### Parameters:
+        - paths: list[str]
+            - paths to the data files
+
+        ##### Returns:
+        - None
+        """
+        with self._lock:
+            self._connection.executemany("DELETE FROM files WHERE folder = ? AND filename = ?", [os.path.split(path) for path in paths])
+            self._connection.commit()
+
+    def files_added_since(self, rowid: int):
+        """
+        #### Get the data files added to the index after a row id, including files added by other processes
+
+        ##### Parameters:
+        - rowid: int
+            - row id of the last file already seen, 0 for every file
+
+        ##### Returns:
+        - added_files: list[tuple[int, str]]
+            - row id and path of each file added since, in the order they were added
+        """
+        with self._lock:
+            rows = self._connection.execute("SELECT rowid, folder, filename FROM files WHERE rowid > ? ORDER BY rowid", (rowid,)).fetchall()
+        added_files = [(row_id, os.path.join(folder, filename)) for row_id, folder, filename in rows]
+        return added_files
+
+    def find_files(
+        self,
+        folder: str,
+        start: np.datetime64 = None,
+        end: np.datetime64 = None
+    ):
+        """
+        #### Find the data files in a folder overlapping a time window, in time order
+
+        ##### Parameters:
+        - folder: str
+            - folder of the data files
+        - start: np.datetime64 = None
+            - start of the time window, unbounded if None
+        - end: np.datetime64 = None
+            - end of the time window, unbounded if None
+
+        ##### Returns:
+        - paths: list[str]
+            - paths to the overlapping data files
+        """
+        start_us = timestamp.to_microseconds(start) if start is not None else -2**63
+        end_us = timestamp.to_microseconds(end) if end is not None else 2**63 - 1
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT filename FROM files WHERE folder = ? AND start_us <= ? AND end_us >= ? ORDER BY start_us",
+                (folder, end_us, start_us)
+            ).fetchall()
+        paths = [os.path.join(folder, filename) for filename, in rows]
+        return paths
+
+    def time_range(self, folder: str):
+        """
+        #### Get the time range of the data files in a folder
+
+        ##### Parameters:
+        - folder: str
+            - folder of the data files
+
+        ##### Returns:
+        - start: np.datetime64
+            - initial timestamp of the earliest file, None if the folder has no indexed files
+        - end: np.datetime64
+            - final timestamp of the latest file, None if the folder has no indexed files
+        """
+        with self._lock:
+            start_us, end_us = self._connection.execute("SELECT MIN(start_us), MAX(end_us) FROM files WHERE folder = ?", (folder,)).fetchone()
+        if start_us is None:
+            return None, None
+        return np.datetime64(start_us, 'us'), np.datetime64(end_us, 'us')
+
+    def file_info(self, folder: str):
+        """
+        #### Get the index entries of every data file in a folder, in time order
+
+        ##### Parameters:
+        - folder: str
+            - folder of the data files
+
+        ##### Returns:
+        - entries: list[dict]
+            - path, start_us, end_us, num_rows, header, channel_min and channel_max of each file
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT filename, start_us, end_us, num_rows, header, channel_min, channel_max FROM files WHERE folder = ? ORDER BY start_us",
+                (folder,)
+            ).fetchall()
+        entries = [{
+            "path": os.path.join(folder, filename),
+            "start_us": start_us,
+            "end_us": end_us,
+            "num_rows": num_rows,
+            "header": json.loads(header),
+            "channel_min": json.loads(channel_min),
+            "channel_max": json.loads(channel_max)
+        } for filename, start_us, end_us, num_rows, header, channel_min, channel_max in rows]
+        return entries
+
+    def sync_folder(
+        self,
+        folder: str,
+        exclude: tuple[str] = ()
+    ):
+        """
+        #### Bring the index up to date with a directory scan of a folder
+
+        Data files missing from the index are read and added, and entries for files no longer in the folder are removed.
+        Dot-files, such as the hot store ring buffer, are not data files.
+
+        ##### Parameters:
+        - folder: str
+            - folder of the data files
+        - exclude: tuple[str] = ()
+            - paths to leave out of the index, such as the running files
+
+        ##### Returns:
+        - None
+        """
+        extensions = tuple(backend.extension for backend in storage.BACKENDS.values())
+        on_disk = {os.path.join(folder, name) for name in os.listdir(folder) if name.endswith(extensions) and not name.startswith(".")} - set(exclude)
+        with self._lock:
+            indexed = {os.path.join(folder, filename) for filename, in self._connection.execute("SELECT filename FROM files WHERE folder = ?", (folder,))}
+        self.remove_files(sorted(indexed - on_disk))
+        for path in sorted(on_disk - indexed):
+            try:  # try add the file, skipping files that can not be read
+                self.add_file_from_disk(path)
+            except Exception:
+                metrics.SWALLOWED_EXCEPTIONS.inc(where="index_sync")
+
+    def rebuild_folder(
+        self,
+        folder: str,
+        exclude: tuple[str] = ()
+    ):
+        """
+        #### Rebuild the index of a folder from a directory scan, re-reading every data file
+
+        ##### Parameters:
+        - folder: str
+            - folder of the data files
+        - exclude: tuple[str] = ()
+            - paths to leave out of the index, such as the running files
+
+        ##### Returns:
+        - None
+        """
+        with self._lock:
+            self._connection.execute("DELETE FROM files WHERE folder = ?", (folder,))
+            self._connection.commit()
+        self.sync_folder(folder, exclude)
+
+    def close(self):
+        """
+        #### Close the index database
+
+        ##### Returns:
+        - None
+        """
+        with self._lock:
+            self._connection.close()
+
+def channel_range(channels: np.ndarray):
+    """
+    #### Get the minimum and maximum of each channel, ignoring NaN values
+
+    ##### Parameters:
+    - channels: np.ndarray
+        - float32 array of shape (number of channels, number of samples)
+
+    ##### Returns:
+    - channel_min: np.ndarray
+        - minimum of each channel, NaN if a channel has no values
+    - channel_max: np.ndarray
+        - maximum of each channel, NaN if a channel has no values
+    """
+    if channels.shape[1] == 0:
+        return np.full(channels.shape[0], np.nan, dtype=np.float32), np.full(channels.shape[0], np.nan, dtype=np.float32)
+    return np.fmin.reduce(channels, axis=1), np.fmax.reduce(channels, axis=1)
+
+def main():
+    """
+    #### Rebuild the index of the low and high frequency folders from a directory scan
+    """
+    import config
+    settings = config.Settings()
+    file_index = FileIndex(os.path.join(settings.output_dir, settings.index_filename))
+    for folder_name, temp_filename in (
+        (settings.output_folder_low_freq, settings.temp_low_freq_filename),
+        (settings.output_folder_high_freq, settings.temp_high_freq_filename)
+    ):
+        folder = os.path.join(settings.output_dir, folder_name)
+        file_index.rebuild_folder(folder, exclude=tuple(os.path.join(folder, temp_filename) + backend.temp_extension for backend in storage.BACKENDS.values()))
+        print(f"Indexed {len(file_index.file_info(folder))} files in {folder}")
+    file_index.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,341 @@
+"""
+In-process publish and subscribe of the logger data as it is received, for live viewers.
+For use with the Python web application for CR1000 data logging.
+
+Each batch is published by the ingestion pipeline once it is written, without the duplicate and late rows, to the topic of its logger and stream,
+which keeps the most recent samples in a fixed size ring buffer and passes the batch to each subscriber's queue.\n
+New subscribers are sent the ring buffer first, so live viewers never read the output files.
+
+Author: Liam Eime
+Date: 12/12/2023
+"""
+
+# Python imports
+import asyncio
+import json
+import numpy as np
+
+# .py file imports
+import payload
+
+class RingBuffer:
+    """
+    #### Fixed size buffer of the most recent samples of a stream, overwriting the oldest samples once full
+    """
+
+    def __init__(
+        self,
+        num_channels: int,
+        capacity: int
+    ):
+        """
+        #### Create the ring buffer
+
+        ##### Parameters:
+        - num_channels: int
+            - number of channels of each sample
+        - capacity: int
+            - number of samples kept
+        """
+        self.capacity = capacity
+        self.timestamps = np.empty(capacity, dtype='datetime64[us]')
+        self.channels = np.empty((num_channels, capacity), dtype=np.float32)
+        self.start = 0
+        self.size = 0
+
+    def append(
+        self,
+        timestamps: np.ndarray,
+        channels: np.ndarray
+    ):
+        """
+        #### Append samples, overwriting the oldest samples once full
+
+        ##### Parameters:
+        - timestamps: np.ndarray
+            - datetime64[us] timestamp of each sample
+        - channels: np.ndarray
+            - float32 array of shape (number of channels, number of samples)
+
+        ##### Returns:
+        - None
+        """
+        if self.capacity == 0:
+            return
+        timestamps = timestamps[-self.capacity:]
+        channels = channels[:, -self.capacity:]
+        num_new = len(timestamps)
+        end = (self.start + self.size) % self.capacity
+        first = min(num_new, self.capacity - end)
+        self.timestamps[end:end + first] = timestamps[:first]
+        self.channels[:, end:end + first] = channels[:, :first]
+        self.timestamps[:num_new - first] = timestamps[first:]
+        self.channels[:, :num_new - first] = channels[:, first:]
+        overwritten = max(0, self.size + num_new - self.capacity)
+        self.start = (self.start + overwritten) % self.capacity
+        self.size = min(self.capacity, self.size + num_new)
+
+    def snapshot(self, duration_s: float = None):
+        """
+        #### Copy the samples in the buffer, oldest first
+
+        ##### Parameters:
+        - duration_s: float = None
+            - only copy the samples within this many seconds of the most recent sample, every sample if None
+
+        ##### Returns:
+        - timestamps: np.ndarray
+            - datetime64[us] timestamp of each sample
+        - channels: np.ndarray
+            - float32 array of shape (number of channels, number of samples)
+        """
+        order = (self.start + np.arange(self.size)) % self.capacity if self.capacity else np.arange(0)
+        timestamps = self.timestamps[order]
+        channels = self.channels[:, order]
+        if duration_s is not None and len(timestamps):
+            first = np.searchsorted(timestamps, timestamps[-1] - np.timedelta64(int(duration_s * 1_000_000), 'us'), side='left')
+            timestamps, channels = timestamps[first:], channels[:, first:]
+        return timestamps, channels
+
+class Subscription:
+    """
+    #### Queue of the batches published to a topic since a live viewer subscribed, with its channel selection and decimation
+
+    The queue is bounded, so a slow viewer drops its oldest batches rather than holding up the uploads.
+    """
+
+    def __init__(
+        self,
+        header: list[str],
+        channels: list[str] = None,
+        decimation: int = 1,
+        max_queue_size: int = 256
+    ):
+        """
+        #### Create the subscription, must be created within the running event loop
+
+        ##### Parameters:
+        - header: list[str]
+            - header of the topic's data
+        - channels: list[str] = None
+            - names of the channels to send, all channels if None
+        - decimation: int = 1
+            - only every decimation-th sample is sent
+        - max_queue_size: int = 256
+            - number of batches that can wait to be sent before the oldest batch is dropped
+        """
+        self.channel_indices = list(range(len(header) - 1)) if channels is None else [header.index(name) - 1 for name in channels]
+        self.header = [header[0]] + [header[i + 1] for i in self.channel_indices]
+        self.decimation = max(1, decimation)
+        self.queue = asyncio.Queue(maxsize=max_queue_size)
+        self.num_dropped = 0
+        self._offset = 0
+
+    def select(
+        self,
+        timestamps: np.ndarray,
+        channels: np.ndarray
+    ):
+        """
+        #### Select the channels and decimate samples, carrying the decimation on from the previous samples
+
+        ##### Parameters:
+        - timestamps: np.ndarray
+            - datetime64[us] timestamp of each sample
+        - channels: np.ndarray
+            - float32 array of shape (number of channels, number of samples)
+
+        ##### Returns:
+        - timestamps: np.ndarray
+            - datetime64[us] timestamp of each selected sample
+        - values: np.ndarray
+            - float32 array of shape (number of selected channels, number of selected samples)
+        """
+        first = (-self._offset) % self.decimation
+        self._offset = (self._offset + len(timestamps)) % self.decimation
+        return timestamps[first::self.decimation], channels[self.channel_indices, first::self.decimation]
+
+    def put(
+        self,
+        timestamps: np.ndarray,
+        channels: np.ndarray
+    ):
+        """
+        #### Queue samples to be sent, dropping the oldest queued samples if the queue is full
+
+        ##### Parameters:
+        - timestamps: np.ndarray
+            - datetime64[us] timestamp of each sample
+        - channels: np.ndarray
+            - float32 array of shape (number of channels, number of samples)
+
+        ##### Returns:
+        - None
+        """
+        timestamps, values = self.select(timestamps, channels)
+        if len(timestamps) == 0:
+            return
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.num_dropped += 1
+        self.queue.put_nowait((timestamps, values))
+
+class LiveHub:
+    """
+    #### Topics of the live data for each logger and stream
+
+    Publishing and subscribing only happen on the event loop, so a new subscriber's backfill and its queue never miss or repeat a batch.
+    """
+
+    def __init__(self, buffer_rows: int):
+        """
+        #### Create the hub
+
+        ##### Parameters:
+        - buffer_rows: int
+            - number of the most recent samples kept for each topic, to backfill new subscribers
+        """
+        self.buffer_rows = buffer_rows
+        self._buffers = {}
+        self._subscriptions = {}
+
+    def publish(
+        self,
+        logger_id: str,
+        stream: str,
+        batch: payload.DataBatch
+    ):
+        """
+        #### Publish a parsed batch to the subscribers of its logger and stream
+
+        ##### Parameters:
+        - logger_id: str
+            - identity of the logger, empty for the default logger
+        - stream: str
+            - either low or high
+        - batch: payload.DataBatch
+            - parsed samples
+
+        ##### Returns:
+        - None
+        """
+        key = (logger_id, stream)
+        if key not in self._buffers:
+            self._buffers[key] = RingBuffer(len(batch.header) - 1, self.buffer_rows)
+        self._buffers[key].append(batch.timestamps, batch.channels)
+        for subscription in self._subscriptions.get(key, ()):
+            subscription.put(batch.timestamps, batch.channels)
+
+    def subscribe(
+        self,
+        logger_id: str,
+        stream: str,
+        subscription: Subscription,
+        backfill_s: float = None
+    ):
+        """
+        #### Subscribe to a logger and stream, queueing the samples in its ring buffer first
+
+        ##### Parameters:
+        - logger_id: str
+            - identity of the logger, empty for the default logger
+        - stream: str
+            - either low or high
+        - subscription: Subscription
+            - subscription to queue the samples on
+        - backfill_s: float = None
+            - only backfill the samples within this many seconds of the most recent sample, the whole ring buffer if None
+
+        ##### Returns:
+        - None
+        """
+        key = (logger_id, stream)
+        if key in self._buffers:
+            subscription.put(*self._buffers[key].snapshot(backfill_s))
+        self._subscriptions.setdefault(key, set()).add(subscription)
+
+    def unsubscribe(
+        self,
+        logger_id: str,
+        stream: str,
+        subscription: Subscription
+    ):
+        """
+        #### Stop queueing samples for a subscription
+
+        ##### Returns:
+        - None
+        """
+        self._subscriptions.get((logger_id, stream), set()).discard(subscription)
+
+    def num_subscribers(self):
+        """
+        #### Get the number of subscriptions over every topic
+
+        ##### Returns:
+        - num_subscribers: int
+            - number of subscriptions
+        """
+        return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+def format_event(
+    header: list[str],
+    timestamps: np.ndarray,
+    values: np.ndarray
+):
+    """
+    #### Format samples as a server-sent event holding a json object of the header, timestamps and channel values
+
+    Missing and infinite values are sent as null, as json has no NaN or infinity.
+
+    ##### Parameters:
+    - header: list[str]
+        - header of the samples, the timestamp followed by the channels
+    - timestamps: np.ndarray
+        - datetime64[us] timestamp of each sample
+    - values: np.ndarray
+        - float32 array of shape (number of channels, number of samples)
+
+    ##### Returns:
+    - event: str
+        - the server-sent event text
+    """
+    value_strings = np.char.mod('%.7g', values).astype('U16')
+    value_strings[~np.isfinite(values)] = 'null'
+    columns = ','.join('[' + ','.join(row) + ']' for row in value_strings)
+    return (
+        f'data: {{"header":{json.dumps(header)},'
+        f'"timestamps":{json.dumps(payload.format_timestamps(timestamps).tolist())},'
+        f'"values":[{columns}]}}\n\n'
+    )
+
+async def iter_events(
+    subscription: Subscription,
+    keep_alive_s: float = 15
+):
+    """
+    #### Generate the server-sent events of a subscription, with a comment sent while idle to keep the connection open
+
+    ##### Parameters:
+    - subscription: Subscription
+        - subscription to send
+    - keep_alive_s: float = 15
+        - seconds without samples before a keep alive comment is sent
+
+    ##### Yields:
+    - event: str
+        - server-sent event text
+    """
+    while True:
+        # wait for samples, sending a keep alive comment if there are none for a while,
+        # with asyncio.wait rather than asyncio.wait_for, as wait_for can swallow the cancellation when the viewer disconnects
+        getter = asyncio.ensure_future(subscription.queue.get())
+        try:
+            await asyncio.wait((getter,), timeout=keep_alive_s)
+        finally:
+            getter.cancel()
+        if not getter.done() or getter.cancelled():
+            yield ": keep-alive\n\n"
+            continue
+        timestamps, values = getter.result()
+        yield format_event(subscription.header, timestamps, values)
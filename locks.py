@@ -0,0 +1,172 @@
+"""
+Cross-process file locks for coordinating several Uvicorn workers.
+For use with the Python web application for CR1000 data logging.
+
+Uses fcntl.flock on Linux and msvcrt.locking on Windows, so locks are released by the operating system if a worker dies.
+
+Author: Liam Eime
+Date: 12/12/2023
+"""
+
+# Python imports
+import os
+import json
+import time
+
+try:  # try import the POSIX file locking, falling back to the Windows file locking
+    import fcntl
+    msvcrt = None
+except ImportError:
+    import msvcrt
+    fcntl = None
+
+class FileLock:
+    """
+    #### Exclusive lock on a lock file, shared between processes
+
+    Can be used as a context manager to hold the lock for a block of code.
+    """
+
+    def __init__(self, path: str):
+        """
+        #### Create the lock, creating the lock file if it does not exist
+
+        ##### Parameters:
+        - path: str
+            - path to the lock file
+        """
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._file = open(path, 'a+b')
+        self.is_held = False
+
+    def acquire(self, blocking: bool = True):
+        """
+        #### Acquire the lock
+
+        ##### Parameters:
+        - blocking: bool = True
+            - wait for the lock if another process holds it, otherwise return straight away
+
+        ##### Returns:
+        - acquired: bool
+            - True if the lock is now held
+        """
+        while True:
+            try:  # try lock the file, an OSError means another process holds the lock
+                if fcntl is not None:
+                    fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+                else:
+                    self._file.seek(0)
+                    msvcrt.locking(self._file.fileno(), msvcrt.LK_NBLCK, 1)
+                self.is_held = True
+                return True
+            except OSError:
+                if not blocking:
+                    return False
+                time.sleep(0.01)
+
+    def release(self):
+        """
+        #### Release the lock
+
+        ##### Returns:
+        - None
+        """
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        else:
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        self.is_held = False
+
+    def close(self):
+        """
+        #### Release the lock if held and close the lock file
+
+        ##### Returns:
+        - None
+        """
+        if self.is_held:
+            self.release()
+        self._file.close()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+class SharedState:
+    """
+    #### Small json state shared between processes, only read or written while its lock is held
+
+    Each write increases a generation number, so a process can tell whether another process has written since it last did.
+    A state the same as the one last read or written is not written again.
+    """
+
+    def __init__(self, path: str):
+        """
+        #### Create the shared state
+
+        ##### Parameters:
+        - path: str
+            - path to the json state file, the lock file is the same path with .lock added
+        """
+        self.path = path
+        self.lock = FileLock(path + '.lock')
+        self.generation = None
+        # json text of the state last read or written
+        self._text = None
+
+    def read(self):
+        """
+        #### Read the state, must be called with the lock held
+
+        ##### Returns:
+        - state: dict
+            - the state, None if it has not been written
+        - is_changed: bool
+            - True if another process has written the state since this process last read or wrote it
+        """
+        try:  # try read the state, it does not exist until first written
+            with open(self.path, 'r') as f:
+                state = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self._text = None
+            return None, self.generation is not None
+        is_changed = state["generation"] != self.generation
+        self.generation = state.pop("generation")
+        self._text = json.dumps(state)
+        return state, is_changed
+
+    def write(self, state: dict):
+        """
+        #### Write the state, must be called with the lock held, unless it is the same as the state last read or written
+
+        ##### Parameters:
+        - state: dict
+            - json serialisable state
+
+        ##### Returns:
+        - None
+        """
+        text = json.dumps(state)
+        if text == self._text:
+            return
+        self._text = text
+        self.generation = (self.generation or 0) + 1
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump({**state, "generation": self.generation}, f)
+        os.replace(temp_path, self.path)
+
+    def close(self):
+        """
+        #### Close the lock file
+
+        ##### Returns:
+        - None
+        """
+        self.lock.close()
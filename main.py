@@ -13,27 +13,35 @@ Date: 12/12/2023
 """
 
 # Python imports
-from fastapi import FastAPI, Request, Depends
+from fastapi import FastAPI, Request, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from contextlib import asynccontextmanager
 from functools import lru_cache
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Literal, Optional
+import numpy as np
 import os
-import csv
 import json
+import asyncio
 import logging
-import numpy as np
-import pandas as pd
+import time
+import re
 
 # .py file imports
 import config
+import payload
 import timestamp
 import files
-
-# global variables
-low_freq_data_path = ''
-prev_high_freq_data_path = ''
-
-# create FastAPI instance
-app = FastAPI()
+import storage
+import writers
+import index
+import query
+import retention
+import pipeline
+import locks
+import metrics
+import continuity
 
 # create a logger
 logger = logging.getLogger(__name__)
@@ -61,8 +69,606 @@ logger.addHandler(console_handler)
 def get_settings():
     return config.Settings()
 
+# create a singleton instance of the index.FileIndex class
+@lru_cache
+def get_file_index():
+    settings = get_settings()
+    return index.FileIndex(os.path.join(settings.output_dir, settings.index_filename))
+
+# create a singleton instance of the retention.RetentionManager class
+@lru_cache
+def get_retention_manager():
+    settings = get_settings()
+    return retention.RetentionManager(
+        settings.max_num_of_files,
+        settings.max_file_age_days * 24 * 60 * 60,
+        int(settings.max_folder_size_mb * 1024 * 1024),
+        get_file_index(),
+        exclude_filenames=tuple(
+            temp_filename + backend.temp_extension
+            for temp_filename in (settings.temp_low_freq_filename, settings.temp_high_freq_filename)
+            for backend in storage.BACKENDS.values()
+        )
+    )
+
+# create a singleton instance of the analytics.EventCatalogue class
+@lru_cache
+def get_event_catalogue():
+    import analytics
+    settings = get_settings()
+    return analytics.EventCatalogue(os.path.join(settings.output_dir, settings.event_catalogue_filename))
+
+# create a singleton instance of the continuity.CoverageMap class
+@lru_cache
+def get_coverage_map():
+    settings = get_settings()
+    return continuity.CoverageMap(os.path.join(settings.output_dir, settings.coverage_filename))
+
+# create a singleton instance of the compaction.Compactor class, None if compaction is turned off
+@lru_cache
+def get_compactor():
+    settings = get_settings()
+    if settings.compact_after_hours <= 0:
+        return None
+    import compaction
+    return compaction.Compactor(
+        get_file_index(),
+        settings.compaction_period,
+        settings.compact_after_hours * 60 * 60,
+        settings.compaction_io_budget_mb_s * 1024 * 1024,
+        sync=settings.durability_mode != "none"
+    )
+
+# create a singleton instance of the live.LiveHub class
+@lru_cache
+def get_live_hub():
+    import live
+    return live.LiveHub(get_settings().live_buffer_rows)
+
+# loggers identify themselves with this header, or with the logger id in the upload path
+LOGGER_ID_HEADER = "X-Logger-Id"
+LOGGER_ID_PATTERN = re.compile(r"[A-Za-z0-9_-][A-Za-z0-9_.-]{0,63}")
+
+# folder in the output directory for the state and locks shared between worker processes
+WORKERS_FOLDER = ".workers"
+
+# seconds between compactions of the output folders, run before enforcing the retention limits
+COMPACTION_INTERVAL_S = 10 * 60
+
+# set when a file is completed, to wake the retention task, created in lifespan
+retention_event = None
+
+# low priority thread the compactor runs on, created in lifespan
+compaction_executor = None
+
+# closed high frequency event files waiting to be analysed, created in lifespan
+analytics_queue = None
+
+# ingestion pipelines for each logger and stream, created in lifespan
+pipelines = None
+
+def get_logger_id(request: Request):
+    """
+    #### Get the identity of the logger sending a request
+
+    ##### Parameters:
+    - request: Request
+        - The incoming http request
+
+    ##### Returns:
+    - logger_id: str
+        - the logger id from the upload path or the X-Logger-Id header, empty for the default logger
+
+    ##### Raises:
+    - HTTPException
+        - 400 if the logger id is not made of letters, digits, '_', '-' and '.'
+    """
+    logger_id = request.path_params.get("logger_id") or request.headers.get(LOGGER_ID_HEADER, "")
+    if logger_id and not LOGGER_ID_PATTERN.fullmatch(logger_id):
+        raise HTTPException(status_code=400, detail="Logger ids must be up to 64 letters, digits, '_', '-' or '.', not starting with '.'")
+    return logger_id
+
+def get_stream_dir(
+    logger_id: str,
+    stream: str
+):
+    """
+    #### Get the output folder of a logger and stream
+
+    The default logger keeps the output folders directly in the output directory, other loggers have a folder of their own.
+
+    ##### Parameters:
+    - logger_id: str
+        - identity of the logger, empty for the default logger
+    - stream: str
+        - either low or high
+
+    ##### Returns:
+    - dir: str
+        - path to the output folder
+    """
+    settings = get_settings()
+    folder = settings.output_folder_low_freq if stream == "low" else settings.output_folder_high_freq
+    return os.path.join(settings.output_dir, logger_id, folder)
+
+def create_writer(
+    logger_id: str,
+    stream: str
+):
+    """
+    #### Create the writer for a logger and stream, recovering its running file and syncing its folder in the file index,
+    then continuing the continuity tracking from the final sample stored
+
+    ##### Parameters:
+    - logger_id: str
+        - identity of the logger, empty for the default logger
+    - stream: str
+        - either low or high
+
+    ##### Returns:
+    - writer: writers.DataFileWriter
+        - the writer for the stream
+    """
+    settings = get_settings()
+    dir = get_stream_dir(logger_id, stream)
+    os.makedirs(dir, exist_ok=True)
+    if stream == "low":
+        writer = writers.LowFreqWriter(
+            dir,
+            settings.output_low_freq_filename,
+            settings.temp_low_freq_filename,
+            json.loads(settings.low_freq_header),
+            storage.get_backend(settings.storage_backend),
+            settings.max_low_freq_data_rows,
+            get_file_index(),
+            settings.durability_mode,
+            settings.durability_batch_rows,
+            settings.durability_batch_ms,
+            continuity.ContinuityTracker(
+                settings.low_freq_interval_micro_s,
+                settings.low_freq_interval_micro_s * 3 // 2,
+                settings.continuity_policy,
+                get_coverage_map(),
+                dir,
+                stream
+            )
+        )
+    else:
+        writer = writers.HighFreqEventWriter(
+            dir,
+            settings.output_high_freq_filename,
+            settings.temp_high_freq_filename,
+            json.loads(settings.high_freq_header),
+            storage.get_backend(settings.storage_backend),
+            settings.scan_rate_micro_s,
+            settings.high_freq_event_timeout_s,
+            get_file_index(),
+            settings.durability_mode,
+            settings.durability_batch_rows,
+            settings.durability_batch_ms,
+            # the high frequency events are only sent when triggered, so the time between them is not a gap
+            continuity.ContinuityTracker(settings.scan_rate_micro_s, policy=settings.continuity_policy, stream=stream)
+        )
+    get_file_index().sync_folder(dir, exclude=(writer.temp_path,))
+    writer.recover_continuity()
+    return writer
+
+def create_pyramid(
+    logger_id: str,
+    stream: str
+):
+    """
+    #### Create the downsampling pyramid for a logger and stream
+
+    ##### Parameters:
+    - logger_id: str
+        - identity of the logger, empty for the default logger
+    - stream: str
+        - either low or high
+
+    ##### Returns:
+    - pyramid: downsample.Pyramid
+        - the pyramid, kept in the .pyramid folder of the output folder
+    """
+    import downsample
+    settings = get_settings()
+    header = json.loads(settings.low_freq_header if stream == "low" else settings.high_freq_header)
+    return downsample.Pyramid(os.path.join(get_stream_dir(logger_id, stream), downsample.PYRAMID_FOLDER), header)
+
+def create_ring_buffer(
+    logger_id: str,
+    stream: str
+):
+    """
+    #### Create the memory-mapped ring buffer of the most recent samples for a logger and stream
+
+    Sized to hold HOTSTORE_HOURS of samples, at the low frequency interval or the high frequency scan rate.
+
+    ##### Parameters:
+    - logger_id: str
+        - identity of the logger, empty for the default logger
+    - stream: str
+        - either low or high
+
+    ##### Returns:
+    - ring_buffer: hotstore.RingWriter
+        - the ring buffer, kept in the .hotstore file of the output folder, None if HOTSTORE_HOURS is 0
+    """
+    settings = get_settings()
+    if settings.hotstore_hours <= 0:
+        return None
+    import hotstore
+    header = json.loads(settings.low_freq_header if stream == "low" else settings.high_freq_header)
+    interval_us = settings.low_freq_interval_micro_s if stream == "low" else settings.scan_rate_micro_s
+    capacity = int(settings.hotstore_hours * 60 * 60 * 1_000_000 // interval_us)
+    return hotstore.RingWriter(get_stream_dir(logger_id, stream), header, capacity)
+
+def find_logger_ids():
+    """
+    #### Find the loggers with output folders in the output directory
+
+    ##### Returns:
+    - logger_ids: list[str]
+        - the default logger followed by each logger with a folder of its own
+    """
+    settings = get_settings()
+    stream_folders = (settings.output_folder_low_freq, settings.output_folder_high_freq)
+    logger_ids = [""]
+    with os.scandir(settings.output_dir) as it:
+        for entry in it:
+            if entry.is_dir() and entry.name not in stream_folders and LOGGER_ID_PATTERN.fullmatch(entry.name):
+                if any(os.path.isdir(os.path.join(entry.path, folder)) for folder in stream_folders):
+                    logger_ids.append(entry.name)
+    return logger_ids
+
+def add_completed_files(paths: list[str]):
+    """
+    #### Queue the completed high frequency event files to be analysed and wake the retention task
+
+    ##### Parameters:
+    - paths: list[str]
+        - paths to the completed files
+
+    ##### Returns:
+    - None
+    """
+    high_freq_folder = get_settings().output_folder_high_freq
+    for path in paths:
+        if analytics_queue is not None and os.path.basename(os.path.dirname(path)) == high_freq_folder:
+            analytics_queue.put_nowait(path)
+    if paths and retention_event is not None:
+        retention_event.set()
+
+async def analyse_events():
+    """
+    #### Analyse each closed high frequency event off the request path, adding the results to the event catalogue
+    """
+    while True:
+        path = await analytics_queue.get()
+        try:  # try analyse the event, it may already have been removed by retention
+            with metrics.STAGE_SECONDS.time(stage="analyse", stream="high"):
+                await asyncio.to_thread(get_event_catalogue().analyse_file, path)
+        except FileNotFoundError:
+            metrics.SWALLOWED_EXCEPTIONS.inc(where="analyse")
+        except Exception:
+            logger.error("There was an error analysing %s", path, exc_info=True)
+            metrics.SWALLOWED_EXCEPTIONS.inc(where="analyse")
+
+def update_retention_view(last_rowid: int):
+    """
+    #### Add the files completed since the last update to the retention manager, from the file index shared by every worker
+
+    ##### Parameters:
+    - last_rowid: int
+        - row id in the file index of the last file already added
+
+    ##### Returns:
+    - last_rowid: int
+        - row id in the file index of the last file now added
+    """
+    retention_manager = get_retention_manager()
+    for rowid, path in get_file_index().files_added_since(last_rowid):
+        retention_manager.add_file(path)
+        last_rowid = rowid
+    return last_rowid
+
+def compact_folders():
+    """
+    #### Merge the old completed files of each logger's output folders into archives, on the compaction thread
+
+    ##### Returns:
+    - removed_paths: list[str]
+        - paths to the files merged into archives and removed
+    """
+    removed_paths = []
+    for logger_id in find_logger_ids():
+        for stream in ("low", "high"):
+            dir = get_stream_dir(logger_id, stream)
+            if os.path.isdir(dir):
+                archive_paths, folder_removed_paths = get_compactor().compact_folder(dir)
+                if archive_paths:
+                    logger.info("Merged %d files into %d archives in %s", len(folder_removed_paths), len(archive_paths), dir)
+                removed_paths.extend(folder_removed_paths)
+    return removed_paths
+
+def prune_coverage_map(deleted_paths: list[str]):
+    """
+    #### Remove the gaps of the coverage map before the oldest file left in each folder the retention limits deleted files from
+
+    ##### Parameters:
+    - deleted_paths: list[str]
+        - paths to the deleted files
+
+    ##### Returns:
+    - None
+    """
+    for folder in set(os.path.dirname(path) for path in deleted_paths):
+        start, _ = get_file_index().time_range(folder)
+        if start is not None:
+            get_coverage_map().remove_before(folder, timestamp.to_microseconds(start))
+
+async def trim_pyramids(deleted_paths: list[str]):
+    """
+    #### Trim the downsampling pyramid of each folder the retention limits deleted files from to the oldest data left in it, on its writer thread
+
+    ##### Parameters:
+    - deleted_paths: list[str]
+        - paths to the deleted files
+
+    ##### Returns:
+    - None
+    """
+    folders = set(os.path.dirname(path) for path in deleted_paths)
+    for stream_pipeline in list(pipelines.pipelines.values()):
+        writer = stream_pipeline.writer
+        if stream_pipeline.pyramid is None or writer.dir not in folders:
+            continue
+        start, _ = await asyncio.to_thread(get_file_index().time_range, writer.dir)
+        if writer.num_rows > 0:
+            writer_start = np.datetime64(writer.initial_us, 'us')
+            start = writer_start if start is None else min(start, writer_start)
+        if start is not None:
+            await stream_pipeline.run_in_writer(stream_pipeline.pyramid.trim, start)
+
+async def enforce_retention():
+    """
+    #### Enforce the retention limits off the request path, when files are completed and at least once a minute for the age limit
+
+    When compaction is turned on, the old completed files are first merged into archives every COMPACTION_INTERVAL_S,
+    so the retention limits delete the oldest archives rather than the files in them while the folders are within their limits.\n
+    With several workers, only the worker holding the retention lock enforces the limits, the others retry for the lock each time.
+    """
+    settings = get_settings()
+    retention_lock = None
+    if settings.workers > 1:
+        retention_lock = locks.FileLock(os.path.join(settings.output_dir, WORKERS_FOLDER, "retention.lock"))
+    last_rowid = 0
+    last_compaction_time = 0
+    try:
+        while True:
+            # wait until a file is completed or a minute has passed, with asyncio.wait rather than asyncio.wait_for,
+            # as wait_for can swallow the cancellation on shutdown if the event is set at the same time
+            event_waiter = asyncio.ensure_future(retention_event.wait())
+            try:
+                await asyncio.wait((event_waiter,), timeout=60)
+            finally:
+                event_waiter.cancel()
+            retention_event.clear()
+            if retention_lock is not None and not retention_lock.is_held and not retention_lock.acquire(blocking=False):
+                continue
+            if get_compactor() is not None and time.monotonic() - last_compaction_time >= COMPACTION_INTERVAL_S:
+                last_compaction_time = time.monotonic()
+                try:  # try merge the old files into archives
+                    with metrics.STAGE_SECONDS.time(stage="compaction", stream=""):
+                        removed_paths = await asyncio.get_running_loop().run_in_executor(compaction_executor, compact_folders)
+                    get_retention_manager().remove_files(removed_paths)
+                    # the events merged into archives are no longer files of their own to be found in the catalogue
+                    await asyncio.to_thread(get_event_catalogue().remove_files, removed_paths)
+                    metrics.COMPACTED_FILES.inc(len(removed_paths))
+                except Exception:
+                    logger.error("There was an error compacting the output folders", exc_info=True)
+                    metrics.SWALLOWED_EXCEPTIONS.inc(where="compaction")
+            try:  # try delete the files over the limits
+                with metrics.STAGE_SECONDS.time(stage="retention", stream=""):
+                    last_rowid = await asyncio.to_thread(update_retention_view, last_rowid)
+                    deleted_paths = await asyncio.to_thread(get_retention_manager().enforce)
+                if deleted_paths:
+                    await asyncio.to_thread(get_event_catalogue().remove_files, deleted_paths)
+                    await asyncio.to_thread(prune_coverage_map, deleted_paths)
+                    await trim_pyramids(deleted_paths)
+                    metrics.RETENTION_DELETED_FILES.inc(len(deleted_paths))
+                    logger.info("Retention deleted %d files", len(deleted_paths))
+            except Exception:
+                logger.error("There was an error enforcing the retention limits", exc_info=True)
+                metrics.SWALLOWED_EXCEPTIONS.inc(where="retention")
+    finally:
+        if retention_lock is not None:
+            retention_lock.close()
+
+async def close_idle_high_freq_events():
+    """
+    #### Periodically close the open high frequency event of each logger once no bursts have arrived for the event timeout
+    """
+    while True:
+        await asyncio.sleep(1)
+        for high_freq_pipeline in pipelines.get_all("high"):
+            try:  # try to close the open event if it is idle
+                closed_event_path = await high_freq_pipeline.run_in_writer(high_freq_pipeline.writer.close_if_idle)
+                if closed_event_path is not None:
+                    add_completed_files([closed_event_path])
+            except Exception:
+                logger.error("There was an error closing the %s event", high_freq_pipeline.name, exc_info=True)
+                metrics.SWALLOWED_EXCEPTIONS.inc(where="close_idle_event")
+
+def record_rows(
+    logger_id: str,
+    stream: str,
+    batch: payload.DataBatch
+):
+    """
+    #### Count the rows parsed from an upload request and the malformed rows dropped from it
+
+    ##### Parameters:
+    - logger_id: str
+        - identity of the logger, empty for the default logger
+    - stream: str
+        - either low or high
+    - batch: payload.DataBatch
+        - the parsed samples
+
+    ##### Returns:
+    - None
+    """
+    logger_label = logger_id or "default"
+    metrics.ROWS_INGESTED.inc(batch.num_rows, logger=logger_label, stream=stream)
+    if batch.num_malformed:
+        metrics.MALFORMED_ROWS.inc(batch.num_malformed, logger=logger_label, stream=stream)
+
+def collect_queue_depths():
+    """
+    #### Get the number of batches waiting to be written for each logger and stream, when the metrics are scraped
+
+    ##### Returns:
+    - queue_depths: dict[tuple[str, str], int]
+        - number of queued batches by logger id and stream
+    """
+    if pipelines is None:
+        return {}
+    return {(logger_id or "default", stream): stream_pipeline.queue.qsize() for (logger_id, stream), stream_pipeline in pipelines.pipelines.items()}
+
+QUEUE_DEPTH = metrics.REGISTRY.register(metrics.Gauge(
+    "datalog_queue_depth",
+    "Batches waiting to be written for each logger and stream",
+    ("logger", "stream"),
+    collect=collect_queue_depths
+))
+
+async def sync_pending_writes():
+    """
+    #### Periodically write and fsync the batches each writer has held for longer than the batch durability interval
+    """
+    interval_s = max(get_settings().durability_batch_ms, 1) / 1000
+    while True:
+        await asyncio.sleep(interval_s)
+        for stream_pipeline in list(pipelines.pipelines.values()):
+            try:  # try to write out the held batches if they are due
+                await stream_pipeline.run_in_writer(stream_pipeline.writer.sync_if_due)
+            except Exception:
+                logger.error("There was an error syncing the %s data", stream_pipeline.name, exc_info=True)
+                metrics.SWALLOWED_EXCEPTIONS.inc(where="sync")
+
+def publish_live(
+    logger_id: str,
+    stream: str,
+    batch: payload.DataBatch
+):
+    """
+    #### Publish the rows of a batch written after the continuity check to the live viewers, so they never see the duplicate or late rows
+
+    ##### Parameters:
+    - logger_id: str
+        - identity of the logger, empty for the default logger
+    - stream: str
+        - either low or high
+    - batch: payload.DataBatch
+        - rows written, in time order
+
+    ##### Returns:
+    - None
+    """
+    get_live_hub().publish(logger_id, stream, batch)
+
+async def write_batch(
+    stream_pipeline: pipeline.StreamPipeline,
+    batch: payload.DataBatch
+):
+    """
+    #### Queue a batch to be written, also waiting until it is on disk in strict durability
+
+    ##### Parameters:
+    - stream_pipeline: pipeline.StreamPipeline
+        - pipeline of the logger and stream
+    - batch: payload.DataBatch
+        - parsed samples to write
+
+    ##### Returns:
+    - None
+
+    ##### Raises:
+    - HTTPException
+        - if the batch could not be written in strict durability, so the logger sends it again
+    """
+    with metrics.STAGE_SECONDS.time(stage="enqueue", stream=stream_pipeline.writer.stream):
+        if get_settings().durability_mode != "strict":
+            await stream_pipeline.put(batch)
+            return
+        try:  # try write the batch before replying
+            await stream_pipeline.put(batch, wait=True)
+        except Exception:
+            raise HTTPException(status_code=500, detail=f"The {stream_pipeline.name} data could not be written")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    #### Rebuild the writer state, sync the file index and start the ingestion pipelines of each known logger on startup
+
+    On shutdown every queued batch is written before the running files are closed.
+    """
+    global retention_event, analytics_queue, pipelines, compaction_executor
+    retention_event = asyncio.Event()
+    analytics_queue = asyncio.Queue()
+    settings = get_settings()
+    os.makedirs(settings.output_dir, exist_ok=True)
+    shared_state_dir = os.path.join(settings.output_dir, WORKERS_FOLDER) if settings.workers > 1 else None
+    pipelines = pipeline.PipelineRegistry(
+        create_writer,
+        add_completed_files,
+        settings.ingest_queue_size,
+        shared_state_dir,
+        create_pyramid,
+        create_ring_buffer,
+        publish_live
+    )
+    for logger_id in find_logger_ids():
+        for stream in ("low", "high"):
+            await pipelines.get(logger_id, stream)
+        # analyse any events closed while the catalogue was not being updated
+        high_freq_dir = get_stream_dir(logger_id, "high")
+        indexed_paths = [entry["path"] for entry in get_file_index().file_info(high_freq_dir) if not files.is_archive(entry["path"])]
+        if indexed_paths:
+            for path in get_event_catalogue().missing_files(high_freq_dir, indexed_paths):
+                analytics_queue.put_nowait(path)
+    compaction_executor = None
+    if get_compactor() is not None:
+        import compaction
+        compaction_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="compactor", initializer=compaction.lower_thread_priority)
+    retention_event.set()
+    background_tasks = [asyncio.create_task(close_idle_high_freq_events()), asyncio.create_task(enforce_retention()), asyncio.create_task(analyse_events())]
+    if settings.durability_mode == "batch":
+        background_tasks.append(asyncio.create_task(sync_pending_writes()))
+    yield
+    if get_compactor() is not None:
+        get_compactor().stop()
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    if compaction_executor is not None:
+        compaction_executor.shutdown()
+    await pipelines.stop()
+    get_file_index().close()
+    # the event catalogue is only opened once an event is analysed, found or removed
+    if get_event_catalogue.cache_info().currsize:
+        get_event_catalogue().close()
+    get_coverage_map().close()
+    for get_singleton in (get_live_hub, get_compactor, get_retention_manager, get_file_index, get_event_catalogue, get_coverage_map):
+        get_singleton.cache_clear()
+
+# create FastAPI instance
+app = FastAPI(lifespan=lifespan)
+
 # HTTP methods    
 @app.post("/uploadLowFreq/{logger_filename}")
+@app.post("/uploadLowFreq/{logger_id}/{logger_filename}")
 async def upload_low_freq_data(
     logger_filename: str, 
     request: Request,
@@ -74,6 +680,8 @@ async def upload_low_freq_data(
     This method receives low frequency data from the CR1000 data logger.\n
     The low frequency data is sent every 30s from the logger containing a single sample.\n
     The samples are appended to the same file until the desired amount of time has passes between initial and final sample, in which then a new file is written.\n
+    The sample is queued to be written by the low frequency writer thread, so the response is sent before it is written, unless the durability mode is strict.\n
+    Each logger's data is written to its own folders, named by the logger id in the path or the X-Logger-Id header.\n
     Each sample has the following information:
         - 1 thermocouple temperature probe measuring temperature (1 measurement)
         - 2 tri-axial accelerometers measuring maximum and minimum accelerations for each axis (6 measurements each)
@@ -90,55 +698,26 @@ async def upload_low_freq_data(
     ##### Returns:
     - The http response message
     """
-    # declare global variables
-    global low_freq_data_path
-    # load environment variables
-    PATH_TO_LOW_FREQ_FOLDER = os.path.join(settings.output_dir, settings.output_folder_low_freq)
-    TEMP_LOW_FREQ_DATA_PATH = os.path.join(PATH_TO_LOW_FREQ_FOLDER, settings.temp_low_freq_filename) + ".csv"
-    # get the raw bytes of data from the http request and decode
-    raw_bytes = await request.body()
-    decoded_data = raw_bytes.decode("utf-8").strip("\r\n").replace('"', '').split(",")
-    # create a dictionary of the decoded data with the header as the keys
-    low_freq_header = json.loads(settings.low_freq_header)
-    low_freq_data = dict(zip(low_freq_header, decoded_data))
-    # check if the low frequency data file exists and is full
-    continue_with_file = True
-    try:  # try to open an existing low freq data file
-        with open(low_freq_data_path, 'r') as f:
-            low_freq_data_rows_count = len(f.readlines())
-        if low_freq_data_rows_count > settings.max_low_freq_data_rows:
-            continue_with_file = False
-    except FileNotFoundError:
-        if low_freq_data_path != '':
-            logger.error("There was an error opening the low frequency data file", exc_info=True)
-        else:
-            logger.info("No previous low frequency data file could be found")
-    # if file exists and is not full, append data to file
-    if continue_with_file: 
-        try:  # appending data to file is achieved by renaming the file the temp file name and continuing with the temp file
-            os.rename(low_freq_data_path, TEMP_LOW_FREQ_DATA_PATH)
-        except Exception:
-            pass
-    # if file does not exist or is full, create a new file
-    try:  # try to open and append the low freq data to file and rename with total timestamp
-        file_exists = os.path.exists(TEMP_LOW_FREQ_DATA_PATH)
-        with open(TEMP_LOW_FREQ_DATA_PATH, 'a', newline='') as f:
-            writer = csv.DictWriter(f, delimiter=',', fieldnames=low_freq_header)
-            if not file_exists:
-                writer.writeheader()
-            writer.writerow(low_freq_data)
-        initial_timestamp = timestamp.get_initial_timestamp(TEMP_LOW_FREQ_DATA_PATH)
-        latest_timestamp = timestamp.get_final_timestamp(TEMP_LOW_FREQ_DATA_PATH, 1)
-        low_freq_data_path = files.create_timestamped_filepath(initial_timestamp, latest_timestamp, settings.output_low_freq_filename, PATH_TO_LOW_FREQ_FOLDER)
-        os.rename(TEMP_LOW_FREQ_DATA_PATH, low_freq_data_path)  # rename temp file to timestamped file
-    except Exception:  # exception returns an error message that there was an error updating file
-        logger.error("There was an error updating the low frequency data file", exc_info=True)
-        return {"message": "There was an error updating the low frequency data file"}
-    files.set_num_file_limit(PATH_TO_LOW_FREQ_FOLDER, settings.max_num_of_files)
+    # get the raw bytes of data from the http request and parse
+    with metrics.STAGE_SECONDS.time(stage="body_read", stream="low"):
+        raw_bytes = await request.body()
+    metrics.PAYLOAD_BYTES.observe(len(raw_bytes), stream="low")
+    logger_id = get_logger_id(request)
+    low_freq_pipeline = await pipelines.get(logger_id, "low")
+    with metrics.STAGE_SECONDS.time(stage="parse", stream="low"):
+        low_freq_data = payload.parse_payload(raw_bytes, low_freq_pipeline.writer.header)
+    record_rows(logger_id, "low", low_freq_data)
+    if low_freq_data.num_malformed:
+        logger.error("Dropped %d malformed low frequency rows", low_freq_data.num_malformed)
+    if low_freq_data.num_rows == 0:
+        return {"message": "No low frequency data was received"}
+    # queue the sample to be appended to the running file, rolling over to a new file when full
+    await write_batch(low_freq_pipeline, low_freq_data)
     logger.info("Successfully uploaded low frequency data")
     return {"message": "successfully uploaded low frequency data"}
 
 @app.post("/uploadHighFreqAccel/{logger_filename}")
+@app.post("/uploadHighFreqAccel/{logger_id}/{logger_filename}")
 async def upload_high_freq_event(
     logger_filename: str,
     request: Request,
@@ -149,7 +728,9 @@ async def upload_high_freq_event(
 
     This method receives high frequency data from the CR1000 data logger.\n
     The high frequency data sent contains multiple rapid samples for an event in which accelerations go above a threshold.\n
-    The multiple samples are all written to one file.\n
+    The multiple samples are all written to one file, with following bursts that continue the event appended to the same file.\n
+    The samples are queued to be written by the high frequency writer thread, so the response is sent before they are written, unless the durability mode is strict.\n
+    Each logger's data is written to its own folders, named by the logger id in the path or the X-Logger-Id header.\n
     The high frequency data samples contain the following:
         - Timestamps
         - 6 acceleration measurements (1 for each axis on 2 tri-axial accelerometers)
@@ -165,62 +746,347 @@ async def upload_high_freq_event(
     ##### Returns:
     - The http response message
     """
-    # declare global variables
-    global prev_high_freq_data_path
-    # load environment variables
-    PATH_TO_HIGH_FREQ_FOLDER = os.path.join(settings.output_dir, settings.output_folder_high_freq)
-    TEMP_HIGH_FREQ_DATA_PATH = os.path.join(PATH_TO_HIGH_FREQ_FOLDER, settings.temp_high_freq_filename) + ".csv"
-    # get the raw bytes of data from the http request and decode
-    raw_bytes = await request.body()
-    decoded_data = raw_bytes.decode("utf-8").replace('"', '').replace('\r\n', 'x,').split(",")
-    indicies = [(i+1) for i, x in enumerate(decoded_data) if x.endswith('x')]
-    decoded_data = [each_split.tolist() for each_split in np.split(decoded_data, indicies) if len(each_split)]
-    # create a dictionary of the decoded data with the header as the keys
-    high_freq_data_lists = [[item.replace('x', '') for item in lst] for lst in decoded_data]
-    high_freq_header = json.loads(settings.high_freq_header)
-    high_freq_data = [dict(zip(high_freq_header, hf_list)) for hf_list in high_freq_data_lists]
-    # take incoming data and write to file, named with timestamp
-    try:  # write the high freq data to file and rename with total timestamp
-        with open(TEMP_HIGH_FREQ_DATA_PATH, 'w', newline='') as f:
-            writer = csv.DictWriter(f, delimiter=',', fieldnames=high_freq_header)
-            writer.writeheader()
-            writer.writerows(high_freq_data)
-        initial_timestamp = timestamp.get_initial_timestamp(TEMP_HIGH_FREQ_DATA_PATH)
-        latest_timestamp = timestamp.get_final_timestamp(TEMP_HIGH_FREQ_DATA_PATH, 2)
-        high_freq_data_path = files.create_timestamped_filepath(initial_timestamp, latest_timestamp, settings.output_high_freq_filename, PATH_TO_HIGH_FREQ_FOLDER)
-        os.rename(TEMP_HIGH_FREQ_DATA_PATH, high_freq_data_path)
-    except Exception:  # exception returns an error message that there was an error updating file
-        logger.error("There was an error updating the high frequency file", exc_info=True)
-        return {"message": "There was an error updating the file"}
-    # get timestamp of the previous file, if it exists
-    try:  # try read the last timestamp from the previous high frequency data path
-        prev_last_timestamp = timestamp.get_final_timestamp(prev_high_freq_data_path, 2)
-    except Exception:
-        logger.info("No previous high frequency data file could be found")
-    # combine current and previous files if current file is a continuation of previous one
-    try:  # try combine current and previous files
-        old_file_end_time = datetime.strptime(prev_last_timestamp, '%Y.%m.%d_%H.%M.%S.%f')
-        new_file_start_time = datetime.strptime(initial_timestamp, '%Y.%m.%d_%H.%M.%S.%f')
-        delta_time = new_file_start_time - old_file_end_time
-        if delta_time <= timedelta(0, 0, settings.scan_rate_micro_s):
-            combined_csv = pd.concat([pd.read_csv(prev_high_freq_data_path), pd.read_csv(high_freq_data_path)])
-            temp_filename = os.path.join(PATH_TO_HIGH_FREQ_FOLDER, 'temp.csv')
-            # create new combined file
-            combined_csv.to_csv(temp_filename, index=False)
-            # remove old files
-            os.remove(high_freq_data_path)
-            os.remove(prev_high_freq_data_path)
-    except Exception:
-        pass  # pass, only errors when there is no previous file last timestamp
-    # get timestamp of the new combined file
-    try:  # try get total timestamp for new combined file
-        temp_initial_timestamp = timestamp.get_initial_timestamp(temp_filename)
-        temp_latest_timestamp = timestamp.get_final_timestamp(temp_filename, 2)
-        high_freq_data_path = files.create_timestamped_filepath(temp_initial_timestamp, temp_latest_timestamp, settings.output_high_freq_filename, PATH_TO_HIGH_FREQ_FOLDER)
-        os.rename(temp_filename, high_freq_data_path)
-    except Exception:
-        pass  # pass, only errors when there is no combined file made
-    prev_high_freq_data_path = high_freq_data_path
-    files.set_num_file_limit(PATH_TO_HIGH_FREQ_FOLDER, settings.max_num_of_files)
+    # get the raw bytes of data from the http request and parse off the event loop, as bursts can be large
+    with metrics.STAGE_SECONDS.time(stage="body_read", stream="high"):
+        raw_bytes = await request.body()
+    metrics.PAYLOAD_BYTES.observe(len(raw_bytes), stream="high")
+    logger_id = get_logger_id(request)
+    high_freq_pipeline = await pipelines.get(logger_id, "high")
+    with metrics.STAGE_SECONDS.time(stage="parse", stream="high"):
+        high_freq_data = await asyncio.to_thread(payload.parse_payload, raw_bytes, high_freq_pipeline.writer.header)
+    record_rows(logger_id, "high", high_freq_data)
+    if high_freq_data.num_malformed:
+        logger.error("Dropped %d malformed high frequency rows", high_freq_data.num_malformed)
+    if high_freq_data.num_rows == 0:
+        return {"message": "No high frequency data was received"}
+    # queue the burst to be appended to the open event, or to start a new event if there was a gap since the previous burst
+    await write_batch(high_freq_pipeline, high_freq_data)
     logger.info("Successfully uploaded high frequency data")
-    return {"message": "successfully uploaded high frequency data"}
\ No newline at end of file
+    return {"message": "successfully uploaded high frequency data"}
+
+@app.post("/import/{stream}")
+async def import_table(
+    stream: Literal["low", "high"],
+    request: Request,
+    logger_id: str = Query("", alias="logger")
+):
+    """
+    #### HTTP Post method for importing a TOA5 or csv table file downloaded from the logger, to backfill data missed while the network was down
+
+    The file is streamed and parsed in chunks, so files of any size are imported with bounded memory.\n
+    Rows with the timestamp of a row already stored are dropped, and the rest are written directly to timestamped output files,
+    merged into the stored files they fall within or, for the high frequency data, stitched into the events they continue.\n
+    Each chunk is imported on the writer thread of the stream, between the batches posted by the logger.
+    Imported high frequency events are analysed for the event catalogue.
+
+    ##### Parameters:
+    - stream: Literal["low", "high"]
+        - either low for the LowFreq table or high for the HighFreqAccel table
+    - request: Request
+        - The table file as the http request body
+    - logger_id: str = Query("", alias="logger")
+        - identity of the logger, the default logger if not given
+
+    ##### Returns:
+    - The number of rows read, malformed rows and duplicate rows dropped, rows imported, and files written and replaced
+
+    ##### Raises:
+    - HTTPException
+        - 400 if the logger id is not valid, 500 if the rows could not be imported
+    """
+    settings = get_settings()
+    if logger_id and not LOGGER_ID_PATTERN.fullmatch(logger_id):
+        raise HTTPException(status_code=400, detail="Logger ids must be up to 64 letters, digits, '_', '-' or '.', not starting with '.'")
+    import backfill
+    stream_pipeline = await pipelines.get(logger_id, stream)
+    writer = stream_pipeline.writer
+    table_reader = backfill.TableReader(writer.header)
+    importer = backfill.Importer(
+        writer,
+        max_rows=writer.max_rows if stream == "low" else 0,
+        max_gap_us=writer.max_gap_us if stream == "high" else 0,
+        pyramid=stream_pipeline.pyramid,
+        sync=settings.durability_mode != "none"
+    )
+    try:  # try import each chunk as it is parsed, then the rows held from the last chunk
+        with metrics.STAGE_SECONDS.time(stage="import", stream=stream):
+            async for data in request.stream():
+                batch = await asyncio.to_thread(table_reader.feed, data)
+                if batch is not None:
+                    add_completed_files(await stream_pipeline.run_in_writer(importer.add, batch))
+            batch = await asyncio.to_thread(table_reader.close)
+            add_completed_files(await stream_pipeline.run_in_writer(importer.add, batch))
+            add_completed_files(await stream_pipeline.run_in_writer(importer.close))
+    except Exception:
+        logger.error("There was an error importing the %s table", stream_pipeline.name, exc_info=True)
+        raise HTTPException(status_code=500, detail=f"The {stream_pipeline.name} table could not be imported, {importer.num_rows_imported} rows were imported")
+    finally:
+        # the files rewritten under the same name stay in the retention view and the event catalogue
+        replaced_paths = sorted(set(importer.replaced_paths) - set(importer.written_paths))
+        get_retention_manager().remove_files(replaced_paths)
+        if stream == "high":
+            await asyncio.to_thread(get_event_catalogue().remove_files, replaced_paths)
+    summary = importer.summary()
+    metrics.IMPORTED_ROWS.inc(summary["rows_imported"], logger=logger_id or "default", stream=stream)
+    logger.info("Imported %d of %d %s rows", summary["rows_imported"], summary["rows_read"], stream_pipeline.name)
+    return summary
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    #### HTTP Get method for the metrics of this worker, in the Prometheus text format
+
+    Includes the latency of each ingest stage, the size of the upload requests, the rows ingested by each logger and stream,
+    the high frequency bursts merged into open events, the files completed and deleted by retention,
+    the exceptions caught without stopping the application and the depth of each queue.
+
+    ##### Returns:
+    - The metrics text
+    """
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/data/{stream}")
+async def get_data(
+    stream: Literal["low", "high"],
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    channels: Optional[str] = None,
+    pixels: Optional[int] = Query(None, ge=1),
+    logger_id: str = Query("", alias="logger")
+):
+    """
+    #### HTTP Get method for the data within a time window
+
+    The files overlapping the time window are found with the file index, along with the running file,
+    and only those files are read.\n
+    The samples are streamed back as csv text, one file at a time.\n
+    When the width in pixels the data is plotted over is given, the coarsest level of the downsampling pyramid
+    with at least one bucket for each pixel is returned instead, with the minimum, maximum, mean and RMS of each channel
+    for each bucket, so peaks stay visible. The X-Resolution-S header holds the width in seconds of the buckets, 0 for the raw samples.
+
+    ##### Parameters:
+    - stream: Literal["low", "high"]
+        - either low for the low frequency data or high for the high frequency data
+    - start: Optional[datetime] = None
+        - start of the time window, from the first sample if not given
+    - end: Optional[datetime] = None
+        - end of the time window, to the last sample if not given
+    - channels: Optional[str] = None
+        - comma separated names of the channels to return, all channels if not given
+    - pixels: Optional[int] = Query(None, ge=1)
+        - width in pixels the data is plotted over, the raw samples are returned if not given
+    - logger_id: str = Query("", alias="logger")
+        - identity of the logger, the default logger if not given
+
+    ##### Returns:
+    - The csv text of the samples
+    """
+    settings = get_settings()
+    dir = get_stream_dir(logger_id, stream)
+    if (logger_id and not LOGGER_ID_PATTERN.fullmatch(logger_id)) or not os.path.isdir(dir):
+        raise HTTPException(status_code=404, detail=f"No {stream} frequency data for logger {logger_id!r}")
+    header = json.loads(settings.low_freq_header if stream == "low" else settings.high_freq_header)
+    start = np.datetime64(start, 'us') if start is not None else None
+    end = np.datetime64(end, 'us') if end is not None else None
+    channel_names = channels.split(",") if channels else None
+    if channel_names is not None and not set(channel_names) <= set(header[1:]):
+        raise HTTPException(status_code=400, detail=f"Unknown channels, expected any of {header[1:]}")
+    stream_pipeline = pipelines.pipelines.get((logger_id, stream))
+    writer = stream_pipeline.writer if stream_pipeline is not None else None
+    if pixels is not None:
+        # fill in an unbounded window from the time range of the files and the running file
+        window_start, window_end = get_file_index().time_range(dir)
+        if writer is not None and writer.num_rows > 0:
+            writer_start, writer_end = np.datetime64(writer.initial_us, 'us'), np.datetime64(writer.final_us, 'us')
+            window_start = writer_start if window_start is None else min(window_start, writer_start)
+            window_end = writer_end if window_end is None else max(window_end, writer_end)
+        window_start = start if start is not None else window_start
+        window_end = end if end is not None else window_end
+        import downsample
+        width_s = downsample.choose_level(window_start, window_end, pixels) if window_start is not None else None
+        if width_s is not None:
+            if stream_pipeline is not None and stream_pipeline.pyramid is not None:
+                records = await stream_pipeline.run_in_writer(stream_pipeline.pyramid.read, width_s, start, end)
+            else:
+                _, records = await asyncio.to_thread(downsample.read_level, os.path.join(dir, downsample.PYRAMID_FOLDER), width_s, start, end)
+            return StreamingResponse(
+                query.iter_summary_csv(header, records, width_s, channel_names),
+                media_type="text/csv",
+                headers={"X-Resolution-S": str(width_s)}
+            )
+    paths = get_file_index().find_files(dir, start, end)
+    if writer is not None and writer.num_rows > 0 and (end is None or writer.initial_us <= timestamp.to_microseconds(end)) and (start is None or writer.final_us >= timestamp.to_microseconds(start)):
+        # write out any batches held for a group commit so the running file can be read
+        await stream_pipeline.run_in_writer(writer.flush)
+        paths.append(writer.temp_path)
+    return StreamingResponse(query.iter_csv(paths, start, end, channel_names), media_type="text/csv", headers={"X-Resolution-S": "0"})
+
+@app.get("/events")
+async def get_events(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    channel: Optional[str] = None,
+    min_peak: Optional[float] = None,
+    min_rms: Optional[float] = None,
+    min_duration_s: Optional[float] = None,
+    max_duration_s: Optional[float] = None,
+    sort: Literal["start", "duration", "peak", "rms", "crest_factor", "dominant_freq"] = "start",
+    order: Literal["asc", "desc"] = "asc",
+    limit: int = Query(100, ge=1, le=10000),
+    logger_id: str = Query("", alias="logger")
+):
+    """
+    #### HTTP Get method for the catalogue of analysed high frequency events
+
+    Each closed event is analysed for the peak, RMS, crest factor and dominant frequency of each channel,
+    and of the vector magnitude of each accelerometer as the <accelerometer>.Magnitude channel,
+    so events can be found without opening the event files.
+
+    ##### Parameters:
+    - start: Optional[datetime] = None
+        - only events ending from this time
+    - end: Optional[datetime] = None
+        - only events starting up to this time
+    - channel: Optional[str] = None
+        - channel the results are filtered and sorted by, the highest over every channel if not given
+    - min_peak: Optional[float] = None
+        - only events with at least this peak
+    - min_rms: Optional[float] = None
+        - only events with at least this RMS
+    - min_duration_s: Optional[float] = None
+        - only events lasting at least this many seconds
+    - max_duration_s: Optional[float] = None
+        - only events lasting at most this many seconds
+    - sort: Literal["start", "duration", "peak", "rms", "crest_factor", "dominant_freq"] = "start"
+        - start, duration, peak, rms, crest_factor or dominant_freq
+    - order: Literal["asc", "desc"] = "asc"
+        - sort from lowest to highest, or highest to lowest
+    - limit: int = Query(100, ge=1, le=10000)
+        - maximum number of events returned
+    - logger_id: str = Query("", alias="logger")
+        - identity of the logger, the default logger if not given
+
+    ##### Returns:
+    - The events, with the results of each channel
+    """
+    import analytics
+    settings = get_settings()
+    dir = get_stream_dir(logger_id, "high")
+    if (logger_id and not LOGGER_ID_PATTERN.fullmatch(logger_id)) or not os.path.isdir(dir):
+        raise HTTPException(status_code=404, detail=f"No high frequency data for logger {logger_id!r}")
+    header = json.loads(settings.high_freq_header)
+    channel_names = header[1:] + [f"{name}.Magnitude" for name in analytics.find_accelerometers(header)]
+    if channel is not None and channel not in channel_names:
+        raise HTTPException(status_code=400, detail=f"Unknown channel, expected any of {channel_names}")
+    events = await asyncio.to_thread(
+        get_event_catalogue().find_events,
+        dir,
+        timestamp.to_microseconds(start) if start is not None else None,
+        timestamp.to_microseconds(end) if end is not None else None,
+        channel,
+        min_peak,
+        min_rms,
+        min_duration_s,
+        max_duration_s,
+        sort,
+        order == "desc",
+        limit
+    )
+    return {"events": events}
+
+@app.get("/coverage")
+async def get_coverage(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    logger_id: str = Query("", alias="logger")
+):
+    """
+    #### HTTP Get method for the gaps in the low frequency data within a time window
+
+    Samples further apart than one and a half low frequency intervals are recorded as a gap in the coverage map as they are written,
+    and the gaps later filled by samples imported from a table file are split or removed,
+    so the missing data of a time window is found without reading the data files.
+
+    ##### Parameters:
+    - start: Optional[datetime] = None
+        - start of the time window, from the first sample if not given
+    - end: Optional[datetime] = None
+        - end of the time window, to the last sample if not given
+    - logger_id: str = Query("", alias="logger")
+        - identity of the logger, the default logger if not given
+
+    ##### Returns:
+    - The first and last sample stored, the gaps overlapping the time window, and the fraction of the time window covered by samples
+    """
+    dir = get_stream_dir(logger_id, "low")
+    if (logger_id and not LOGGER_ID_PATTERN.fullmatch(logger_id)) or not os.path.isdir(dir):
+        raise HTTPException(status_code=404, detail=f"No low frequency data for logger {logger_id!r}")
+    first, last = await asyncio.to_thread(get_file_index().time_range, dir)
+    first_us = timestamp.to_microseconds(first) if first is not None else None
+    last_us = timestamp.to_microseconds(last) if last is not None else None
+    stream_pipeline = pipelines.pipelines.get((logger_id, "low"))
+    if stream_pipeline is not None and stream_pipeline.writer.num_rows > 0:
+        writer = stream_pipeline.writer
+        first_us = writer.initial_us if first_us is None else min(first_us, writer.initial_us)
+        last_us = writer.final_us if last_us is None else max(last_us, writer.final_us)
+    start_us = timestamp.to_microseconds(start) if start is not None else first_us
+    end_us = timestamp.to_microseconds(end) if end is not None else last_us
+    gaps = await asyncio.to_thread(get_coverage_map().find_gaps, dir, start_us, end_us)
+    return {
+        "first_us": first_us,
+        "last_us": last_us,
+        "gaps": gaps,
+        "coverage": continuity.coverage(gaps, start_us, end_us) if start_us is not None and end_us is not None else None
+    }
+
+@app.get("/live/{stream}")
+async def get_live_data(
+    stream: Literal["low", "high"],
+    channels: Optional[str] = None,
+    decimation: int = Query(1, ge=1),
+    backfill_s: Optional[float] = Query(None, ge=0),
+    logger_id: str = Query("", alias="logger")
+):
+    """
+    #### HTTP Get method for streaming the data live as it is received, as server-sent events
+
+    Each uploaded batch is sent as an event holding a json object of the header, timestamps and channel values.\n
+    The recent samples kept in memory are sent first, so a new viewer does not start with an empty plot,
+    and no files are read for live viewers.\n
+    When running several workers, each viewer is only sent the data uploaded to the worker it is connected to.
+
+    ##### Parameters:
+    - stream: Literal["low", "high"]
+        - either low for the low frequency data or high for the high frequency data
+    - channels: Optional[str] = None
+        - comma separated names of the channels to send, all channels if not given
+    - decimation: int = Query(1, ge=1)
+        - only every decimation-th sample is sent
+    - backfill_s: Optional[float] = Query(None, ge=0)
+        - seconds of samples before the most recent sample to send first, every sample kept in memory if not given
+    - logger_id: str = Query("", alias="logger")
+        - identity of the logger, the default logger if not given
+
+    ##### Returns:
+    - The event stream of the samples
+    """
+    settings = get_settings()
+    if (logger_id and not LOGGER_ID_PATTERN.fullmatch(logger_id)) or not os.path.isdir(get_stream_dir(logger_id, stream)):
+        raise HTTPException(status_code=404, detail=f"No {stream} frequency data for logger {logger_id!r}")
+    header = json.loads(settings.low_freq_header if stream == "low" else settings.high_freq_header)
+    channel_names = channels.split(",") if channels else None
+    if channel_names is not None and not set(channel_names) <= set(header[1:]):
+        raise HTTPException(status_code=400, detail=f"Unknown channels, expected any of {header[1:]}")
+    import live
+    live_hub = get_live_hub()
+    subscription = live.Subscription(header, channel_names, decimation)
+    live_hub.subscribe(logger_id, stream, subscription, backfill_s)
+
+    async def send_events():
+        try:  # stream the events until the viewer disconnects
+            async for event in live.iter_events(subscription):
+                yield event
+        finally:
+            live_hub.unsubscribe(logger_id, stream, subscription)
+
+    return StreamingResponse(send_events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
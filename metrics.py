@@ -0,0 +1,357 @@
+"""
+Counters, gauges and histograms of the web application, served in the Prometheus text format by GET /metrics.
+For use with the Python web application for CR1000 data logging.
+
+Each update is a dictionary lookup and an addition under a lock, so the metrics are cheap enough to leave on under load.
+Metrics can also be read from a collect function when they are scraped, such as the depth of each queue, so they cost nothing on the request path.\n
+Each worker process keeps its own metrics, so with several workers a scrape reads the worker that answered it.
+
+Author: Liam Eime
+Date: 12/12/2023
+"""
+
+# Python imports
+from contextlib import contextmanager
+from typing import Callable
+from bisect import bisect_left
+import threading
+import time
+
+# upper bounds of the histogram buckets of durations in seconds, and of sizes in bytes
+SECONDS_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BYTES_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+
+def format_labels(labels: dict):
+    """
+    #### Format labels as the label set of a sample
+
+    ##### Parameters:
+    - labels: dict
+        - label values by label name
+
+    ##### Returns:
+    - label_set: str
+        - the label set, empty if there are no labels
+    """
+    if not labels:
+        return ""
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+def format_value(value: float):
+    """
+    #### Format a sample value, integers without a decimal point
+
+    ##### Returns:
+    - text: str
+        - the formatted value
+    """
+    if value == float('inf'):
+        return "+Inf"
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+class Metric:
+    """
+    #### Base class of the metrics, holding a value for each set of label values
+    """
+    type = "untyped"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple[str] = (),
+        collect: Callable[[], dict] = None
+    ):
+        """
+        #### Create the metric
+
+        ##### Parameters:
+        - name: str
+            - name of the metric
+        - help: str
+            - description of the metric
+        - labelnames: tuple[str] = ()
+            - names of the labels of the metric
+        - collect: Callable[[], dict] = None
+            - called when the metric is scraped for its value by the tuple of label values, rather than the values being updated
+        """
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict):
+        """
+        #### Get the tuple of label values the value is stored under
+        """
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """
+        #### Get the samples of the metric
+
+        ##### Returns:
+        - samples: list[tuple[str, dict, float]]
+            - name, labels and value of each sample
+        """
+        if self.collect is not None:
+            values = self.collect()
+        else:
+            with self._lock:
+                values = dict(self._values)
+        return [(self.name, dict(zip(self.labelnames, key)), value) for key, value in sorted(values.items())]
+
+    def render(self):
+        """
+        #### Format the metric in the Prometheus text format
+
+        ##### Returns:
+        - text: str
+            - the help, type and samples of the metric
+        """
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(f"{name}{format_labels(labels)} {format_value(value)}" for name, labels, value in self.samples())
+        return "\n".join(lines) + "\n"
+
+class Counter(Metric):
+    """
+    #### Count that only increases, such as rows ingested
+    """
+    type = "counter"
+
+    def inc(
+        self,
+        amount: float = 1,
+        **labels
+    ):
+        """
+        #### Increase the count for a set of label values
+
+        ##### Parameters:
+        - amount: float = 1
+            - amount to increase the count by
+        - **labels
+            - value of each label
+
+        ##### Returns:
+        - None
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(Metric):
+    """
+    #### Value that can go up and down, such as the depth of a queue
+    """
+    type = "gauge"
+
+    def set(
+        self,
+        value: float,
+        **labels
+    ):
+        """
+        #### Set the value for a set of label values
+
+        ##### Parameters:
+        - value: float
+            - the value
+        - **labels
+            - value of each label
+
+        ##### Returns:
+        - None
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+class Histogram(Metric):
+    """
+    #### Distribution of observed values in cumulative buckets, with their sum and count, such as the latency of a stage
+    """
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple[str] = (),
+        buckets: tuple[float] = SECONDS_BUCKETS
+    ):
+        """
+        #### Create the histogram
+
+        ##### Parameters:
+        - name: str
+            - name of the metric
+        - help: str
+            - description of the metric
+        - labelnames: tuple[str] = ()
+            - names of the labels of the metric
+        - buckets: tuple[float] = SECONDS_BUCKETS
+            - upper bound of each bucket, in increasing order
+        """
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(
+        self,
+        value: float,
+        **labels
+    ):
+        """
+        #### Add an observed value
+
+        ##### Parameters:
+        - value: float
+            - the observed value
+        - **labels
+            - value of each label
+
+        ##### Returns:
+        - None
+        """
+        key = self._key(labels)
+        with self._lock:
+            if key not in self._values:
+                # the count of each bucket and of the +Inf bucket, followed by the sum
+                self._values[key] = [0] * (len(self.buckets) + 1) + [0]
+            counts = self._values[key]
+            counts[bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        #### Observe the seconds taken by the block of a with statement
+
+        ##### Parameters:
+        - **labels
+            - value of each label
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = {key: list(counts) for key, counts in self._values.items()}
+        samples = []
+        for key, counts in sorted(values.items()):
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for upper_bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", {**labels, "le": format_value(upper_bound)}, cumulative))
+            samples.append((f"{self.name}_sum", labels, counts[-1]))
+            samples.append((f"{self.name}_count", labels, cumulative))
+        return samples
+
+class Registry:
+    """
+    #### Metrics served together by GET /metrics
+    """
+
+    def __init__(self):
+        """
+        #### Create an empty registry
+        """
+        self.metrics = []
+
+    def register(self, metric: Metric):
+        """
+        #### Add a metric to the registry
+
+        ##### Parameters:
+        - metric: Metric
+            - the metric
+
+        ##### Returns:
+        - metric: Metric
+            - the same metric, so it can be created and registered in one statement
+        """
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """
+        #### Format every metric in the Prometheus text format
+
+        ##### Returns:
+        - text: str
+            - the text served by GET /metrics
+        """
+        return "".join(metric.render() for metric in self.metrics)
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "datalog_stage_seconds",
+    "Seconds taken by each stage of ingesting the logger data",
+    ("stage", "stream")
+))
+PAYLOAD_BYTES = REGISTRY.register(Histogram(
+    "datalog_payload_bytes",
+    "Size in bytes of each upload request body",
+    ("stream",),
+    BYTES_BUCKETS
+))
+ROWS_INGESTED = REGISTRY.register(Counter(
+    "datalog_rows_ingested_total",
+    "Rows parsed from the upload requests and queued to be written",
+    ("logger", "stream")
+))
+MALFORMED_ROWS = REGISTRY.register(Counter(
+    "datalog_malformed_rows_total",
+    "Malformed rows dropped from the upload requests",
+    ("logger", "stream")
+))
+FILES_COMPLETED = REGISTRY.register(Counter(
+    "datalog_files_completed_total",
+    "Running files renamed with their timestamp once complete",
+    ("stream",)
+))
+EVENT_MERGES = REGISTRY.register(Counter(
+    "datalog_event_merges_total",
+    "High frequency bursts appended to the open event they continue"
+))
+RETENTION_DELETED_FILES = REGISTRY.register(Counter(
+    "datalog_retention_deleted_files_total",
+    "Files deleted by the retention limits"
+))
+IMPORTED_ROWS = REGISTRY.register(Counter(
+    "datalog_imported_rows_total",
+    "Rows imported from table files, not counting the rows already stored",
+    ("logger", "stream")
+))
+DUPLICATE_ROWS = REGISTRY.register(Counter(
+    "datalog_duplicate_rows_total",
+    "Rows dropped for repeating the timestamp of a row already written, such as from a retried upload",
+    ("stream",)
+))
+OUT_OF_ORDER_ROWS = REGISTRY.register(Counter(
+    "datalog_out_of_order_rows_total",
+    "Rows older than a row written before them, by whether they were dropped or reordered by the continuity policy",
+    ("stream", "action")
+))
+GAPS = REGISTRY.register(Counter(
+    "datalog_gaps_total",
+    "Gaps between consecutive samples added to the coverage map",
+    ("stream",)
+))
+COMPACTED_FILES = REGISTRY.register(Counter(
+    "datalog_compacted_files_total",
+    "Files merged into hourly or daily archives by the compactor"
+))
+SWALLOWED_EXCEPTIONS = REGISTRY.register(Counter(
+    "datalog_swallowed_exceptions_total",
+    "Exceptions caught and logged or ignored without stopping the application, by where they were caught",
+    ("where",)
+))
@@ -0,0 +1,356 @@
+"""
+Parser for the HTTPPost payloads sent by the CR1000 data logger.
+For use with the Python web application for CR1000 data logging.
+
+The raw bytes of a request are parsed in one pass into a DataBatch holding a datetime64 timestamp column
+and float32 channel columns, along with the cleaned csv rows so the writers can write them without re-formatting.
+Samples read back from a file as columns are formatted as csv rows the same way as the logger.
+
+Author: Liam Eime
+Date: 12/12/2023
+"""
+
+# Python imports
+from itertools import compress, repeat
+import numpy as np
+import io
+
+class DataBatch:
+    """
+    #### Columnar batch of samples parsed from a HTTPPost payload
+
+    ##### Attributes:
+    - header: list[str]
+        - header of the data, the first column being the timestamp
+    - timestamps: np.ndarray
+        - datetime64[us] timestamp of each sample
+    - channels: np.ndarray
+        - float32 array of shape (number of channels, number of samples), one row for each column of the header after the timestamp
+    - lines: bytes
+        - the samples as csv rows, each ending with \\r\\n
+    - line_offsets: np.ndarray
+        - byte offset of the start of each row in lines, with the length of lines as the final offset
+    - num_malformed: int
+        - number of rows in the payload that were dropped for being malformed or short
+    """
+
+    def __init__(
+        self,
+        header: list[str],
+        timestamps: np.ndarray,
+        channels: np.ndarray,
+        lines: bytes,
+        line_offsets: np.ndarray,
+        num_malformed: int = 0
+    ):
+        self.header = header
+        self.timestamps = timestamps
+        self.channels = channels
+        self.lines = lines
+        self.line_offsets = line_offsets
+        self.num_malformed = num_malformed
+
+    @property
+    def num_rows(self):
+        return len(self.timestamps)
+
+    def column(self, name: str):
+        """
+        #### Get a channel column by its header name
+
+        ##### Parameters:
+        - name: str
+            - name of the column in the header
+
+        ##### Returns:
+        - column: np.ndarray
+            - float32 values of the column
+        """
+        return self.channels[self.header.index(name) - 1]
+
+    def slice(
+        self,
+        start: int,
+        stop: int
+    ):
+        """
+        #### Get the samples from start up to stop as a new batch, without copying the columns
+
+        ##### Parameters:
+        - start: int
+            - index of the first sample
+        - stop: int
+            - index after the last sample
+
+        ##### Returns:
+        - batch: DataBatch
+            - batch of the selected samples
+        """
+        start, stop, _ = slice(start, stop).indices(self.num_rows)
+        stop = max(start, stop)
+        lines = self.lines[self.line_offsets[start]:self.line_offsets[stop]]
+        line_offsets = self.line_offsets[start:stop + 1] - self.line_offsets[start]
+        return DataBatch(self.header, self.timestamps[start:stop], self.channels[:, start:stop], lines, line_offsets)
+
+    def has_lines(self):
+        """
+        #### Check whether the batch holds the csv rows of its samples, batches read from binary files do not
+
+        ##### Returns:
+        - has_lines: bool
+            - True if every sample has its csv row
+        """
+        return self.num_rows == 0 or len(self.lines) > 0
+
+    def take(self, indices: np.ndarray):
+        """
+        #### Get the samples at the given indices as a new batch, in the order of the indices
+
+        ##### Parameters:
+        - indices: np.ndarray
+            - index of each sample to take
+
+        ##### Returns:
+        - batch: DataBatch
+            - batch of the selected samples
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        if not self.has_lines():
+            return DataBatch(self.header, self.timestamps[indices], self.channels[:, indices], b'', np.zeros(len(indices) + 1, dtype=np.int64))
+        starts = self.line_offsets[indices].tolist()
+        ends = self.line_offsets[indices + 1].tolist()
+        lines = b''.join([self.lines[start:end] for start, end in zip(starts, ends)])
+        line_offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(self.line_offsets[indices + 1] - self.line_offsets[indices], out=line_offsets[1:])
+        return DataBatch(self.header, self.timestamps[indices], self.channels[:, indices], lines, line_offsets)
+
+def empty_batch(header: list[str]):
+    """
+    #### Create a batch with no samples
+
+    ##### Parameters:
+    - header: list[str]
+        - header of the data
+
+    ##### Returns:
+    - batch: DataBatch
+        - batch with no samples
+    """
+    return DataBatch(
+        header,
+        np.empty(0, dtype='datetime64[us]'),
+        np.empty((len(header) - 1, 0), dtype=np.float32),
+        b'',
+        np.zeros(1, dtype=np.int64)
+    )
+
+def from_columns(
+    header: list[str],
+    timestamps: np.ndarray,
+    channels: np.ndarray
+):
+    """
+    #### Create a batch from columns, formatting its csv rows the same way as the logger
+
+    ##### Parameters:
+    - header: list[str]
+        - header of the data
+    - timestamps: np.ndarray
+        - datetime64[us] timestamp of each sample
+    - channels: np.ndarray
+        - float32 array of shape (number of channels, number of samples)
+
+    ##### Returns:
+    - batch: DataBatch
+        - batch of the samples
+    """
+    lines = format_csv_rows(timestamps, channels).encode()
+    line_offsets = np.zeros(len(timestamps) + 1, dtype=np.int64)
+    np.cumsum(np.fromiter(map(len, lines.split(b'\r\n')[:-1]), dtype=np.int64, count=len(timestamps)) + 2, out=line_offsets[1:])
+    return DataBatch(header, timestamps, channels, lines, line_offsets)
+
+def merge_batches(batches: list[DataBatch]):
+    """
+    #### Merge batches of the same header into one batch in time order, keeping the order of samples with the same timestamp
+
+    The csv rows are kept if any batch has them, formatting the rows of the batches that do not.
+
+    ##### Parameters:
+    - batches: list[DataBatch]
+        - the batches, at least one
+
+    ##### Returns:
+    - batch: DataBatch
+        - the samples of every batch in time order
+    """
+    header = batches[0].header
+    if any(batch.num_rows > 0 and batch.has_lines() for batch in batches):
+        batches = [batch if batch.has_lines() else from_columns(header, batch.timestamps, batch.channels) for batch in batches]
+        lines = b''.join(batch.lines for batch in batches)
+        line_offsets = np.zeros(sum(batch.num_rows for batch in batches) + 1, dtype=np.int64)
+        np.cumsum(np.concatenate([np.diff(batch.line_offsets) for batch in batches]), out=line_offsets[1:])
+    else:
+        lines = b''
+        line_offsets = np.zeros(sum(batch.num_rows for batch in batches) + 1, dtype=np.int64)
+    batch = DataBatch(
+        header,
+        np.concatenate([batch.timestamps for batch in batches]),
+        np.concatenate([batch.channels for batch in batches], axis=1),
+        lines,
+        line_offsets
+    )
+    if np.any(batch.timestamps[1:] < batch.timestamps[:-1]):
+        batch = batch.take(np.argsort(batch.timestamps, kind='stable'))
+    return batch
+
+def format_timestamps(timestamps: np.ndarray):
+    """
+    #### Format timestamps the same way as the logger, with milli-seconds only if any timestamp has a fraction of a second
+
+    ##### Parameters:
+    - timestamps: np.ndarray
+        - datetime64[us] timestamps
+
+    ##### Returns:
+    - timestamp_strings: np.ndarray
+        - formatted timestamps
+    """
+    microseconds = timestamps.astype(np.int64)
+    unit = 's' if not np.any(microseconds % 1_000_000) else 'ms'
+    return np.char.replace(np.datetime_as_string(timestamps, unit=unit), 'T', ' ')
+
+def format_csv_rows(
+    timestamps: np.ndarray,
+    values: np.ndarray
+):
+    """
+    #### Format samples as csv rows, with the timestamps written the same way as the logger
+
+    ##### Parameters:
+    - timestamps: np.ndarray
+        - datetime64[us] timestamp of each sample
+    - values: np.ndarray
+        - float32 array of shape (number of channels, number of samples)
+
+    ##### Returns:
+    - text: str
+        - csv rows, each ending with \\r\\n
+    """
+    timestamp_strings = format_timestamps(timestamps)
+    if values.shape[0] == 0:
+        return ''.join(f"{t}\r\n" for t in timestamp_strings)
+    buffer = io.StringIO()
+    np.savetxt(buffer, values.T, fmt='%.7g', delimiter=',')
+    return ''.join(f"{t},{row}\r\n" for t, row in zip(timestamp_strings, buffer.getvalue().splitlines()))
+
+def parse_payload(
+    raw_bytes: bytes,
+    header: list[str]
+):
+    """
+    #### Parse the raw bytes of a HTTPPost payload to a DataBatch
+
+    Rows are separated by \\r\\n and fields by commas, with the timestamp as the first field of each row.
+    Quotes are removed, empty fields are read as NaN, and rows without one field per header column,
+    with a field that can not be read or without a timestamp are dropped.
+
+    ##### Parameters:
+    - raw_bytes: bytes
+        - raw bytes of the http request body
+    - header: list[str]
+        - header of the data, its length sets the number of fields in each row
+
+    ##### Returns:
+    - batch: DataBatch
+        - parsed samples
+    """
+    num_fields = len(header)
+    lines = raw_bytes.translate(None, b'"\r').split(b'\n')
+    # keep only the rows with the right number of fields
+    comma_counts = np.fromiter(map(bytes.count, lines, repeat(b',')), dtype=np.int64, count=len(lines))
+    line_lengths = np.fromiter(map(len, lines), dtype=np.int64, count=len(lines))
+    is_complete = comma_counts == num_fields - 1
+    num_malformed = int(np.count_nonzero(~is_complete & (line_lengths > 0)))
+    complete_lines = list(compress(lines, is_complete))
+    complete_lengths = line_lengths[is_complete]
+    # convert every row at once, only finding the bad rows if a field could not be read
+    try:  # try convert all rows at once
+        records = _convert_lines(complete_lines, num_fields)
+    except ValueError:
+        is_valid = _find_valid_lines(complete_lines, num_fields)
+        num_malformed += int(np.count_nonzero(~is_valid))
+        complete_lines = list(compress(complete_lines, is_valid))
+        complete_lengths = complete_lengths[is_valid]
+        records = _convert_lines(complete_lines, num_fields)
+    # an empty or NaT timestamp converts, but the row can not be written without a time
+    is_timed = ~np.isnat(records['timestamp'])
+    if not np.all(is_timed):
+        num_malformed += int(np.count_nonzero(~is_timed))
+        complete_lines = list(compress(complete_lines, is_timed))
+        complete_lengths = complete_lengths[is_timed]
+        records = records[is_timed]
+    if not complete_lines:
+        batch = empty_batch(header)
+        batch.num_malformed = num_malformed
+        return batch
+    lines = b'\r\n'.join(complete_lines) + b'\r\n'
+    line_offsets = np.zeros(len(complete_lines) + 1, dtype=np.int64)
+    np.cumsum(complete_lengths + 2, out=line_offsets[1:])
+    channels = np.ascontiguousarray(records['channels'].T)
+    return DataBatch(header, records['timestamp'], channels, lines, line_offsets, num_malformed)
+
+def _convert_lines(
+    lines: list[bytes],
+    num_fields: int
+):
+    """
+    #### Convert csv rows to a structured array of the timestamp and channel columns in one pass
+
+    ##### Parameters:
+    - lines: list[bytes]
+        - csv rows without quotes or line endings
+    - num_fields: int
+        - number of fields in each row
+
+    ##### Returns:
+    - records: np.ndarray
+        - structured array with a datetime64[us] 'timestamp' field and a float32 'channels' field for each row
+    """
+    dtype = np.dtype([('timestamp', 'datetime64[us]'), ('channels', np.float32, (num_fields - 1,))])
+    if not lines:
+        return np.empty(0, dtype=dtype)
+    text = b'\n'.join(lines)
+    if b',,' in text or b',\n' in text or text.endswith(b','):  # read empty fields as NaN
+        text = text.replace(b',,', b',nan,').replace(b',,', b',nan,').replace(b',\n', b',nan\n')
+        if text.endswith(b','):
+            text += b'nan'
+    records = np.loadtxt(io.BytesIO(text), delimiter=',', dtype=dtype, comments=None, ndmin=1)
+    return records
+
+def _find_valid_lines(
+    lines: list[bytes],
+    num_fields: int
+):
+    """
+    #### Find the csv rows in which every field can be converted
+
+    The rows are halved until each half converts, so only the halves holding a bad row are converted again.
+
+    ##### Parameters:
+    - lines: list[bytes]
+        - csv rows without quotes or line endings
+    - num_fields: int
+        - number of fields in each row
+
+    ##### Returns:
+    - is_valid: np.ndarray
+        - bool array, True for each row that can be converted
+    """
+    try:  # try convert the rows at once
+        _convert_lines(lines, num_fields)
+        return np.ones(len(lines), dtype=bool)
+    except ValueError:
+        if len(lines) == 1:
+            return np.zeros(1, dtype=bool)
+    half = len(lines) // 2
+    return np.concatenate((_find_valid_lines(lines[:half], num_fields), _find_valid_lines(lines[half:], num_fields)))
@@ -0,0 +1,370 @@
+"""
+Ingestion pipeline for writing the logger data off the event loop.
+For use with the Python web application for CR1000 data logging.
+
+The HTTP handlers parse each request and put the batch on a bounded queue for its stream, then return.
+A single writer thread for each stream drains the queue in order, so one slow write does not stall the requests of other streams,
+and a full queue makes the handlers wait rather than buffering without limit.
+
+Author: Liam Eime
+Date: 12/12/2023
+"""
+
+# Python imports
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, TYPE_CHECKING
+import functools
+import asyncio
+import logging
+import time
+import os
+import numpy as np
+
+# .py file imports
+import payload
+import writers
+import locks
+import metrics
+
+if TYPE_CHECKING:  # the pyramids and ring buffers are created by main, which imports their modules when they are used
+    import downsample
+    import hotstore
+
+logger = logging.getLogger(__name__)
+
+class StreamPipeline:
+    """
+    #### Queue and writer thread for one stream of data
+
+    Every call on the writer goes through the writer thread, so the writer is only ever used from one thread.\n
+    When several worker processes write the same stream, each call holds the stream's shared state lock,
+    reloading the writer state if another process has written since, so only one process writes the stream at a time.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        writer: writers.DataFileWriter,
+        on_completed: Callable[[list[str]], None],
+        max_queue_size: int,
+        shared_state: locks.SharedState = None,
+        pyramid: "downsample.Pyramid" = None,
+        ring_buffer: "hotstore.RingWriter" = None,
+        on_written: Callable[[payload.DataBatch], None] = None
+    ):
+        """
+        #### Create the pipeline, must be created within the running event loop
+
+        ##### Parameters:
+        - name: str
+            - name of the stream, used for the writer thread name and log messages
+        - writer: writers.DataFileWriter
+            - writer the batches are written with
+        - on_completed: Callable[[list[str]], None]
+            - called on the event loop with the paths to the files completed by each write
+        - max_queue_size: int
+            - number of batches that can wait to be written before putting a batch waits
+        - shared_state: locks.SharedState = None
+            - writer state shared with other worker processes, not shared if None
+        - pyramid: downsample.Pyramid = None
+            - downsampling pyramid updated with each batch after it is written, not updated if None
+        - ring_buffer: hotstore.RingWriter = None
+            - memory-mapped ring buffer each batch is appended to after it is written, not appended to if None
+        - on_written: Callable[[payload.DataBatch], None] = None
+            - called on the event loop with the rows of each batch written after the continuity check, in time order, such as to publish them to live viewers
+        """
+        self.name = name
+        self.shared_state = shared_state
+        self.writer = writer
+        self.pyramid = pyramid
+        self.ring_buffer = ring_buffer
+        self.on_completed = on_completed
+        self.on_written = on_written
+        self.queue = asyncio.Queue(maxsize=max_queue_size)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"{name}-writer")
+        self._task = None
+
+    def start(self):
+        """
+        #### Start draining the queue
+
+        ##### Returns:
+        - None
+        """
+        self._task = asyncio.create_task(self._run())
+
+    async def put(
+        self,
+        batch: payload.DataBatch,
+        wait: bool = False
+    ):
+        """
+        #### Put a batch on the queue to be written, waiting while the queue is full
+
+        ##### Parameters:
+        - batch: payload.DataBatch
+            - parsed samples to write
+        - wait: bool = False
+            - also wait until the batch has been written, raising the error if the write fails
+
+        ##### Returns:
+        - None
+        """
+        written = asyncio.get_running_loop().create_future() if wait else None
+        await self.queue.put((batch, written, time.perf_counter()))
+        if written is not None:
+            await written
+
+    async def run_in_writer(
+        self,
+        func: Callable,
+        *args
+    ):
+        """
+        #### Run a function on the writer thread, after any writes already started
+
+        ##### Parameters:
+        - func: Callable
+            - function to run
+        - *args
+            - arguments to the function
+
+        ##### Returns:
+        - The return value of the function
+        """
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._call_writer, func, *args)
+
+    def _call_writer(
+        self,
+        func: Callable,
+        *args
+    ):
+        """
+        #### Call a function on the writer thread, holding the shared state lock if the stream is shared
+
+        ##### Returns:
+        - The return value of the function
+        """
+        if self.shared_state is None:
+            return func(*args)
+        with self.shared_state.lock:
+            state, is_changed = self.shared_state.read()
+            if is_changed and state is not None:
+                self.writer.load_state(state)
+            result = func(*args)
+            # write out any batches held for a group commit before another process appends to the file
+            self.writer.sync()
+            self.shared_state.write(self.writer.dump_state())
+        return result
+
+    def _write(self, batch: payload.DataBatch):
+        """
+        #### Check a batch for continuity, write it and add it to the downsampling pyramid and ring buffer, on the writer thread
+
+        Rows older than the last sample written are merged into the running file by the reorder continuity policy,
+        and are added to the pyramid but not the ring buffer, which only holds samples in time order.
+
+        ##### Returns:
+        - completed_paths: list[str]
+            - paths to the files completed by the write
+        - batch: payload.DataBatch
+            - the rows written after the last sample, without the duplicate and late rows
+        """
+        completed_paths = []
+        written = [batch]
+        if self.writer.continuity_tracker is not None:
+            with metrics.STAGE_SECONDS.time(stage="continuity", stream=self.writer.stream):
+                batch, late = self.writer.continuity_tracker.check(batch)
+            written = [batch]
+            if late.num_rows > 0:
+                with metrics.STAGE_SECONDS.time(stage="write", stream=self.writer.stream):
+                    completed_paths, inserted = self.writer.write_late(late)
+                written.append(inserted)
+        if batch.num_rows > 0:
+            with metrics.STAGE_SECONDS.time(stage="write", stream=self.writer.stream):
+                completed_paths.extend(self.writer.write(batch))
+        if self.pyramid is not None and sum(written_batch.num_rows for written_batch in written) > 0:
+            with metrics.STAGE_SECONDS.time(stage="downsample", stream=self.writer.stream):
+                self.pyramid.update(
+                    np.concatenate([written_batch.timestamps for written_batch in written]),
+                    np.concatenate([written_batch.channels for written_batch in written], axis=1)
+                )
+        if self.ring_buffer is not None and batch.num_rows > 0:
+            self.ring_buffer.append(batch.timestamps, batch.channels)
+        return completed_paths, batch
+
+    def _close(self):
+        """
+        #### Close the writer, the downsampling pyramid and the ring buffer, on the writer thread
+        """
+        self.writer.close()
+        if self.pyramid is not None:
+            self.pyramid.close()
+        if self.ring_buffer is not None:
+            self.ring_buffer.close()
+
+    async def _run(self):
+        """
+        #### Write each batch from the queue in order on the writer thread
+        """
+        while True:
+            batch, written, put_time = await self.queue.get()
+            metrics.STAGE_SECONDS.observe(time.perf_counter() - put_time, stage="queue_wait", stream=self.writer.stream)
+            try:  # try write the batch, logging errors so later batches are still written
+                completed_paths, batch = await self.run_in_writer(self._write, batch)
+                self.on_completed(completed_paths)
+                if self.on_written is not None and batch.num_rows > 0:
+                    self.on_written(batch)
+                if written is not None and not written.done():
+                    written.set_result(None)
+            except Exception as e:
+                logger.error("There was an error writing the %s data", self.name, exc_info=True)
+                metrics.SWALLOWED_EXCEPTIONS.inc(where="write")
+                if written is not None and not written.done():
+                    written.set_exception(e)
+            finally:
+                self.queue.task_done()
+
+    async def stop(self):
+        """
+        #### Write every batch left on the queue, then close the writer and its thread
+
+        ##### Returns:
+        - None
+        """
+        await self.queue.join()
+        self._task.cancel()
+        await self.run_in_writer(self._close)
+        self._executor.shutdown()
+        if self.shared_state is not None:
+            self.shared_state.close()
+
+class PipelineRegistry:
+    """
+    #### Pipelines for each logger and stream, created the first time a logger sends data
+    """
+
+    def __init__(
+        self,
+        create_writer: Callable[[str, str], writers.DataFileWriter],
+        on_completed: Callable[[list[str]], None],
+        max_queue_size: int,
+        shared_state_dir: str = None,
+        create_pyramid: Callable[[str, str], "downsample.Pyramid"] = None,
+        create_ring_buffer: Callable[[str, str], "hotstore.RingWriter"] = None,
+        on_written: Callable[[str, str, payload.DataBatch], None] = None
+    ):
+        """
+        #### Create the registry, must be created within the running event loop
+
+        ##### Parameters:
+        - create_writer: Callable[[str, str], writers.DataFileWriter]
+            - called with the logger id and stream to create the writer for a new pipeline, run off the event loop
+        - on_completed: Callable[[list[str]], None]
+            - called on the event loop with the paths to the files completed by each write
+        - max_queue_size: int
+            - number of batches that can wait to be written for each pipeline
+        - shared_state_dir: str = None
+            - folder for the writer state shared between worker processes, not shared if None
+        - create_pyramid: Callable[[str, str], downsample.Pyramid] = None
+            - called with the logger id and stream to create the downsampling pyramid for a new pipeline, no pyramid if None
+        - create_ring_buffer: Callable[[str, str], hotstore.RingWriter] = None
+            - called with the logger id and stream to create the ring buffer for a new pipeline, run off the event loop, no ring buffer if None
+        - on_written: Callable[[str, str, payload.DataBatch], None] = None
+            - called on the event loop with the logger id, stream and rows of each batch written after the continuity check
+        """
+        self.create_writer = create_writer
+        self.on_completed = on_completed
+        self.max_queue_size = max_queue_size
+        self.shared_state_dir = shared_state_dir
+        self.create_pyramid = create_pyramid
+        self.create_ring_buffer = create_ring_buffer
+        self.on_written = on_written
+        self.pipelines = {}
+        self._lock = asyncio.Lock()
+
+    def _create_shared_writer(
+        self,
+        logger_id: str,
+        stream: str,
+        shared_state: locks.SharedState
+    ):
+        """
+        #### Create a writer while holding its shared state lock, so no other process writes the stream while it recovers
+
+        ##### Returns:
+        - writer: writers.DataFileWriter
+            - the new writer
+        """
+        if shared_state is None:
+            return self.create_writer(logger_id, stream)
+        with shared_state.lock:
+            state, _ = shared_state.read()
+            writer = self.create_writer(logger_id, stream)
+            if state is not None:
+                writer.load_state(state)
+            shared_state.write(writer.dump_state())
+        return writer
+
+    async def get(
+        self,
+        logger_id: str,
+        stream: str
+    ):
+        """
+        #### Get the pipeline for a logger and stream, creating and starting it if it does not exist
+
+        ##### Parameters:
+        - logger_id: str
+            - identity of the logger, empty for the default logger
+        - stream: str
+            - either low or high
+
+        ##### Returns:
+        - stream_pipeline: StreamPipeline
+            - the pipeline
+        """
+        key = (logger_id, stream)
+        if key in self.pipelines:
+            return self.pipelines[key]
+        async with self._lock:
+            if key not in self.pipelines:
+                shared_state = None
+                if self.shared_state_dir is not None:
+                    shared_state = locks.SharedState(os.path.join(self.shared_state_dir, f"{logger_id or 'default'}-{stream}.json"))
+                writer = await asyncio.to_thread(self._create_shared_writer, logger_id, stream, shared_state)
+                pyramid = self.create_pyramid(logger_id, stream) if self.create_pyramid is not None else None
+                ring_buffer = None
+                if self.create_ring_buffer is not None:
+                    ring_buffer = await asyncio.to_thread(self.create_ring_buffer, logger_id, stream)
+                name = f"{logger_id} {stream} frequency" if logger_id else f"{stream} frequency"
+                on_written = functools.partial(self.on_written, logger_id, stream) if self.on_written is not None else None
+                stream_pipeline = StreamPipeline(name, writer, self.on_completed, self.max_queue_size, shared_state, pyramid, ring_buffer, on_written)
+                stream_pipeline.start()
+                self.pipelines[key] = stream_pipeline
+        return self.pipelines[key]
+
+    def get_all(self, stream: str):
+        """
+        #### Get the pipelines of every logger for a stream
+
+        ##### Parameters:
+        - stream: str
+            - either low or high
+
+        ##### Returns:
+        - stream_pipelines: list[StreamPipeline]
+            - the pipelines
+        """
+        return [stream_pipeline for (_, pipeline_stream), stream_pipeline in self.pipelines.items() if pipeline_stream == stream]
+
+    async def stop(self):
+        """
+        #### Stop every pipeline, writing every queued batch
+
+        ##### Returns:
+        - None
+        """
+        for stream_pipeline in self.pipelines.values():
+            await stream_pipeline.stop()
+        self.pipelines.clear()
@@ -0,0 +1,122 @@
+"""
+Functions for reading the logger data for a time window.
+For use with the Python web application for CR1000 data logging.
+
+The files to read are planned with the file index, so only the files overlapping the time window are opened.
+
+Author: Liam Eime
+Date: 12/12/2023
+"""
+
+# Python imports
+import numpy as np
+
+# .py file imports
+import storage
+import payload
+
+ROWS_PER_CHUNK = 10000
+
+def read_window(
+    path: str,
+    start: np.datetime64 = None,
+    end: np.datetime64 = None,
+    channels: list[str] = None
+):
+    """
+    #### Read the rows of a data file within a time window
+
+    ##### Parameters:
+    - path: str
+        - path to the data file
+    - start: np.datetime64 = None
+        - start of the time window, unbounded if None
+    - end: np.datetime64 = None
+        - end of the time window, unbounded if None
+    - channels: list[str] = None
+        - names of the channels to read, all channels if None
+
+    ##### Returns:
+    - header: list[str]
+        - header of the data read, the timestamp followed by the selected channels
+    - timestamps: np.ndarray
+        - datetime64[us] timestamp of each sample in the window
+    - values: np.ndarray
+        - float32 array of shape (number of selected channels, number of samples in the window)
+    """
+    header, timestamps, values = storage.get_backend_for_path(path).read(path)
+    first = 0 if start is None else np.searchsorted(timestamps, start, side='left')
+    last = len(timestamps) if end is None else np.searchsorted(timestamps, end, side='right')
+    if channels is not None:
+        channel_indices = [header.index(name) - 1 for name in channels if name in header[1:]]
+        header = [header[0]] + [header[i + 1] for i in channel_indices]
+        values = values[channel_indices]
+    return header, timestamps[first:last], values[:, first:last]
+
+def iter_csv(
+    paths: list[str],
+    start: np.datetime64 = None,
+    end: np.datetime64 = None,
+    channels: list[str] = None
+):
+    """
+    #### Generate csv text of the samples within a time window from data files, one file and chunk at a time
+
+    ##### Parameters:
+    - paths: list[str]
+        - paths to the data files, in time order
+    - start: np.datetime64 = None
+        - start of the time window, unbounded if None
+    - end: np.datetime64 = None
+        - end of the time window, unbounded if None
+    - channels: list[str] = None
+        - names of the channels to read, all channels if None
+
+    ##### Yields:
+    - text: str
+        - the header row, then chunks of csv rows
+    """
+    header_written = False
+    for path in paths:
+        try:  # try read the file, skipping files removed since the query was planned
+            header, timestamps, values = read_window(path, start, end, channels)
+        except FileNotFoundError:
+            continue
+        if not header_written:
+            yield ','.join(header) + '\r\n'
+            header_written = True
+        for first in range(0, len(timestamps), ROWS_PER_CHUNK):
+            last = first + ROWS_PER_CHUNK
+            yield payload.format_csv_rows(timestamps[first:last], values[:, first:last])
+
+def iter_summary_csv(
+    header: list[str],
+    records: np.ndarray,
+    width_s: int,
+    channels: list[str] = None
+):
+    """
+    #### Generate csv text of the minimum, maximum, mean and RMS of each channel for each bucket of a downsampling pyramid level
+
+    ##### Parameters:
+    - header: list[str]
+        - header of the data the records were aggregated from
+    - records: np.ndarray
+        - one record for each bucket, in bucket order
+    - width_s: int
+        - width in seconds of the buckets
+    - channels: list[str] = None
+        - names of the channels to summarise, all channels if None
+
+    ##### Yields:
+    - text: str
+        - the header row, with .min, .max, .mean and .rms columns for each channel, then chunks of csv rows
+    """
+    import downsample
+    channel_names = header[1:] if channels is None else channels
+    channel_indices = [header.index(name) - 1 for name in channel_names]
+    yield ','.join([header[0]] + [f"{name}.{statistic}" for name in channel_names for statistic in ('min', 'max', 'mean', 'rms')]) + '\r\n'
+    for first in range(0, len(records), ROWS_PER_CHUNK):
+        timestamps, minimum, maximum, mean, rms = downsample.summarise(records[first:first + ROWS_PER_CHUNK], width_s)
+        values = np.stack([minimum, maximum, mean, rms], axis=1)[channel_indices].reshape(-1, len(timestamps))
+        yield payload.format_csv_rows(timestamps, values)
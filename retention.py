@@ -0,0 +1,213 @@
+"""
+Retention manager for limiting the files kept in the output folders.
+For use with the Python web application for CR1000 data logging.
+
+Keeps an in-memory view of each managed folder, oldest file first, seeded with one directory scan the first time a folder is managed.
+Completed files are added as they are written, so enforcing the limits never needs another directory scan.
+
+Author: Liam Eime
+Date: 12/12/2023
+"""
+
+# Python imports
+from collections import deque
+import bisect
+import os
+import time
+import logging
+import threading
+
+# .py file imports
+import index
+
+logger = logging.getLogger(__name__)
+
+class RetentionManager:
+    """
+    #### Retention manager for the output folders
+
+    Files are deleted oldest first, in batches, while a folder has more than max_num_of_files files,
+    holds more than max_total_bytes bytes, or its oldest file is older than max_age_s.\\n
+    A limit of 0 disables that limit.
+    """
+
+    def __init__(
+        self,
+        max_num_of_files: int,
+        max_age_s: float = 0,
+        max_total_bytes: int = 0,
+        file_index: index.FileIndex = None,
+        exclude_filenames: tuple[str] = ()
+    ):
+        """
+        #### Create the retention manager
+
+        ##### Parameters:
+        - max_num_of_files: int
+            - number of files to limit each folder to
+        - max_age_s: float = 0
+            - age in seconds, from when a file was last written, after which it is deleted
+        - max_total_bytes: int = 0
+            - total size in bytes to limit each folder to
+        - file_index: index.FileIndex = None
+            - index the deleted files are removed from, not updated if None
+        - exclude_filenames: tuple[str] = ()
+            - filenames never to delete, such as the running files
+        """
+        self.max_num_of_files = max_num_of_files
+        self.max_age_s = max_age_s
+        self.max_total_bytes = max_total_bytes
+        self.file_index = file_index
+        self.exclude_filenames = set(exclude_filenames)
+        self._folders = {}
+        self._paths = {}
+        self._total_bytes = {}
+        self._lock = threading.Lock()
+
+    def add_folder(self, folder: str):
+        """
+        #### Start managing a folder, seeding its view with a directory scan of its data files, leaving out the dot-files
+
+        ##### Parameters:
+        - folder: str
+            - folder to manage
+
+        ##### Returns:
+        - None
+        """
+        entries = []
+        with os.scandir(folder) as it:
+            for entry in it:
+                # dot-files, such as the hot store ring buffer and its lock, are kept by the writers and never deleted
+                if entry.is_file() and not entry.name.startswith(".") and entry.name not in self.exclude_filenames:
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, entry.path, stat.st_size))
+        entries.sort()
+        with self._lock:
+            self._folders[folder] = deque(entries)
+            self._paths[folder] = {path for _, path, _ in entries}
+            self._total_bytes[folder] = sum(size for _, _, size in entries)
+
+    def add_file(self, path: str):
+        """
+        #### Add a completed file to the view of its folder, starting to manage the folder if it is not yet managed
+
+        ##### Parameters:
+        - path: str
+            - path to the completed file
+
+        ##### Returns:
+        - None
+        """
+        folder = os.path.dirname(path)
+        if folder not in self._folders:
+            self.add_folder(folder)
+            return
+        try:  # try get the size of the file, it may already have been removed
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            if path in self._paths[folder]:
+                return
+            entries = self._folders[folder]
+            if entries and stat.st_mtime < entries[-1][0]:
+                # an archive keeps the time its newest merged file was written, so it is put in order rather than at the end
+                bisect.insort(entries, (stat.st_mtime, path, stat.st_size))
+            else:
+                entries.append((stat.st_mtime, path, stat.st_size))
+            self._paths[folder].add(path)
+            self._total_bytes[folder] += stat.st_size
+
+    def _is_over_limit(
+        self,
+        folder: str,
+        now: float
+    ):
+        """
+        #### Check whether a folder is over any of its limits
+
+        ##### Parameters:
+        - folder: str
+            - managed folder
+        - now: float
+            - current time in seconds since the epoch
+
+        ##### Returns:
+        - is_over_limit: bool
+            - True if the oldest file should be deleted
+        """
+        entries = self._folders[folder]
+        if not entries:
+            return False
+        return (
+            (self.max_num_of_files > 0 and len(entries) > self.max_num_of_files)
+            or (self.max_total_bytes > 0 and self._total_bytes[folder] > self.max_total_bytes)
+            or (self.max_age_s > 0 and now - entries[0][0] > self.max_age_s)
+        )
+
+    def enforce(self):
+        """
+        #### Delete the oldest files of each folder until every folder is within its limits
+
+        ##### Returns:
+        - deleted_paths: list[str]
+            - paths to the deleted files
+        """
+        now = time.time()
+        to_delete = []
+        with self._lock:
+            for folder in self._folders:
+                while self._is_over_limit(folder, now):
+                    _, path, size = self._folders[folder].popleft()
+                    self._paths[folder].discard(path)
+                    self._total_bytes[folder] -= size
+                    to_delete.append(path)
+        deleted_paths = []
+        for path in to_delete:
+            try:  # try delete the file, it may already have been removed
+                os.remove(path)
+                deleted_paths.append(path)
+            except FileNotFoundError:
+                deleted_paths.append(path)
+            except OSError:
+                logger.error("There was an error deleting %s", path, exc_info=True)
+        if deleted_paths and self.file_index is not None:
+            self.file_index.remove_files(deleted_paths)
+        return deleted_paths
+
+    def remove_files(self, paths: list[str]):
+        """
+        #### Remove files deleted by something else, such as the compactor, from the view of their folders
+
+        ##### Parameters:
+        - paths: list[str]
+            - paths to the deleted files
+
+        ##### Returns:
+        - None
+        """
+        removed = set(paths)
+        with self._lock:
+            for folder in {os.path.dirname(path) for path in removed}:
+                if folder not in self._folders:
+                    continue
+                entries = self._folders[folder]
+                self._total_bytes[folder] -= sum(size for _, path, size in entries if path in removed)
+                self._folders[folder] = deque(entry for entry in entries if entry[1] not in removed)
+                self._paths[folder] -= removed
+
+    def num_files(self, folder: str):
+        """
+        #### Get the number of files in the view of a folder
+
+        ##### Parameters:
+        - folder: str
+            - managed folder
+
+        ##### Returns:
+        - num_files: int
+            - number of files
+        """
+        with self._lock:
+            return len(self._folders[folder])
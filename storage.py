@@ -0,0 +1,465 @@
+"""
+Storage backends for writing and reading the logger data files.
+For use with the Python web application for CR1000 data logging.
+
+The backend is selected with the STORAGE_BACKEND setting:
+    - csv: text .csv files, the default
+    - npz: compressed numpy .npz archives with a datetime64 timestamp column and float32 channel columns
+
+Author: Liam Eime
+Date: 12/12/2023
+"""
+
+# Python imports
+import os
+import json
+import numpy as np
+
+# .py file imports
+import timestamp
+import files
+import payload
+
+# size of the write buffer of the running files, so batches waiting for a group commit are written with one system call
+WRITE_BUFFER_BYTES = 1024 * 1024
+
+def sync_directory(dir: str):
+    """
+    #### Flush a directory to disk, so a file renamed into it survives a power loss
+
+    Only possible on POSIX systems, elsewhere the rename is left to the operating system.
+
+    ##### Parameters:
+    - dir: str
+        - path to the directory
+
+    ##### Returns:
+    - None
+    """
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+    fd = os.open(dir, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class CsvBackend:
+    """
+    #### Storage backend for text .csv files
+
+    The running file is a .csv file that rows are appended to and is renamed once complete.
+    """
+    name = 'csv'
+    extension = '.csv'
+    temp_extension = '.csv'
+
+    def open(
+        self,
+        temp_path: str,
+        header: list[str]
+    ):
+        """
+        #### Open a running file for appending, writing the header if the file is new
+
+        ##### Parameters:
+        - temp_path: str
+            - path to the running file
+        - header: list[str]
+            - header of the data
+
+        ##### Returns:
+        - f: file
+            - file opened for appending bytes, with a write buffer of WRITE_BUFFER_BYTES
+        """
+        file_exists = os.path.exists(temp_path) and os.path.getsize(temp_path) > 0
+        f = open(temp_path, 'ab', buffering=WRITE_BUFFER_BYTES)
+        if not file_exists:
+            f.write((','.join(header) + '\r\n').encode())
+        return f
+
+    def append(
+        self,
+        f,
+        batch: payload.DataBatch
+    ):
+        """
+        #### Append the rows of a batch to a running file with a single write
+
+        The rows of a batch read from a binary file are formatted first.
+
+        ##### Parameters:
+        - f: file
+            - file returned by open
+        - batch: payload.DataBatch
+            - parsed samples to write
+
+        ##### Returns:
+        - None
+        """
+        if not batch.has_lines():
+            batch = payload.from_columns(batch.header, batch.timestamps, batch.channels)
+        f.write(batch.lines)
+
+    def repair(self, temp_path: str):
+        """
+        #### Remove a partly written final row left in a running file by a crash or power loss
+
+        ##### Parameters:
+        - temp_path: str
+            - path to the running file
+
+        ##### Returns:
+        - None
+        """
+        size = os.path.getsize(temp_path)
+        with open(temp_path, 'r+b') as f:
+            f.seek(max(size - 65536, 0))
+            tail = f.read()
+            if tail.endswith(b'\n') or b'\n' not in tail:
+                return
+            f.truncate(size - len(tail) + tail.rindex(b'\n') + 1)
+
+    def finalize(
+        self,
+        temp_path: str,
+        path: str,
+        sync: bool = False
+    ):
+        """
+        #### Turn a closed running file into a complete data file
+
+        ##### Parameters:
+        - temp_path: str
+            - path to the closed running file
+        - path: str
+            - path to the complete data file
+        - sync: bool = False
+            - flush the complete data file and its directory to disk before returning
+
+        ##### Returns:
+        - None
+        """
+        os.rename(temp_path, path)
+        if sync:
+            sync_directory(os.path.dirname(path))
+
+    def reopen(
+        self,
+        path: str,
+        temp_path: str
+    ):
+        """
+        #### Turn a complete data file back into a running file to continue appending to it
+
+        ##### Parameters:
+        - path: str
+            - path to the complete data file
+        - temp_path: str
+            - path to the running file
+
+        ##### Returns:
+        - None
+        """
+        os.rename(path, temp_path)
+
+    def read_info(self, path: str):
+        """
+        #### Read the number of rows and the initial and final timestamps of a data file
+
+        ##### Parameters:
+        - path: str
+            - path to the data file
+
+        ##### Returns:
+        - num_rows: int
+            - number of rows in the file
+        - initial_timestamp: np.datetime64
+            - initial timestamp, None if the file has no rows
+        - final_timestamp: np.datetime64
+            - final timestamp, None if the file has no rows
+        """
+        num_rows = files.count_data_rows(path)
+        if num_rows == 0:
+            return 0, None, None
+        initial_timestamp = timestamp.get_initial_datetime64(path)
+        final_timestamp = timestamp.get_final_datetime64(path)
+        # the rows counted are only empty rows
+        if initial_timestamp is None or final_timestamp is None:
+            return 0, None, None
+        return num_rows, initial_timestamp, final_timestamp
+
+    def read(self, path: str):
+        """
+        #### Read a data file to its header, timestamp column and channel columns
+
+        ##### Parameters:
+        - path: str
+            - path to the data file
+
+        ##### Returns:
+        - header: list[str]
+            - header of the data
+        - timestamps: np.ndarray
+            - datetime64[us] timestamp of each sample
+        - channels: np.ndarray
+            - float32 array of shape (number of channels, number of samples)
+        """
+        batch = self.read_batch(path)
+        return batch.header, batch.timestamps, batch.channels
+
+    def read_batch(self, path: str):
+        """
+        #### Read a data file to a batch, along with its csv rows if the file is text
+
+        ##### Parameters:
+        - path: str
+            - path to the data file
+
+        ##### Returns:
+        - batch: payload.DataBatch
+            - samples of the file
+        """
+        with open(path, 'rb') as f:
+            header = f.readline().decode().strip("\r\n").replace('"', '').split(",")
+            batch = payload.parse_payload(f.read(), header)
+        return batch
+
+    def write_batch(
+        self,
+        path: str,
+        batch: payload.DataBatch,
+        sync: bool = False
+    ):
+        """
+        #### Write a batch to a complete data file, replacing any file already at the path
+
+        ##### Parameters:
+        - path: str
+            - path to the data file
+        - batch: payload.DataBatch
+            - samples to write, in time order
+        - sync: bool = False
+            - flush the data file and its directory to disk before returning
+
+        ##### Returns:
+        - None
+        """
+        with open(path + '.part', 'wb', buffering=WRITE_BUFFER_BYTES) as f:
+            f.write((','.join(batch.header) + '\r\n').encode())
+            self.append(f, batch)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(path + '.part', path)
+        if sync:
+            sync_directory(os.path.dirname(path))
+
+class NpzBackend(CsvBackend):
+    """
+    #### Storage backend for compressed numpy .npz archives
+
+    The running file is a .bin file of fixed size binary records, a json header line followed by a
+    datetime64[us] timestamp and float32 channels for each sample, so each batch is appended with a single write.\n
+    Once complete the running file is compressed to a .npz archive holding the timestamps as micro-second differences
+    and each channel as byte planes, which compress much smaller than text.
+    """
+    name = 'npz'
+    extension = '.npz'
+    temp_extension = '.bin'
+
+    @staticmethod
+    def record_dtype(num_channels: int):
+        """
+        #### Get the dtype of the binary records of the running file
+
+        ##### Parameters:
+        - num_channels: int
+            - number of channels after the timestamp
+
+        ##### Returns:
+        - dtype: np.dtype
+            - structured dtype of a record
+        """
+        return np.dtype([('timestamp', '<M8[us]'), ('channels', '<f4', (num_channels,))])
+
+    def open(
+        self,
+        temp_path: str,
+        header: list[str]
+    ):
+        file_exists = os.path.exists(temp_path) and os.path.getsize(temp_path) > 0
+        f = open(temp_path, 'ab', buffering=WRITE_BUFFER_BYTES)
+        if not file_exists:
+            f.write((json.dumps(header) + '\n').encode())
+        return f
+
+    def append(
+        self,
+        f,
+        batch: payload.DataBatch
+    ):
+        records = np.empty(batch.num_rows, dtype=self.record_dtype(len(batch.header) - 1))
+        records['timestamp'] = batch.timestamps
+        records['channels'] = batch.channels.T
+        f.write(records.tobytes())
+
+    def _read_temp(self, temp_path: str):
+        """
+        #### Read the header and binary records of a running file
+
+        A partly written final record is ignored.
+
+        ##### Parameters:
+        - temp_path: str
+            - path to the running file
+
+        ##### Returns:
+        - header: list[str]
+            - header of the data
+        - records: np.ndarray
+            - structured array of the records
+        """
+        with open(temp_path, 'rb') as f:
+            header = json.loads(f.readline())
+            dtype = self.record_dtype(len(header) - 1)
+            data = f.read()
+        records = np.frombuffer(data, dtype=dtype, count=len(data) // dtype.itemsize)
+        return header, records
+
+    def repair(self, temp_path: str):
+        with open(temp_path, 'r+b') as f:
+            header = json.loads(f.readline())
+            header_size = f.tell()
+            record_size = self.record_dtype(len(header) - 1).itemsize
+            data_size = f.seek(0, os.SEEK_END) - header_size
+            if data_size % record_size:
+                f.truncate(header_size + data_size - data_size % record_size)
+
+    def finalize(
+        self,
+        temp_path: str,
+        path: str,
+        sync: bool = False
+    ):
+        header, records = self._read_temp(temp_path)
+        self.write(path, header, records['timestamp'], records['channels'].T, sync)
+        os.remove(temp_path)
+
+    def write(
+        self,
+        path: str,
+        header: list[str],
+        timestamps: np.ndarray,
+        channels: np.ndarray,
+        sync: bool = False
+    ):
+        """
+        #### Write the columns of a data file to a compressed .npz archive
+
+        ##### Parameters:
+        - path: str
+            - path to the data file
+        - header: list[str]
+            - header of the data
+        - timestamps: np.ndarray
+            - datetime64[us] timestamp of each sample
+        - channels: np.ndarray
+            - float32 array of shape (number of channels, number of samples)
+        - sync: bool = False
+            - flush the archive and its directory to disk before returning
+
+        ##### Returns:
+        - None
+        """
+        microseconds = timestamps.astype('datetime64[us]').astype(np.int64)
+        timestamp_diffs = np.diff(microseconds, prepend=np.int64(0))
+        channel_planes = np.ascontiguousarray(channels, dtype='<f4').view(np.uint8).reshape(len(header) - 1, -1, 4).transpose(0, 2, 1)
+        with open(path + '.part', 'wb') as f:
+            np.savez_compressed(f, header=np.array(header), timestamp_diffs=timestamp_diffs, channel_planes=channel_planes)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(path + '.part', path)
+        if sync:
+            sync_directory(os.path.dirname(path))
+
+    def write_batch(
+        self,
+        path: str,
+        batch: payload.DataBatch,
+        sync: bool = False
+    ):
+        self.write(path, batch.header, batch.timestamps, batch.channels, sync)
+
+    def read_batch(self, path: str):
+        header, timestamps, channels = self.read(path)
+        return payload.DataBatch(header, timestamps, channels, b'', np.zeros(len(timestamps) + 1, dtype=np.int64))
+
+    def reopen(
+        self,
+        path: str,
+        temp_path: str
+    ):
+        header, timestamps, channels = self.read(path)
+        with self.open(temp_path, header) as f:
+            self.append(f, payload.DataBatch(header, timestamps, channels, b'', np.zeros(1, dtype=np.int64)))
+        os.remove(path)
+
+    def read_info(self, path: str):
+        if path.endswith(self.temp_extension):
+            _, records = self._read_temp(path)
+            timestamps = records['timestamp']
+        else:
+            _, timestamps, _ = self.read(path)
+        if len(timestamps) == 0:
+            return 0, None, None
+        return len(timestamps), timestamps[0], timestamps[-1]
+
+    def read(self, path: str):
+        if path.endswith(self.temp_extension):
+            header, records = self._read_temp(path)
+            return header, records['timestamp'].copy(), np.ascontiguousarray(records['channels'].T)
+        with np.load(path) as archive:
+            header = archive['header'].tolist()
+            timestamps = np.cumsum(archive['timestamp_diffs']).astype('datetime64[us]')
+            channel_planes = archive['channel_planes']
+        channels = np.ascontiguousarray(channel_planes.transpose(0, 2, 1)).view('<f4').reshape(len(header) - 1, -1)
+        return header, timestamps, channels
+
+BACKENDS = {backend.name: backend for backend in (CsvBackend(), NpzBackend())}
+
+def get_backend(name: str):
+    """
+    #### Get a storage backend by its name
+
+    ##### Parameters:
+    - name: str
+        - name of the storage backend, csv or npz
+
+    ##### Returns:
+    - backend: CsvBackend
+        - the storage backend
+    """
+    try:  # try get the backend, raising a clearer error for an unknown name
+        return BACKENDS[name.lower()]
+    except KeyError:
+        raise ValueError(f"Unknown storage backend '{name}', expected one of {list(BACKENDS)}") from None
+
+def get_backend_for_path(path: str):
+    """
+    #### Get the storage backend that wrote a data file, from the file extension
+
+    ##### Parameters:
+    - path: str
+        - path to the data file
+
+    ##### Returns:
+    - backend: CsvBackend
+        - the storage backend
+    """
+    extension = os.path.splitext(path)[1].lower()
+    for backend in BACKENDS.values():
+        if extension in (backend.extension, backend.temp_extension):
+            return backend
+    raise ValueError(f"No storage backend for file '{path}'")
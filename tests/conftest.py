@@ -0,0 +1,103 @@
+"""
+Shared setup of the tests, run from the repository folder with:
+    python -m pytest tests
+
+Holds the factory of the batches of samples the tests write, and a test client of the app writing to a temporary output directory.
+
+Author: Liam Eime
+Date: 12/12/2023
+"""
+
+# import libraries
+import numpy as np
+import pytest
+import json
+import os
+import sys
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+# .py file imports
+import payload
+
+# settings of the app under test, written to a temporary output directory rather than read from .env
+SETTINGS = {
+    "OUTPUT_FOLDER_LOW_FREQ": "Low Frequency",
+    "OUTPUT_FOLDER_HIGH_FREQ": "High Frequency",
+    "INDEX_FILENAME": "file_index.sqlite3",
+    "EVENT_CATALOGUE_FILENAME": "event_catalogue.sqlite3",
+    "COVERAGE_FILENAME": "coverage.sqlite3",
+    "TEMP_LOW_FREQ_FILENAME": "lowfreqdata0",
+    "TEMP_HIGH_FREQ_FILENAME": "highfreqdata0",
+    "OUTPUT_LOW_FREQ_FILENAME": "lowfreqdata",
+    "OUTPUT_HIGH_FREQ_FILENAME": "highfreqdata",
+    "STORAGE_BACKEND": "csv",
+    "MAX_LOW_FREQ_DATA_ROWS": "120",
+    "MAX_NUM_OF_FILES": "1000",
+    "MAX_FILE_AGE_DAYS": "0",
+    "MAX_FOLDER_SIZE_MB": "0",
+    "COMPACT_AFTER_HOURS": "0",
+    "COMPACTION_PERIOD": "day",
+    "COMPACTION_IO_BUDGET_MB_S": "0",
+    "SCAN_RATE_MICRO_S": "20000",
+    "LOW_FREQ_INTERVAL_MICRO_S": "30000000",
+    "CONTINUITY_POLICY": "drop",
+    "HIGH_FREQ_EVENT_TIMEOUT_S": "90",
+    "INGEST_QUEUE_SIZE": "64",
+    "DURABILITY_MODE": "none",
+    "DURABILITY_BATCH_ROWS": "1000",
+    "DURABILITY_BATCH_MS": "1000",
+    "WORKERS": "1",
+    "LIVE_BUFFER_ROWS": "10000",
+    "HOTSTORE_HOURS": "0",
+    "LOW_FREQ_HEADER": '["Timestamp", "Temperature"]',
+    "HIGH_FREQ_HEADER": '["Timestamp", "Accelerometer1.X", "Accelerometer1.Y", "Accelerometer1.Z"]'
+}
+
+LOW_FREQ_HEADER = json.loads(SETTINGS["LOW_FREQ_HEADER"])
+HIGH_FREQ_HEADER = json.loads(SETTINGS["HIGH_FREQ_HEADER"])
+SCAN_RATE_US = int(SETTINGS["SCAN_RATE_MICRO_S"])
+
+START_TIME = np.datetime64('2023-12-12T00:00:00', 'us')
+
+def make_batch(
+    header: list[str],
+    steps: list[int],
+    interval_us: int = 1_000_000
+):
+    """
+    #### Make a batch of samples at the given numbers of intervals after START_TIME, in the given order,
+    with each channel of a sample holding its number of intervals
+    """
+    steps = np.asarray(steps)
+    timestamps = START_TIME + steps * np.timedelta64(interval_us, 'us')
+    channels = np.tile(steps.astype(np.float32), (len(header) - 1, 1))
+    return payload.from_columns(header, timestamps, channels)
+
+def to_steps(
+    timestamps: np.ndarray,
+    interval_us: int = 1_000_000
+):
+    """
+    #### Get the numbers of intervals after START_TIME of timestamps
+    """
+    return ((timestamps - START_TIME) // np.timedelta64(interval_us, 'us')).tolist()
+
+@pytest.fixture
+def make_client(tmp_path, monkeypatch):
+    """
+    #### Make a test client of the app writing to a temporary output directory, with the given settings changed from SETTINGS
+    """
+    monkeypatch.chdir(tmp_path)
+    from fastapi.testclient import TestClient
+    import main
+
+    def make_client(**settings):
+        for name, value in {**SETTINGS, "OUTPUT_DIR": str(tmp_path / "Logger Data"), **settings}.items():
+            monkeypatch.setenv(name, str(value))
+        main.get_settings.cache_clear()
+        return TestClient(main.app)
+
+    yield make_client
+    main.get_settings.cache_clear()
@@ -0,0 +1,137 @@
+"""
+Tests of the analysis of the high frequency events and the event catalogue.
+
+Author: Liam Eime
+Date: 12/12/2023
+"""
+
+# import libraries
+import numpy as np
+import time
+import os
+
+# .py file imports
+from conftest import HIGH_FREQ_HEADER, SCAN_RATE_US, START_TIME, make_batch
+import timestamp
+import analytics
+import payload
+import storage
+
+def make_event(
+    first: int,
+    num_rows: int,
+    amplitude: float
+):
+    """
+    #### Make an event of num_rows samples from the first scan interval, with a 5 Hz cosine of the amplitude on the X axis,
+    no acceleration on the Y axis and 1 g on the Z axis
+    """
+    steps = np.arange(first, first + num_rows)
+    timestamps = START_TIME + steps * np.timedelta64(SCAN_RATE_US, 'us')
+    channels = np.zeros((3, num_rows), dtype=np.float32)
+    channels[0] = amplitude * np.cos(2 * np.pi * 5 * steps * SCAN_RATE_US / 1e6)
+    channels[2] = 1
+    return payload.from_columns(HIGH_FREQ_HEADER, timestamps, channels)
+
+def wait_for_events(client, is_done, timeout_s: float = 10):
+    """
+    #### Get the paths of the events in the catalogue once is_done returns True for them, or after the timeout
+    """
+    deadline = time.monotonic() + timeout_s
+    while True:
+        paths = [event["path"] for event in client.get("/events").json()["events"]]
+        if is_done(paths) or time.monotonic() > deadline:
+            return paths
+        time.sleep(0.05)
+
+def test_events_deleted_by_retention_leave_the_catalogue(make_client):
+    """
+    #### An event deleted by the retention limits is no longer found in the catalogue
+    """
+    with make_client(MAX_NUM_OF_FILES="1") as client:
+        for first in (0, 1000, 2000):
+            response = client.post("/uploadHighFreqAccel/data.dat", content=make_batch(HIGH_FREQ_HEADER, np.arange(first, first + 50), SCAN_RATE_US).lines)
+            assert response.status_code == 200
+            if first == 1000:
+                first_path, = wait_for_events(client, lambda paths: len(paths) == 1)
+
+        paths = wait_for_events(client, lambda paths: first_path not in paths and len(paths) == 1)
+
+        assert not os.path.exists(first_path)
+        assert len(paths) == 1 and os.path.exists(paths[0])
+
+def test_events_merged_into_archives_leave_the_catalogue(make_client, monkeypatch):
+    """
+    #### Events merged into an archive by the compactor are no longer found in the catalogue
+    """
+    import main
+    monkeypatch.setattr(main, "COMPACTION_INTERVAL_S", 0)
+    hour_steps = 60 * 60 * 1_000_000 // SCAN_RATE_US
+    with make_client(COMPACT_AFTER_HOURS="1", COMPACTION_PERIOD="hour") as client:
+        for first in (0, 1000):
+            client.post("/uploadHighFreqAccel/data.dat", content=make_batch(HIGH_FREQ_HEADER, np.arange(first, first + 50), SCAN_RATE_US).lines)
+        first_path, = wait_for_events(client, lambda paths: len(paths) == 1)
+        for first in (3 * hour_steps, 3 * hour_steps + 1000):
+            client.post("/uploadHighFreqAccel/data.dat", content=make_batch(HIGH_FREQ_HEADER, np.arange(first, first + 50), SCAN_RATE_US).lines)
+
+        paths = wait_for_events(client, lambda paths: first_path not in paths and len(paths) == 1)
+
+        assert not os.path.exists(first_path)
+        assert len(paths) == 1 and os.path.exists(paths[0])
+        assert any(main.files.is_archive(entry["path"]) for entry in main.get_file_index().file_info(os.path.dirname(first_path)))
+
+def test_analyse_event():
+    """
+    #### The peak, RMS, crest factor and dominant frequency of each axis and the magnitude are found, leaving out missing values
+    """
+    batch = make_event(0, 500, 2)
+    batch.channels[1, 10] = np.nan
+
+    summary, channel_results = analytics.analyse_event(HIGH_FREQ_HEADER, batch.timestamps, batch.channels)
+
+    assert summary["num_rows"] == 500 and summary["duration_s"] == 499 * SCAN_RATE_US / 1e6
+    assert summary["sample_rate_hz"] == 1e6 / SCAN_RATE_US
+    x_result = channel_results["Accelerometer1.X"]
+    assert x_result["peak"] == 2
+    assert np.isclose(x_result["rms"], np.sqrt(2))
+    assert np.isclose(x_result["crest_factor"], np.sqrt(2))
+    assert np.isclose(x_result["dominant_freq_hz"], 5)
+    assert channel_results["Accelerometer1.Y"]["peak"] == 0 and channel_results["Accelerometer1.Y"]["crest_factor"] is None
+    assert np.isclose(channel_results["Accelerometer1.Magnitude"]["peak"], np.sqrt(5))
+
+def test_catalogue_query(tmp_path):
+    """
+    #### The catalogue finds the analysed events matching the filters, sorted by a result, and the event files not yet analysed
+    """
+    folder = str(tmp_path)
+    catalogue = analytics.EventCatalogue(os.path.join(folder, "event_catalogue.sqlite3"))
+    paths = []
+    for i, (first, num_rows, amplitude) in enumerate(((0, 100, 1), (1000, 300, 3), (2000, 200, 2))):
+        path = os.path.join(folder, f"highfreqdata{i}.csv")
+        storage.get_backend("csv").write_batch(path, make_event(first, num_rows, amplitude))
+        paths.append(path)
+    for path in paths[:2]:
+        catalogue.analyse_file(path)
+    assert catalogue.missing_files(folder, paths) == paths[2:]
+    catalogue.analyse_file(paths[2])
+
+    by_peak = catalogue.find_events(folder, min_peak=2, sort="peak", descending=True)
+    by_duration = catalogue.find_events(folder, channel="Accelerometer1.X", min_duration_s=3, sort="duration")
+    after_first = catalogue.find_events(folder, start_us=timestamp.to_microseconds(START_TIME + 500 * np.timedelta64(SCAN_RATE_US, 'us')), limit=1)
+
+    assert [event["path"] for event in by_peak] == [paths[1], paths[2]]
+    assert np.isclose(by_peak[0]["peak"], np.sqrt(10)) and set(by_peak[0]["channels"]) == {"Accelerometer1.X", "Accelerometer1.Y", "Accelerometer1.Z", "Accelerometer1.Magnitude"}
+    assert [event["path"] for event in by_duration] == [paths[2], paths[1]]
+    assert np.isclose(by_duration[0]["peak"], 2)
+    assert [event["path"] for event in after_first] == [paths[1]]
+    assert catalogue.missing_files(folder, paths) == []
+    catalogue.close()
+
+def test_events_of_unknown_logger_not_found(make_client):
+    """
+    #### The events of a logger id that is not valid, or of a logger without a high frequency folder, are not found
+    """
+    with make_client() as client:
+        assert client.get("/events").status_code == 200
+        assert client.get("/events", params={"logger": "missing"}).status_code == 404
+        assert client.get("/events", params={"logger": "../High Frequency"}).status_code == 404
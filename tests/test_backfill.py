@@ -0,0 +1,95 @@
+"""
+Tests of importing the table files downloaded from the logger.
+
+Author: Liam Eime
+Date: 12/12/2023
+"""
+
+# import libraries
+import numpy as np
+import os
+
+# .py file imports
+from conftest import LOW_FREQ_HEADER, HIGH_FREQ_HEADER, SCAN_RATE_US, make_batch
+import backfill
+import storage
+import writers
+import index
+
+def make_writer(folder: str, file_index: index.FileIndex):
+    """
+    #### Make a high frequency event writer of the folder
+    """
+    return writers.HighFreqEventWriter(folder, "highfreqdata", "highfreqdata0", HIGH_FREQ_HEADER, storage.get_backend("csv"), SCAN_RATE_US, 90, file_index)
+
+def test_import_bridging_closed_and_open_event(tmp_path):
+    """
+    #### Rows joining a closed event to the open event are merged with both into the running file, removing the closed event file
+    """
+    folder = str(tmp_path)
+    file_index = index.FileIndex(os.path.join(folder, "index.sqlite3"))
+    writer = make_writer(folder, file_index)
+    writer.write(make_batch(HIGH_FREQ_HEADER, np.arange(0, 100), SCAN_RATE_US))
+    closed_path, = writer.write(make_batch(HIGH_FREQ_HEADER, np.arange(200, 300), SCAN_RATE_US))
+    assert file_index.find_files(folder, None, None) == [closed_path]
+
+    importer = backfill.Importer(writer, max_gap_us=SCAN_RATE_US)
+    importer.add(make_batch(HIGH_FREQ_HEADER, np.arange(100, 200), SCAN_RATE_US))
+    importer.close()
+
+    assert importer.summary()["rows_imported"] == 100
+    assert not os.path.exists(closed_path)
+    assert file_index.find_files(folder, None, None) == []
+    assert writer.num_rows == 300
+    writer.close()
+    _, timestamps, _ = storage.get_backend("csv").read(writer.temp_path)
+    assert np.array_equal(timestamps, make_batch(HIGH_FREQ_HEADER, np.arange(0, 300), SCAN_RATE_US).timestamps)
+    file_index.close()
+
+def test_import_duplicates_into_running_file(tmp_path):
+    """
+    #### Importing rows already in the running file writes nothing
+    """
+    folder = str(tmp_path)
+    file_index = index.FileIndex(os.path.join(folder, "index.sqlite3"))
+    writer = make_writer(folder, file_index)
+    writer.write(make_batch(HIGH_FREQ_HEADER, np.arange(0, 100), SCAN_RATE_US))
+
+    importer = backfill.Importer(writer, max_gap_us=SCAN_RATE_US)
+    importer.add(make_batch(HIGH_FREQ_HEADER, np.arange(50, 100), SCAN_RATE_US))
+    importer.close()
+
+    assert importer.summary()["duplicate_rows"] == 50
+    assert importer.summary()["rows_imported"] == 0
+    assert writer.num_rows == 100
+    writer.close()
+    file_index.close()
+
+def test_import_low_frequency_into_stored_and_running_files(tmp_path):
+    """
+    #### Low frequency rows within a stored file replace it with the merged file, rows within the running file are inserted into it,
+    and rows between them are written to their own file
+    """
+    folder = str(tmp_path)
+    file_index = index.FileIndex(os.path.join(folder, "index.sqlite3"))
+    writer = writers.LowFreqWriter(folder, "lowfreqdata", "lowfreqdata0", LOW_FREQ_HEADER, storage.get_backend("csv"), 10, file_index)
+    stored_path, = writer.write(make_batch(LOW_FREQ_HEADER, np.arange(0, 20, 2)))
+    writer.write(make_batch(LOW_FREQ_HEADER, np.arange(20, 30, 2)))
+
+    importer = backfill.Importer(writer, max_rows=10)
+    importer.add(make_batch(LOW_FREQ_HEADER, np.arange(1, 29, 2)))
+    importer.close()
+
+    assert importer.summary()["rows_imported"] == 14
+    entries = file_index.file_info(folder)
+    assert [(entry["path"], entry["num_rows"]) for entry in entries][0] == (stored_path, 19)
+    assert [entry["num_rows"] for entry in entries][1:] == [1]
+    _, timestamps, _ = storage.get_backend("csv").read(stored_path)
+    assert np.array_equal(timestamps, make_batch(LOW_FREQ_HEADER, np.arange(0, 19)).timestamps)
+    _, timestamps, _ = storage.get_backend("csv").read(entries[1]["path"])
+    assert np.array_equal(timestamps, make_batch(LOW_FREQ_HEADER, [19]).timestamps)
+    assert writer.num_rows == 9
+    writer.close()
+    _, timestamps, _ = storage.get_backend("csv").read(writer.temp_path)
+    assert np.array_equal(timestamps, make_batch(LOW_FREQ_HEADER, np.arange(20, 29)).timestamps)
+    file_index.close()
@@ -0,0 +1,53 @@
+"""
+Tests of merging the old completed data files into archives.
+
+Author: Liam Eime
+Date: 12/12/2023
+"""
+
+# import libraries
+import pytest
+import os
+
+# .py file imports
+from conftest import LOW_FREQ_HEADER, make_batch, to_steps
+import compaction
+import storage
+import writers
+import index
+import files
+
+MINUTE_US = 60 * 1_000_000
+
+def test_compact_folder_merges_old_hours(tmp_path):
+    """
+    #### The files of each hour ending an hour before the newest data are merged into an indexed archive in time order, once
+    """
+    folder = str(tmp_path)
+    file_index = index.FileIndex(os.path.join(folder, "index.sqlite3"))
+    writer = writers.LowFreqWriter(folder, "lowfreqdata", "lowfreqdata0", LOW_FREQ_HEADER, storage.get_backend("csv"), 30, file_index)
+    paths = writer.write(make_batch(LOW_FREQ_HEADER, range(300), MINUTE_US))
+    writer.close()
+    compactor = compaction.Compactor(file_index, "hour", 60 * 60)
+
+    archive_paths, removed_paths = compactor.compact_folder(folder)
+
+    assert len(archive_paths) == 3 and all(files.is_archive(path) for path in archive_paths)
+    assert removed_paths == paths[:6]
+    assert not any(os.path.exists(path) for path in removed_paths)
+    assert file_index.find_files(folder) == archive_paths + paths[6:]
+    assert [entry["num_rows"] for entry in file_index.file_info(folder)] == [60, 60, 60, 30, 30, 30, 30]
+    _, timestamps, channels = storage.get_backend_for_path(archive_paths[1]).read(archive_paths[1])
+    assert to_steps(timestamps, MINUTE_US) == list(range(60, 120))
+    assert channels[0].tolist() == list(range(60, 120))
+    assert compactor.compact_folder(folder) == ([], [])
+    file_index.close()
+
+def test_unknown_compaction_period(tmp_path):
+    """
+    #### A compaction period other than hour or day is refused
+    """
+    file_index = index.FileIndex(os.path.join(tmp_path, "index.sqlite3"))
+    with pytest.raises(ValueError):
+        compaction.Compactor(file_index, "week", 60 * 60)
+    file_index.close()
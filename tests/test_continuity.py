@@ -0,0 +1,140 @@
+"""
+Tests of the continuity tracking of each stream and its coverage map.
+
+Author: Liam Eime
+Date: 12/12/2023
+"""
+
+# import libraries
+import numpy as np
+import json
+import os
+
+# .py file imports
+from conftest import LOW_FREQ_HEADER, START_TIME, make_batch, to_steps
+import continuity
+
+INTERVAL_US = 30_000_000
+
+def to_microseconds(interval: int):
+    """
+    #### Get the timestamp of the sample a number of intervals after START_TIME, in integer epoch micro-seconds
+    """
+    return int(START_TIME.astype(np.int64)) + interval * INTERVAL_US
+
+def test_duplicates_are_dropped():
+    """
+    #### Rows repeating the last sample, a recently written row or an earlier row of the batch are dropped with either policy
+    """
+    for policy in continuity.CONTINUITY_POLICIES:
+        tracker = continuity.ContinuityTracker(INTERVAL_US, policy=policy)
+        tracker.check(make_batch(LOW_FREQ_HEADER, range(5), INTERVAL_US))
+
+        written, late = tracker.check(make_batch(LOW_FREQ_HEADER, [2, 4, 5, 5, 6, 6], INTERVAL_US))
+
+        assert to_steps(written.timestamps, INTERVAL_US) == [5, 6]
+        assert late.num_rows == 0
+        assert tracker.last_us == to_microseconds(6)
+
+def test_drop_policy_drops_out_of_order_rows():
+    """
+    #### With the drop policy the rows older than the last sample or than an earlier row of the batch are dropped, keeping the order they arrived
+    """
+    tracker = continuity.ContinuityTracker(INTERVAL_US, policy="drop")
+    tracker.check(make_batch(LOW_FREQ_HEADER, range(10, 15), INTERVAL_US))
+
+    written, late = tracker.check(make_batch(LOW_FREQ_HEADER, [15, 3, 17, 16, 18], INTERVAL_US))
+
+    assert to_steps(written.timestamps, INTERVAL_US) == [15, 17, 18]
+    assert late.num_rows == 0
+    assert tracker.last_us == to_microseconds(18)
+
+def test_reorder_policy_returns_late_rows():
+    """
+    #### With the reorder policy the rows are sorted and the rows older than the last sample are returned to be merged, in time order
+    """
+    tracker = continuity.ContinuityTracker(INTERVAL_US, policy="reorder")
+    tracker.check(make_batch(LOW_FREQ_HEADER, range(10, 15), INTERVAL_US))
+
+    written, late = tracker.check(make_batch(LOW_FREQ_HEADER, [17, 3, 15, 1, 16], INTERVAL_US))
+
+    assert to_steps(written.timestamps, INTERVAL_US) == [15, 16, 17]
+    assert to_steps(late.timestamps, INTERVAL_US) == [1, 3]
+    assert late.channels[0].tolist() == [1, 3]
+    assert tracker.last_us == to_microseconds(17)
+
+def test_gaps_are_recorded_and_filled(tmp_path):
+    """
+    #### Gaps before and between the rows written are added to the coverage map, and samples stored later within a gap split or remove it
+    """
+    coverage_map = continuity.CoverageMap(os.path.join(str(tmp_path), "coverage.sqlite3"))
+    tracker = continuity.ContinuityTracker(INTERVAL_US, 3 * INTERVAL_US // 2, "drop", coverage_map, "folder")
+    tracker.check(make_batch(LOW_FREQ_HEADER, [0, 1, 2], INTERVAL_US))
+    tracker.check(make_batch(LOW_FREQ_HEADER, [6, 7, 10], INTERVAL_US))
+
+    gaps = coverage_map.find_gaps("folder")
+    assert [(gap["start_us"], gap["end_us"], gap["num_missing"]) for gap in gaps] == [
+        (to_microseconds(2), to_microseconds(6), 3),
+        (to_microseconds(7), to_microseconds(10), 2)
+    ]
+    assert continuity.coverage(gaps, to_microseconds(0), to_microseconds(10)) == 1 - 7 / 10
+
+    tracker.fill(make_batch(LOW_FREQ_HEADER, [4], INTERVAL_US).timestamps.astype(np.int64))
+    assert [(gap["start_us"], gap["end_us"]) for gap in coverage_map.find_gaps("folder")] == [
+        (to_microseconds(2), to_microseconds(4)),
+        (to_microseconds(4), to_microseconds(6)),
+        (to_microseconds(7), to_microseconds(10))
+    ]
+
+    tracker.fill(make_batch(LOW_FREQ_HEADER, [3, 5, 8, 9], INTERVAL_US).timestamps.astype(np.int64))
+    assert coverage_map.find_gaps("folder") == []
+    assert continuity.coverage([], to_microseconds(0), to_microseconds(10)) == 1
+    assert tracker.last_us == to_microseconds(10)
+    coverage_map.close()
+
+def test_shared_state_finds_retry_written_by_another_worker():
+    """
+    #### A retried upload sent to another worker is found to be duplicate rows through the shared writer state
+    """
+    first_worker = continuity.ContinuityTracker(INTERVAL_US, policy="drop")
+    second_worker = continuity.ContinuityTracker(INTERVAL_US, policy="drop")
+    written, _ = first_worker.check(make_batch(LOW_FREQ_HEADER, range(10), INTERVAL_US))
+    assert to_steps(written.timestamps, INTERVAL_US) == list(range(10))
+    second_worker.load_state(json.loads(json.dumps(first_worker.dump_state())))
+
+    written, late = second_worker.check(make_batch(LOW_FREQ_HEADER, range(5, 10), INTERVAL_US))
+
+    assert written.num_rows == 0 and late.num_rows == 0
+    assert second_worker.last_us == first_worker.last_us
+
+def test_shared_state_is_bounded():
+    """
+    #### Only the SHARED_RECENT_ROWS most recent timestamps are shared, and are added to the recent timestamps of the other worker
+    """
+    first_worker = continuity.ContinuityTracker(INTERVAL_US, policy="drop")
+    second_worker = continuity.ContinuityTracker(INTERVAL_US, policy="drop")
+    second_worker.check(make_batch(LOW_FREQ_HEADER, range(10), INTERVAL_US))
+    first_worker.load_state(second_worker.dump_state())
+    first_worker.check(make_batch(LOW_FREQ_HEADER, range(10, 10 + 2 * continuity.SHARED_RECENT_ROWS), INTERVAL_US))
+
+    state = first_worker.dump_state()
+    second_worker.load_state(json.loads(json.dumps(state)))
+
+    assert len(state["recent_us"]) == continuity.SHARED_RECENT_ROWS
+    # the worker still finds its own rows and the most recent rows of the other worker
+    written, _ = second_worker.check(make_batch(LOW_FREQ_HEADER, [5, 10 + 2 * continuity.SHARED_RECENT_ROWS - 1], INTERVAL_US))
+    assert written.num_rows == 0
+
+def test_coverage_uses_low_freq_interval_setting(make_client):
+    """
+    #### The gaps of the low frequency data are found from the LOW_FREQ_INTERVAL_MICRO_S setting
+    """
+    interval_us = 2 * INTERVAL_US
+    with make_client(LOW_FREQ_INTERVAL_MICRO_S=str(interval_us), DURABILITY_MODE="strict") as client:
+        response = client.post("/uploadLowFreq/data.dat", content=make_batch(LOW_FREQ_HEADER, [0, 1, 2, 4, 5], interval_us).lines)
+        assert response.status_code == 200
+
+        coverage = client.get("/coverage").json()
+
+    assert [(gap["start_us"], gap["end_us"], gap["num_missing"]) for gap in coverage["gaps"]] == [(to_microseconds(4), to_microseconds(8), 1)]
+    assert coverage["coverage"] == 1 - 2 / 5
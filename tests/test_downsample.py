@@ -0,0 +1,97 @@
+"""
+Tests of the downsampling pyramid.
+
+Author: Liam Eime
+Date: 12/12/2023
+"""
+
+# import libraries
+import numpy as np
+import os
+
+# .py file imports
+from conftest import LOW_FREQ_HEADER, START_TIME, make_batch
+import downsample
+
+def update(pyramid: downsample.Pyramid, seconds: np.ndarray):
+    """
+    #### Add samples at the given seconds after START_TIME to a pyramid, with the value of each sample its seconds
+    """
+    batch = make_batch(LOW_FREQ_HEADER, seconds)
+    pyramid.update(batch.timestamps, batch.channels)
+
+def read_buckets(dir: str, width_s: int, start: np.datetime64 = None, end: np.datetime64 = None):
+    """
+    #### Read the buckets of a level as seconds after START_TIME
+    """
+    _, records = downsample.read_level(dir, width_s, start, end)
+    return ((records['bucket'] * width_s * 1_000_000).astype('datetime64[us]') - START_TIME) // np.timedelta64(1, 's')
+
+def test_read_window_with_late_records(tmp_path):
+    """
+    #### Records older than the level file are kept in the late records file and merged into a window when read,
+    then merged back into the level file in bucket order when the pyramid is closed
+    """
+    dir = str(tmp_path)
+    pyramid = downsample.Pyramid(dir, LOW_FREQ_HEADER)
+    update(pyramid, np.arange(100, 200))
+    update(pyramid, np.arange(0, 100))
+    assert os.path.exists(downsample.late_path(dir, 1))
+
+    assert read_buckets(dir, 1).tolist() == list(range(199))
+    assert read_buckets(dir, 1, START_TIME + np.timedelta64(50, 's'), START_TIME + np.timedelta64(149, 's')).tolist() == list(range(50, 150))
+    pyramid.close()
+    assert not os.path.exists(downsample.late_path(dir, 1))
+    assert read_buckets(dir, 1).tolist() == list(range(200))
+    _, records = downsample.read_level(dir, 10)
+    assert records['count'][:, 0].tolist() == [10] * 20
+    assert records['max'][:, 0].tolist() == list(range(9, 200, 10))
+
+def test_late_records_merged_past_limit(tmp_path, monkeypatch):
+    """
+    #### The late records are merged back into the level file once there are more than MAX_LATE_RECORDS of them,
+    and another worker holding the removed late records file writes its late records to a new one
+    """
+    monkeypatch.setattr(downsample, "MAX_LATE_RECORDS", 20)
+    dir = str(tmp_path)
+    pyramid = downsample.Pyramid(dir, LOW_FREQ_HEADER)
+    other_worker = downsample.Pyramid(dir, LOW_FREQ_HEADER)
+    update(pyramid, np.arange(100, 200))
+    update(pyramid, np.arange(80, 90))
+    update(other_worker, np.arange(70, 75))
+    assert os.path.exists(downsample.late_path(dir, 1))
+
+    update(pyramid, np.arange(40, 50))
+
+    assert not os.path.exists(downsample.late_path(dir, 1))
+    with open(downsample.level_path(dir, 1), 'rb') as f:
+        f.readline()
+        buckets = np.frombuffer(f.read(), dtype=downsample.record_dtype(1))['bucket']
+    assert np.all(np.diff(buckets) >= 0)
+    update(other_worker, np.arange(60, 65))
+    assert os.path.exists(downsample.late_path(dir, 1))
+    assert read_buckets(dir, 1).tolist() == list(range(40, 50)) + list(range(60, 65)) + list(range(70, 74)) + list(range(80, 90)) + list(range(100, 199))
+    pyramid.close()
+    other_worker.close()
+    assert read_buckets(dir, 1).tolist() == list(range(40, 50)) + list(range(60, 65)) + list(range(70, 75)) + list(range(80, 90)) + list(range(100, 200))
+
+def test_trim_before_oldest_data(tmp_path):
+    """
+    #### Trimming removes the older buckets, merges the late records into the level file, and later writes continue the level
+    """
+    dir = str(tmp_path)
+    pyramid = downsample.Pyramid(dir, LOW_FREQ_HEADER)
+    other_worker = downsample.Pyramid(dir, LOW_FREQ_HEADER)
+    update(pyramid, np.arange(100, 200))
+    update(pyramid, np.arange(0, 100))
+    update(other_worker, np.arange(200, 210))
+
+    pyramid.trim(START_TIME + np.timedelta64(150, 's'))
+
+    assert not os.path.exists(downsample.late_path(dir, 1))
+    assert read_buckets(dir, 1).tolist() == list(range(150, 199)) + list(range(200, 209))
+    # the other worker reopens the level file replaced by the trim rather than appending to the old file
+    update(other_worker, np.arange(210, 220))
+    pyramid.close()
+    other_worker.close()
+    assert read_buckets(dir, 1).tolist() == list(range(150, 220))
@@ -0,0 +1,79 @@
+"""
+Tests of the index of the completed data files and the data query windowed by it.
+
+Author: Liam Eime
+Date: 12/12/2023
+"""
+
+# import libraries
+import numpy as np
+import os
+
+# .py file imports
+from conftest import LOW_FREQ_HEADER, START_TIME, make_batch, to_steps
+import timestamp
+import storage
+import writers
+import index
+
+def test_find_files_overlapping_window(tmp_path):
+    """
+    #### The files overlapping a time window are found in time order, with the time range and channel range of the folder
+    """
+    folder = str(tmp_path)
+    file_index = index.FileIndex(os.path.join(folder, "index.sqlite3"))
+    writer = writers.LowFreqWriter(folder, "lowfreqdata", "lowfreqdata0", LOW_FREQ_HEADER, storage.get_backend("csv"), 10, file_index)
+    paths = writer.write(make_batch(LOW_FREQ_HEADER, range(30)))
+    second = np.timedelta64(1, 's')
+
+    assert file_index.find_files(folder) == paths
+    assert file_index.find_files(folder, START_TIME + 12 * second, START_TIME + 25 * second) == paths[1:]
+    assert file_index.find_files(folder, end=START_TIME + 10 * second) == paths[:2]
+    assert file_index.find_files(folder, START_TIME + 30 * second) == []
+    assert file_index.time_range(folder) == (START_TIME, START_TIME + 29 * second)
+    assert [(entry["channel_min"], entry["channel_max"]) for entry in file_index.file_info(folder)] == [([0], [9]), ([10], [19]), ([20], [29])]
+    file_index.close()
+
+def test_sync_folder_adds_and_removes_files(tmp_path):
+    """
+    #### Syncing a folder adds the files written while it was not indexed and removes the files deleted, leaving out the running file
+    """
+    folder = str(tmp_path)
+    file_index = index.FileIndex(os.path.join(folder, "index.sqlite3"))
+    writer = writers.LowFreqWriter(folder, "lowfreqdata", "lowfreqdata0", LOW_FREQ_HEADER, storage.get_backend("csv"), 10)
+    paths = writer.write(make_batch(LOW_FREQ_HEADER, range(25)))
+    writer.close()
+
+    file_index.sync_folder(folder, exclude=(writer.temp_path,))
+    assert file_index.find_files(folder) == paths
+    os.remove(paths[0])
+    file_index.sync_folder(folder, exclude=(writer.temp_path,))
+
+    assert file_index.find_files(folder) == paths[1:]
+    assert [entry["num_rows"] for entry in file_index.file_info(folder)] == [10]
+    second = np.timedelta64(1, 's')
+    assert [(entry["start_us"], entry["end_us"]) for entry in file_index.file_info(folder)] == [
+        (timestamp.to_microseconds(START_TIME + 10 * second), timestamp.to_microseconds(START_TIME + 19 * second))
+    ]
+    file_index.close()
+
+def test_data_query_window(make_client):
+    """
+    #### The data query returns the samples of the completed files and the running file within the time window, and only the channels asked for
+    """
+    with make_client(MAX_LOW_FREQ_DATA_ROWS="10", DURABILITY_MODE="strict") as client:
+        assert client.post("/uploadLowFreq/data.dat", content=make_batch(LOW_FREQ_HEADER, range(25)).lines).status_code == 200
+
+        response = client.get("/data/low", params={"start": "2023-12-12T00:00:08", "end": "2023-12-12T00:00:21"})
+        all_response = client.get("/data/low", params={"channels": "Temperature"})
+        unknown_response = client.get("/data/low", params={"channels": "Pressure"})
+        missing_response = client.get("/data/low", params={"logger": "missing"})
+
+    lines = response.text.splitlines()
+    assert lines[0] == ",".join(LOW_FREQ_HEADER) and response.headers["X-Resolution-S"] == "0"
+    timestamps = np.array([line.split(",")[0] for line in lines[1:]], dtype='datetime64[us]')
+    assert to_steps(timestamps) == list(range(8, 22))
+    assert [float(line.split(",")[1]) for line in lines[1:]] == list(range(8, 22))
+    assert len(all_response.text.splitlines()) == 26
+    assert unknown_response.status_code == 400
+    assert missing_response.status_code == 404
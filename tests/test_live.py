@@ -0,0 +1,92 @@
+"""
+Tests of publishing the logger data to live viewers as server-sent events.
+
+Author: Liam Eime
+Date: 12/12/2023
+"""
+
+# import libraries
+import numpy as np
+import asyncio
+import json
+
+# .py file imports
+from conftest import HIGH_FREQ_HEADER, SCAN_RATE_US, make_batch, to_steps
+import live
+
+def parse_event(event: str):
+    """
+    #### Parse the json object of a server-sent event, with the timestamps as numbers of scan intervals
+    """
+    assert event.startswith("data: ") and event.endswith("\n\n")
+    data = json.loads(event[len("data: "):])
+    data["timestamps"] = to_steps(np.array(data["timestamps"], dtype='datetime64[us]'), SCAN_RATE_US)
+    return data
+
+def test_backfill_then_live_events():
+    """
+    #### A new viewer is sent the recent samples within its backfill, then each batch published, with only its channels and every decimation-th sample
+    """
+    async def run():
+        hub = live.LiveHub(100)
+        hub.publish("", "high", make_batch(HIGH_FREQ_HEADER, range(0, 10), SCAN_RATE_US))
+        subscription = live.Subscription(HIGH_FREQ_HEADER, ["Accelerometer1.Y"], decimation=2)
+        hub.subscribe("", "high", subscription, backfill_s=4 * SCAN_RATE_US / 1_000_000)
+        hub.publish("", "high", make_batch(HIGH_FREQ_HEADER, range(10, 15), SCAN_RATE_US))
+        hub.publish("logger2", "high", make_batch(HIGH_FREQ_HEADER, range(15, 20), SCAN_RATE_US))
+        events = live.iter_events(subscription)
+        sent = [await anext(events), await anext(events)]
+        await events.aclose()
+        hub.unsubscribe("", "high", subscription)
+        return sent, hub.num_subscribers()
+
+    sent, num_subscribers = asyncio.run(run())
+
+    backfill, published = [parse_event(event) for event in sent]
+    assert backfill["header"] == ["Timestamp", "Accelerometer1.Y"]
+    assert backfill["timestamps"] == [5, 7, 9]
+    assert backfill["values"] == [[5, 7, 9]]
+    assert published["timestamps"] == [11, 13]
+    assert published["values"] == [[11, 13]]
+    assert num_subscribers == 0
+
+def test_slow_viewer_drops_oldest_batches():
+    """
+    #### A viewer whose queue is full drops its oldest batch, and an idle viewer is sent keep alive comments
+    """
+    async def run():
+        hub = live.LiveHub(0)
+        subscription = live.Subscription(HIGH_FREQ_HEADER, max_queue_size=2)
+        hub.subscribe("", "high", subscription)
+        for start in range(0, 9, 3):
+            hub.publish("", "high", make_batch(HIGH_FREQ_HEADER, range(start, start + 3), SCAN_RATE_US))
+        events = live.iter_events(subscription, keep_alive_s=0.01)
+        sent = [await anext(events) for _ in range(3)]
+        await events.aclose()
+        return sent, subscription.num_dropped
+
+    sent, num_dropped = asyncio.run(run())
+
+    assert num_dropped == 1
+    assert [parse_event(event)["timestamps"] for event in sent[:2]] == [[3, 4, 5], [6, 7, 8]]
+    assert sent[2] == ": keep-alive\n\n"
+
+def test_live_data_of_unknown_logger_not_found(make_client):
+    """
+    #### Live data is not streamed for a logger id that is not valid, or for a logger without a folder for the stream
+    """
+    with make_client() as client:
+        assert client.get("/live/low", params={"logger": "missing"}).status_code == 404
+        assert client.get("/live/high", params={"logger": ".hidden"}).status_code == 404
+
+def test_non_finite_values_sent_as_null():
+    """
+    #### Missing and infinite values are sent as json null
+    """
+    batch = make_batch(HIGH_FREQ_HEADER, range(4), SCAN_RATE_US)
+    batch.channels[0] = [np.nan, np.inf, -np.inf, 1.5]
+
+    data = parse_event(live.format_event(HIGH_FREQ_HEADER, batch.timestamps, batch.channels))
+
+    assert data["values"][0] == [None, None, None, 1.5]
+    assert data["values"][1] == [0, 1, 2, 3]
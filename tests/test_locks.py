@@ -0,0 +1,97 @@
+"""
+Tests of the cross-process file locks and the state shared between workers.
+
+Author: Liam Eime
+Date: 12/12/2023
+"""
+
+# import libraries
+import asyncio
+import os
+
+# .py file imports
+from conftest import LOW_FREQ_HEADER, make_batch, to_steps
+import continuity
+import storage
+import writers
+import pipeline
+import locks
+
+def test_lock_held_by_one_holder(tmp_path):
+    """
+    #### A lock held through one lock file can not be acquired through another until it is released
+    """
+    path = os.path.join(tmp_path, "retention.lock")
+    first_worker = locks.FileLock(path)
+    second_worker = locks.FileLock(path)
+
+    assert first_worker.acquire(blocking=False)
+    assert not second_worker.acquire(blocking=False)
+    first_worker.release()
+    assert second_worker.acquire(blocking=False)
+    assert not first_worker.acquire(blocking=False)
+
+    second_worker.close()
+    first_worker.close()
+
+def test_unchanged_state_is_not_rewritten(tmp_path):
+    """
+    #### Writing the state last read or written leaves the file and its generation alone, and another worker sees a changed state
+    """
+    path = os.path.join(tmp_path, "state.json")
+    first_worker = locks.SharedState(path)
+    second_worker = locks.SharedState(path)
+
+    with first_worker.lock:
+        first_worker.write({"last_us": 1})
+        modified_ns = os.stat(path).st_mtime_ns
+        first_worker.write({"last_us": 1})
+    assert first_worker.generation == 1
+    assert os.stat(path).st_mtime_ns == modified_ns
+
+    with second_worker.lock:
+        state, is_changed = second_worker.read()
+        second_worker.write(state)
+    assert state == {"last_us": 1} and is_changed
+    assert second_worker.generation == 1
+
+    with second_worker.lock:
+        second_worker.write({"last_us": 2})
+    with first_worker.lock:
+        state, is_changed = first_worker.read()
+    assert state == {"last_us": 2} and is_changed
+    assert first_worker.generation == 2
+
+    first_worker.close()
+    second_worker.close()
+
+def test_workers_share_the_running_file(tmp_path):
+    """
+    #### Pipelines of two workers writing the same stream continue the same running file and roll it over once, dropping a retry sent to the other worker
+    """
+    folder = str(tmp_path / "Low Frequency")
+    os.makedirs(folder)
+    completed_paths = []
+
+    def create_writer(logger_id: str, stream: str):
+        tracker = continuity.ContinuityTracker(1_000_000)
+        return writers.LowFreqWriter(folder, "lowfreqdata", "lowfreqdata0", LOW_FREQ_HEADER, storage.get_backend("csv"), 10, continuity_tracker=tracker)
+
+    async def run():
+        worker_pipelines = [pipeline.PipelineRegistry(create_writer, completed_paths.extend, 4, str(tmp_path / ".workers")) for _ in range(2)]
+        first_pipeline = await worker_pipelines[0].get("", "low")
+        second_pipeline = await worker_pipelines[1].get("", "low")
+        await first_pipeline.put(make_batch(LOW_FREQ_HEADER, range(0, 5)), wait=True)
+        await second_pipeline.put(make_batch(LOW_FREQ_HEADER, range(5, 12)), wait=True)
+        await first_pipeline.put(make_batch(LOW_FREQ_HEADER, range(3, 8)), wait=True)
+        await first_pipeline.put(make_batch(LOW_FREQ_HEADER, range(12, 15)), wait=True)
+        for worker_pipeline in worker_pipelines:
+            await worker_pipeline.stop()
+
+    asyncio.run(run())
+
+    assert len(completed_paths) == 1
+    _, timestamps, _ = storage.get_backend("csv").read(completed_paths[0])
+    assert to_steps(timestamps) == list(range(10))
+    _, timestamps, _ = storage.get_backend("csv").read(os.path.join(folder, "lowfreqdata0.csv"))
+    assert to_steps(timestamps) == list(range(10, 15))
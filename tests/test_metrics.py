@@ -0,0 +1,58 @@
+"""
+Tests of the metrics served in the Prometheus text format.
+
+Author: Liam Eime
+Date: 12/12/2023
+"""
+
+# .py file imports
+from conftest import LOW_FREQ_HEADER, make_batch
+import metrics
+
+def test_render_counter_gauge_and_histogram():
+    """
+    #### Each metric is rendered with its help, type and samples, with escaped label values, cumulative buckets and collected values
+    """
+    registry = metrics.Registry()
+    counter = registry.register(metrics.Counter("test_rows_total", "Rows", ("logger",)))
+    registry.register(metrics.Gauge("test_queue_depth", "Queue depth", ("stream",), collect=lambda: {("low",): 3}))
+    histogram = registry.register(metrics.Histogram("test_seconds", "Seconds", buckets=(0.1, 1)))
+    counter.inc(2, logger='logger "1"')
+    counter.inc(logger='logger "1"')
+    for value in (0.05, 0.5, 5):
+        histogram.observe(value)
+
+    assert registry.render().splitlines() == [
+        "# HELP test_rows_total Rows",
+        "# TYPE test_rows_total counter",
+        'test_rows_total{logger="logger \\"1\\""} 3',
+        "# HELP test_queue_depth Queue depth",
+        "# TYPE test_queue_depth gauge",
+        'test_queue_depth{stream="low"} 3',
+        "# HELP test_seconds Seconds",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{le="0.1"} 1',
+        'test_seconds_bucket{le="1"} 2',
+        'test_seconds_bucket{le="+Inf"} 3',
+        "test_seconds_sum 5.55",
+        "test_seconds_count 3"
+    ]
+
+def test_metrics_endpoint_counts_uploads(make_client):
+    """
+    #### The metrics endpoint counts the rows ingested and malformed, and the latency of the ingest stages, of each upload
+    """
+    def read_sample(text: str, sample: str):
+        return next((float(line.rpartition(" ")[2]) for line in text.splitlines() if line.startswith(sample + " ")), 0)
+
+    with make_client(DURABILITY_MODE="strict") as client:
+        before = client.get("/metrics").text
+        client.post("/uploadLowFreq/metrics-logger/data.dat", content=make_batch(LOW_FREQ_HEADER, range(3)).lines + b'"not a timestamp",1\r\n')
+        response = client.get("/metrics")
+
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert read_sample(response.text, 'datalog_rows_ingested_total{logger="metrics-logger",stream="low"}') == 3
+    assert read_sample(response.text, 'datalog_malformed_rows_total{logger="metrics-logger",stream="low"}') == 1
+    parse_count = 'datalog_stage_seconds_count{stage="parse",stream="low"}'
+    assert read_sample(response.text, parse_count) == read_sample(before, parse_count) + 1
+    assert 'datalog_queue_depth{logger="metrics-logger",stream="low"} 0' in response.text
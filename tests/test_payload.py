@@ -0,0 +1,106 @@
+"""
+Tests of the parser for the HTTPPost payloads sent by the logger.
+
+Author: Liam Eime
+Date: 12/12/2023
+"""
+
+# import libraries
+import numpy as np
+
+# .py file imports
+import payload
+
+HEADER = ["Timestamp", "Temperature", "Pressure"]
+
+def row_lines(batch: payload.DataBatch):
+    """
+    #### Split the csv rows of a batch at its line offsets
+    """
+    return [batch.lines[start:end] for start, end in zip(batch.line_offsets[:-1], batch.line_offsets[1:])]
+
+def test_malformed_rows_are_dropped_and_counted():
+    """
+    #### Rows with the wrong number of fields or a field that can not be read are dropped, and blank lines are not counted
+    """
+    raw_bytes = (
+        b'"2023-12-12 00:00:00",1,2\r\n'
+        b'"2023-12-12 00:00:01",1\r\n'
+        b'"2023-12-12 00:00:02",1,2,3\r\n'
+        b'"not a timestamp",1,2\r\n'
+        b'"2023-12-12 00:00:04",one,2\r\n'
+        b'\r\n'
+        b'"2023-12-12 00:00:05",5,6\r\n'
+    )
+
+    batch = payload.parse_payload(raw_bytes, HEADER)
+
+    assert batch.num_malformed == 4
+    assert batch.timestamps.tolist() == np.array(['2023-12-12T00:00:00', '2023-12-12T00:00:05'], dtype='datetime64[us]').tolist()
+    assert batch.channels.tolist() == [[1, 5], [2, 6]]
+    assert row_lines(batch) == [b'2023-12-12 00:00:00,1,2\r\n', b'2023-12-12 00:00:05,5,6\r\n']
+
+def test_rows_without_a_timestamp_are_malformed():
+    """
+    #### Rows with an empty or NaT timestamp are dropped and counted as malformed
+    """
+    raw_bytes = (
+        b',1,2\r\n'
+        b'"NaT",1,2\r\n'
+        b'"2023-12-12 00:00:00",3,4\r\n'
+    )
+
+    batch = payload.parse_payload(raw_bytes, HEADER)
+
+    assert batch.num_malformed == 2
+    assert not np.any(np.isnat(batch.timestamps))
+    assert batch.channels.tolist() == [[3], [4]]
+    assert row_lines(batch) == [b'2023-12-12 00:00:00,3,4\r\n']
+
+    batch = payload.parse_payload(b'"NaT",1,2\r\n', HEADER)
+
+    assert batch.num_rows == 0 and batch.num_malformed == 1
+
+def test_empty_fields_are_nan():
+    """
+    #### Empty fields at the start, middle and end of the channels are read as NaN and kept empty in the csv rows
+    """
+    raw_bytes = (
+        b'"2023-12-12 00:00:00",,2\r\n'
+        b'"2023-12-12 00:00:01",1,\r\n'
+        b'"2023-12-12 00:00:02",,\r\n'
+    )
+
+    batch = payload.parse_payload(raw_bytes, HEADER)
+
+    assert batch.num_rows == 3 and batch.num_malformed == 0
+    assert np.isnan(batch.channels).tolist() == [[True, False, True], [False, True, True]]
+    assert batch.channels[1, 0] == 2 and batch.channels[0, 1] == 1
+    assert row_lines(batch)[2] == b'2023-12-12 00:00:02,,\r\n'
+
+def test_crlf_and_lf_rows_parse_the_same():
+    """
+    #### Rows ending with \\n alone, or with no line ending on the last row, parse the same as rows ending with \\r\\n
+    """
+    crlf_batch = payload.parse_payload(b'"2023-12-12 00:00:00",1,2\r\n"2023-12-12 00:00:01",3,4\r\n', HEADER)
+    lf_batch = payload.parse_payload(b'"2023-12-12 00:00:00",1,2\n"2023-12-12 00:00:01",3,4', HEADER)
+
+    for batch in (crlf_batch, lf_batch):
+        assert batch.num_rows == 2 and batch.num_malformed == 0
+        assert batch.lines == b'2023-12-12 00:00:00,1,2\r\n2023-12-12 00:00:01,3,4\r\n'
+        assert batch.line_offsets.tolist() == [0, 25, 50]
+    assert crlf_batch.timestamps.tolist() == lf_batch.timestamps.tolist()
+    assert crlf_batch.channels.tolist() == lf_batch.channels.tolist()
+
+def test_empty_and_all_malformed_payloads():
+    """
+    #### An empty payload and a payload of only malformed rows give an empty batch with the header's channels
+    """
+    empty_batch = payload.parse_payload(b'', HEADER)
+    malformed_batch = payload.parse_payload(b'"2023-12-12 00:00:00",one,two\r\n', HEADER)
+
+    assert empty_batch.num_rows == 0 and empty_batch.num_malformed == 0
+    assert malformed_batch.num_rows == 0 and malformed_batch.num_malformed == 1
+    for batch in (empty_batch, malformed_batch):
+        assert batch.channels.shape == (2, 0)
+        assert batch.lines == b''
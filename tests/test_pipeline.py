@@ -0,0 +1,90 @@
+"""
+Tests of the ingestion pipeline queueing each stream's batches for its writer thread.
+
+Author: Liam Eime
+Date: 12/12/2023
+"""
+
+# import libraries
+import threading
+import asyncio
+
+# .py file imports
+from conftest import LOW_FREQ_HEADER, make_batch, to_steps
+import storage
+import writers
+import pipeline
+
+def create_pipeline(
+    folder: str,
+    completed_paths: list[str],
+    max_queue_size: int
+):
+    """
+    #### Create a low frequency pipeline, adding the paths to the files it completes to a list, must be called within the running event loop
+    """
+    writer = writers.LowFreqWriter(folder, "lowfreqdata", "lowfreqdata0", LOW_FREQ_HEADER, storage.get_backend("csv"), 10)
+    stream_pipeline = pipeline.StreamPipeline("low frequency", writer, completed_paths.extend, max_queue_size)
+    stream_pipeline.start()
+    return stream_pipeline
+
+def test_full_queue_holds_back_puts(tmp_path):
+    """
+    #### Putting a batch waits while the queue is full, and every queued batch is written in order before the pipeline stops
+    """
+    async def run():
+        completed_paths = []
+        stream_pipeline = create_pipeline(str(tmp_path), completed_paths, 1)
+        is_released = threading.Event()
+        # hold up the writer thread, so the first batch is taken off the queue and the second fills it
+        blocked = asyncio.ensure_future(stream_pipeline.run_in_writer(is_released.wait))
+        await asyncio.sleep(0.05)
+        await stream_pipeline.put(make_batch(LOW_FREQ_HEADER, range(0, 5)))
+        await asyncio.sleep(0.05)
+        await stream_pipeline.put(make_batch(LOW_FREQ_HEADER, range(5, 10)))
+
+        held_put = asyncio.ensure_future(stream_pipeline.put(make_batch(LOW_FREQ_HEADER, range(10, 15))))
+        await asyncio.sleep(0.1)
+        is_held = not held_put.done() and stream_pipeline.queue.full()
+        is_released.set()
+        await asyncio.wait_for(held_put, 5)
+        await blocked
+        await stream_pipeline.stop()
+        return is_held, completed_paths, stream_pipeline.writer
+
+    is_held, completed_paths, writer = asyncio.run(run())
+
+    assert is_held
+    assert len(completed_paths) == 1
+    _, timestamps, _ = storage.get_backend("csv").read(completed_paths[0])
+    assert to_steps(timestamps) == list(range(10))
+    _, timestamps, _ = storage.get_backend("csv").read(writer.temp_path)
+    assert to_steps(timestamps) == list(range(10, 15))
+
+def test_failed_write_raised_to_waiting_put(tmp_path):
+    """
+    #### A batch that fails to write raises its error to a put waiting for it, and later batches are still written
+    """
+    async def run():
+        stream_pipeline = create_pipeline(str(tmp_path), [], 4)
+        write = stream_pipeline.writer.write
+
+        def fail_first_write(batch):
+            stream_pipeline.writer.write = write
+            raise OSError("No space left on device")
+
+        stream_pipeline.writer.write = fail_first_write
+        try:  # try write a batch while the disk is full
+            await stream_pipeline.put(make_batch(LOW_FREQ_HEADER, range(3)), wait=True)
+            error = None
+        except OSError as e:
+            error = e
+        await stream_pipeline.put(make_batch(LOW_FREQ_HEADER, range(3, 6)), wait=True)
+        await stream_pipeline.stop()
+        return error, stream_pipeline.writer
+
+    error, writer = asyncio.run(run())
+
+    assert str(error) == "No space left on device"
+    _, timestamps, _ = storage.get_backend("csv").read(writer.temp_path)
+    assert to_steps(timestamps) == list(range(3, 6))
@@ -0,0 +1,66 @@
+"""
+Tests of the incremental reading of the running files and the sliding window of the live plots.
+
+Author: Liam Eime
+Date: 12/12/2023
+"""
+
+# import libraries
+import numpy as np
+import pytest
+import os
+import sys
+
+# .py file imports
+from conftest import LOW_FREQ_HEADER, make_batch, to_steps, parent
+sys.path.append(os.path.join(parent, "Plotting"))
+import plotting
+import storage
+import writers
+
+@pytest.mark.parametrize("backend_name", ["csv", "npz"])
+def test_tail_reads_new_rows_across_roll_over(tmp_path, backend_name):
+    """
+    #### Each read returns only the complete rows appended since the previous read, reading the rest of a completed file before the new running file
+    """
+    folder = str(tmp_path)
+    writer = writers.LowFreqWriter(folder, "lowfreqdata", "lowfreqdata0", LOW_FREQ_HEADER, storage.get_backend(backend_name), 10)
+    tail = plotting.FileTail(writer.temp_path)
+    assert tail.read_new_rows() is None
+
+    writer.write(make_batch(LOW_FREQ_HEADER, range(0, 4)))
+    assert to_steps(tail.read_new_rows().timestamps) == [0, 1, 2, 3]
+    assert tail.read_new_rows() is None
+    writer.write(make_batch(LOW_FREQ_HEADER, range(4, 13)))
+    batch = tail.read_new_rows()
+
+    assert to_steps(batch.timestamps) == list(range(4, 13))
+    assert batch.channels[0].tolist() == list(range(4, 13))
+    writer.close()
+
+def test_tail_skips_partly_written_row(tmp_path):
+    """
+    #### A row still being written is left until it is complete
+    """
+    path = os.path.join(tmp_path, "lowfreqdata0.csv")
+    with open(path, 'wb') as f:
+        f.write(b'Timestamp,Temperature\r\n2023-12-12 00:00:00,0\r\n2023-12-12 00:00:01,')
+    tail = plotting.FileTail(path)
+
+    assert to_steps(tail.read_new_rows().timestamps) == [0]
+    with open(path, 'ab') as f:
+        f.write(b'1\r\n')
+    assert to_steps(tail.read_new_rows().timestamps) == [1]
+
+def test_sliding_window_keeps_most_recent_samples():
+    """
+    #### The window holds the most recent samples in order as they are appended, across moving them to the front of its arrays
+    """
+    window = plotting.SlidingWindow(1, 5)
+    for start in range(0, 20, 3):
+        times = np.arange(start, start + 3, dtype=np.float64)
+        window.append(times, times[np.newaxis].astype(np.float32))
+
+    times, values = window.view()
+    assert times.tolist() == [16, 17, 18, 19, 20]
+    assert values.tolist() == [[16, 17, 18, 19, 20]]
@@ -0,0 +1,92 @@
+"""
+Tests of the retention limits of the output folders.
+
+Author: Liam Eime
+Date: 12/12/2023
+"""
+
+# import libraries
+import numpy as np
+import time
+import os
+
+# .py file imports
+import retention
+import hotstore
+
+HEADER = ["Timestamp", "Channel1", "Channel2"]
+
+def write_file(
+    folder: str,
+    filename: str,
+    modified_time: float,
+    size: int = 100
+):
+    """
+    #### Write a file of a given size, last written at a given time
+    """
+    path = os.path.join(folder, filename)
+    with open(path, "wb") as f:
+        f.write(b"0" * size)
+    os.utime(path, (modified_time, modified_time))
+    return path
+
+def test_enforce_keeps_hotstore(tmp_path):
+    """
+    #### The ring buffer and its lock are not counted or deleted as data files while the writer has them open
+    """
+    folder = str(tmp_path)
+    ring_writer = hotstore.RingWriter(folder, HEADER, 16)
+    for i in range(5):
+        path = os.path.join(folder, f"data{i}.csv")
+        with open(path, "w") as f:
+            f.write("Timestamp,Channel1,Channel2\n")
+        os.utime(path, (1000 + i, 1000 + i))
+    retention_manager = retention.RetentionManager(3)
+    retention_manager.add_folder(folder)
+    assert retention_manager.num_files(folder) == 5
+
+    deleted_paths = retention_manager.enforce()
+
+    assert sorted(os.path.basename(path) for path in deleted_paths) == ["data0.csv", "data1.csv"]
+    assert os.path.exists(hotstore.hotstore_path(folder))
+    assert os.path.exists(hotstore.hotstore_path(folder) + ".lock")
+    timestamps = np.array(['2023-12-12T00:00:00', '2023-12-12T00:00:01'], dtype='datetime64[us]')
+    ring_writer.append(timestamps, np.zeros((2, 2), dtype=np.float32))
+    ring_writer.close()
+
+def test_enforce_size_and_age_limits(tmp_path):
+    """
+    #### The oldest files are deleted while a folder is over its size limit or older than its age limit, never deleting the excluded files
+    """
+    folder = str(tmp_path)
+    now = time.time()
+    paths = [write_file(folder, f"data{i}.csv", now - 1000 + i * 100) for i in range(6)]
+    write_file(folder, "lowfreqdata0.csv", now - 2000)
+    size_manager = retention.RetentionManager(0, max_total_bytes=450, exclude_filenames=("lowfreqdata0.csv",))
+    size_manager.add_folder(folder)
+
+    assert size_manager.enforce() == paths[:2]
+    assert size_manager.num_files(folder) == 4
+    age_manager = retention.RetentionManager(0, max_age_s=750, exclude_filenames=("lowfreqdata0.csv",))
+    age_manager.add_folder(folder)
+    assert age_manager.enforce() == [paths[2]]
+    assert sorted(os.listdir(folder)) == ["data3.csv", "data4.csv", "data5.csv", "lowfreqdata0.csv"]
+
+def test_files_added_and_removed_from_view(tmp_path):
+    """
+    #### Files added with an older time than the newest file, such as archives, are deleted in time order, and files removed by the compactor are not counted
+    """
+    folder = str(tmp_path)
+    paths = [write_file(folder, f"data{i}.csv", 1000 + i * 100) for i in range(3)]
+    retention_manager = retention.RetentionManager(3)
+    retention_manager.add_folder(folder)
+    archive_path = write_file(folder, "archive.csv", 1050)
+    retention_manager.add_file(archive_path)
+    retention_manager.add_file(write_file(folder, "data3.csv", 1300))
+
+    assert retention_manager.num_files(folder) == 5
+    retention_manager.remove_files(paths[:1])
+    os.remove(paths[0])
+    assert retention_manager.num_files(folder) == 4
+    assert retention_manager.enforce() == [archive_path]
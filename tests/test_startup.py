@@ -0,0 +1,32 @@
+"""
+Tests of the modules loaded by starting a worker.
+
+Author: Liam Eime
+Date: 12/12/2023
+"""
+
+# import libraries
+import subprocess
+import json
+import sys
+import os
+
+# .py file imports
+from conftest import parent
+
+# modules only imported by the features that use them
+OPTIONAL_MODULES = ["analytics", "compaction", "backfill", "hotstore", "live"]
+
+def test_startup_skips_optional_modules(make_client, tmp_path):
+    """
+    #### Starting a worker on an empty output directory, with compaction and the hot store turned off, imports none of the optional modules
+    """
+    make_client(COMPACT_AFTER_HOURS="0", HOTSTORE_HOURS="0")
+    code = (
+        f"import sys, json; sys.path.append({parent!r}); from fastapi.testclient import TestClient; import main\n"
+        "with TestClient(main.app): pass\n"
+        f"print(json.dumps([name for name in {OPTIONAL_MODULES!r} if name in sys.modules]))"
+    )
+    completed = subprocess.run([sys.executable, "-c", code], cwd=tmp_path, env=os.environ.copy(), capture_output=True, text=True, check=True)
+
+    assert json.loads(completed.stdout.strip().splitlines()[-1]) == []
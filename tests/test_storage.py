@@ -0,0 +1,57 @@
+"""
+Tests of the storage backends the data files are written with.
+
+Author: Liam Eime
+Date: 12/12/2023
+"""
+
+# import libraries
+import numpy as np
+import os
+
+# .py file imports
+from conftest import HIGH_FREQ_HEADER, SCAN_RATE_US, make_batch
+import storage
+
+def test_npz_round_trip(tmp_path):
+    """
+    #### A batch written to an .npz archive reads back with the same timestamps and channels, including NaN and irregular timestamps
+    """
+    backend = storage.get_backend("npz")
+    path = os.path.join(tmp_path, "event.npz")
+    batch = make_batch(HIGH_FREQ_HEADER, [0, 1, 2, 5, 1000], SCAN_RATE_US)
+    batch.channels[0, 1] = np.nan
+    batch.channels[1] = [-1.5, 3.25e-7, 1e30, 0, -0.0]
+
+    backend.write_batch(path, batch)
+    header, timestamps, channels = backend.read(path)
+
+    assert header == HIGH_FREQ_HEADER
+    assert np.array_equal(timestamps, batch.timestamps)
+    assert channels.dtype == np.float32
+    assert np.array_equal(channels, batch.channels, equal_nan=True)
+    assert backend.read_info(path) == (5, batch.timestamps[0], batch.timestamps[-1])
+
+def test_npz_running_file_repaired_and_finalized(tmp_path):
+    """
+    #### A partly written record is removed from the running file, which is then compressed to an archive and can be reopened
+    """
+    backend = storage.get_backend("npz")
+    temp_path = os.path.join(tmp_path, "highfreqdata0" + backend.temp_extension)
+    path = os.path.join(tmp_path, "event.npz")
+    with backend.open(temp_path, HIGH_FREQ_HEADER) as f:
+        backend.append(f, make_batch(HIGH_FREQ_HEADER, range(3), SCAN_RATE_US))
+        backend.append(f, make_batch(HIGH_FREQ_HEADER, range(3, 6), SCAN_RATE_US))
+        f.write(b'\x00' * 5)
+
+    backend.repair(temp_path)
+    assert backend.read_info(temp_path)[0] == 6
+    backend.finalize(temp_path, path)
+
+    assert not os.path.exists(temp_path)
+    _, timestamps, channels = backend.read(path)
+    assert np.array_equal(timestamps, make_batch(HIGH_FREQ_HEADER, range(6), SCAN_RATE_US).timestamps)
+    assert channels[2].tolist() == list(range(6))
+    backend.reopen(path, temp_path)
+    assert not os.path.exists(path)
+    assert np.array_equal(backend.read_batch(temp_path).channels, channels)
@@ -0,0 +1,62 @@
+"""
+Tests of getting and formatting the timestamps the data files are named with.
+
+Author: Liam Eime
+Date: 12/12/2023
+"""
+
+# import libraries
+import numpy as np
+import os
+
+# .py file imports
+import timestamp
+import storage
+
+def test_format_microseconds():
+    """
+    #### Timestamps are formatted for file names the same as the logger's timestamps, without the trailing zeros of the fractional seconds
+    """
+    for value, expected in (
+        ('1970-01-01T00:00:00', "1970.01.01_00.00.00"),
+        ('2023-12-12T09:05:03.250000', "2023.12.12_09.05.03.25"),
+        ('2024-02-29T23:59:59.000001', "2024.02.29_23.59.59.000001")
+    ):
+        microseconds = timestamp.to_microseconds(np.datetime64(value))
+        assert timestamp.format_microseconds(microseconds) == expected
+
+def test_lines_reversed_across_blocks(tmp_path):
+    """
+    #### Lines are read back from the end the same whether or not they cross the blocks read
+    """
+    path = os.path.join(tmp_path, "data.csv")
+    lines = [f"line {i}".encode() * (i % 4 + 1) for i in range(50)]
+    with open(path, 'wb') as f:
+        f.write(b'\n'.join(lines) + b'\n')
+
+    for block_size in (1, 7, 65536):
+        assert list(timestamp.iter_lines_reversed(path, block_size)) == [b''] + lines[::-1]
+
+def test_initial_and_final_timestamps(tmp_path):
+    """
+    #### The initial and final timestamps are read from a file from another program, skipping empty trailing rows
+    """
+    path = os.path.join(tmp_path, "data.csv")
+    with open(path, 'w', newline='') as f:
+        f.write('"Timestamp","Temperature"\r\n"2023-12-12 00:00:00",1\r\n"2023-12-12 00:00:30",2\r\n"2023-12-12 00:01:00.5",3\r\n,\r\n\r\n')
+
+    assert timestamp.get_initial_datetime64(path) == np.datetime64('2023-12-12T00:00:00', 'us')
+    assert timestamp.get_final_datetime64(path) == np.datetime64('2023-12-12T00:01:00.500000', 'us')
+
+def test_file_without_rows_has_no_timestamps(tmp_path):
+    """
+    #### An empty file, a header-only file and a file of only empty rows have no initial or final timestamp, and no rows
+    """
+    for i, text in enumerate(('', '"Timestamp","Temperature"', '"Timestamp","Temperature"\r\n', '"Timestamp","Temperature"\r\n,\r\n\r\n')):
+        path = os.path.join(tmp_path, f"data{i}.csv")
+        with open(path, 'w', newline='') as f:
+            f.write(text)
+
+        assert timestamp.get_initial_datetime64(path) is None
+        assert timestamp.get_final_datetime64(path) is None
+        assert storage.get_backend("csv").read_info(path) == (0, None, None)
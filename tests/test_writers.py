@@ -0,0 +1,172 @@
+"""
+Tests of writing the logger data to file.
+
+Author: Liam Eime
+Date: 12/12/2023
+"""
+
+# import libraries
+import numpy as np
+import pytest
+import os
+
+# .py file imports
+from conftest import LOW_FREQ_HEADER, HIGH_FREQ_HEADER, SCAN_RATE_US, START_TIME, make_batch
+import timestamp
+import storage
+import writers
+import index
+
+def test_write_late_splits_at_max_rows(tmp_path):
+    """
+    #### Late samples merged into the running file leave completed files of max_rows samples
+    """
+    folder = str(tmp_path)
+    file_index = index.FileIndex(os.path.join(folder, "index.sqlite3"))
+    writer = writers.LowFreqWriter(folder, "lowfreqdata", "lowfreqdata0", LOW_FREQ_HEADER, storage.get_backend("csv"), 10, file_index)
+    assert len(writer.write(make_batch(LOW_FREQ_HEADER, np.arange(20, 40, 2)))) == 1
+    writer.write(make_batch(LOW_FREQ_HEADER, [40, 42, 44, 46, 48, 50, 52, 54]))
+    assert writer.num_rows == 8
+
+    paths, inserted = writer.write_late(make_batch(LOW_FREQ_HEADER, [41, 43, 45, 47, 49, 51, 53]))
+
+    assert inserted.num_rows == 7
+    assert len(paths) == 1
+    entries = file_index.file_info(folder)
+    assert [entry["num_rows"] for entry in entries] == [10, 10]
+    _, timestamps, _ = storage.get_backend("csv").read(paths[0])
+    assert np.array_equal(timestamps, make_batch(LOW_FREQ_HEADER, np.arange(40, 50)).timestamps)
+    assert writer.num_rows == 5
+    writer.close()
+    _, timestamps, _ = storage.get_backend("csv").read(writer.temp_path)
+    assert np.array_equal(timestamps, make_batch(LOW_FREQ_HEADER, [50, 51, 52, 53, 54]).timestamps)
+    file_index.close()
+
+def test_low_freq_rolls_over_at_max_rows(tmp_path):
+    """
+    #### Samples are split into indexed files of max_rows samples, leaving the rest in the running file
+    """
+    folder = str(tmp_path)
+    file_index = index.FileIndex(os.path.join(folder, "index.sqlite3"))
+    writer = writers.LowFreqWriter(folder, "lowfreqdata", "lowfreqdata0", LOW_FREQ_HEADER, storage.get_backend("csv"), 10, file_index)
+
+    paths = writer.write(make_batch(LOW_FREQ_HEADER, range(25)))
+
+    assert len(paths) == 2 and writer.num_rows == 5
+    assert [entry["num_rows"] for entry in file_index.file_info(folder)] == [10, 10]
+    _, timestamps, channels = storage.get_backend("csv").read(paths[1])
+    assert np.array_equal(timestamps, make_batch(LOW_FREQ_HEADER, range(10, 20)).timestamps)
+    assert channels[0].tolist() == list(range(10, 20))
+    writer.close()
+    file_index.close()
+
+def test_running_file_recovered_after_crash(tmp_path):
+    """
+    #### A running file left with a partly written row by a crash is repaired and continued, rolling over with the samples written before the crash
+    """
+    folder = str(tmp_path)
+    file_index = index.FileIndex(os.path.join(folder, "index.sqlite3"))
+    writer = writers.LowFreqWriter(folder, "lowfreqdata", "lowfreqdata0", LOW_FREQ_HEADER, storage.get_backend("csv"), 10, file_index)
+    writer.write(make_batch(LOW_FREQ_HEADER, range(6)))
+    # the process dies part way through writing a row, without closing the running file
+    with open(writer.temp_path, 'ab') as f:
+        f.write(b'2023-12-12 00:00:06,')
+
+    recovered_writer = writers.LowFreqWriter(folder, "lowfreqdata", "lowfreqdata0", LOW_FREQ_HEADER, storage.get_backend("csv"), 10, file_index)
+
+    assert recovered_writer.num_rows == 6
+    assert recovered_writer.initial_us == writer.initial_us and recovered_writer.final_us == writer.final_us
+    paths = recovered_writer.write(make_batch(LOW_FREQ_HEADER, range(6, 12)))
+    assert len(paths) == 1 and recovered_writer.num_rows == 2
+    _, timestamps, _ = storage.get_backend("csv").read(paths[0])
+    assert np.array_equal(timestamps, make_batch(LOW_FREQ_HEADER, range(10)).timestamps)
+    recovered_writer.close()
+    file_index.close()
+
+def test_newest_file_continued_when_not_full(tmp_path):
+    """
+    #### With no running file, the newest completed file is continued if it holds fewer than max_rows samples
+    """
+    folder = str(tmp_path)
+    writer = writers.LowFreqWriter(folder, "lowfreqdata", "lowfreqdata0", LOW_FREQ_HEADER, storage.get_backend("csv"), 10)
+    writer.write(make_batch(LOW_FREQ_HEADER, range(4)))
+    path = writer.roll_over()
+
+    recovered_writer = writers.LowFreqWriter(folder, "lowfreqdata", "lowfreqdata0", LOW_FREQ_HEADER, storage.get_backend("csv"), 10)
+
+    assert not os.path.exists(path)
+    assert recovered_writer.num_rows == 4
+    assert recovered_writer.initial_us == timestamp.to_microseconds(START_TIME)
+    recovered_writer.close()
+
+def test_bursts_stitched_into_events(tmp_path):
+    """
+    #### Bursts within the scan rate of the open event are appended to it, and a burst after a gap closes it and starts a new event
+    """
+    folder = str(tmp_path)
+    writer = writers.HighFreqEventWriter(folder, "highfreqdata", "highfreqdata0", HIGH_FREQ_HEADER, storage.get_backend("csv"), SCAN_RATE_US, 60)
+
+    assert writer.write(make_batch(HIGH_FREQ_HEADER, range(0, 5), SCAN_RATE_US)) == []
+    assert writer.write(make_batch(HIGH_FREQ_HEADER, range(5, 10), SCAN_RATE_US)) == []
+    paths = writer.write(make_batch(HIGH_FREQ_HEADER, range(12, 15), SCAN_RATE_US))
+
+    assert len(paths) == 1 and writer.num_rows == 3
+    _, timestamps, _ = storage.get_backend("csv").read(paths[0])
+    assert np.array_equal(timestamps, make_batch(HIGH_FREQ_HEADER, range(10), SCAN_RATE_US).timestamps)
+    writer.close()
+
+def test_idle_event_closed_after_timeout(tmp_path):
+    """
+    #### The open event is only closed once no burst has been written for the timeout, and is continued after a restart until then
+    """
+    folder = str(tmp_path)
+    writer = writers.HighFreqEventWriter(folder, "highfreqdata", "highfreqdata0", HIGH_FREQ_HEADER, storage.get_backend("csv"), SCAN_RATE_US, 60)
+    writer.write(make_batch(HIGH_FREQ_HEADER, range(5), SCAN_RATE_US))
+
+    assert writer.close_if_idle() is None
+    writer.close()
+    recovered_writer = writers.HighFreqEventWriter(folder, "highfreqdata", "highfreqdata0", HIGH_FREQ_HEADER, storage.get_backend("csv"), SCAN_RATE_US, 60)
+    assert recovered_writer.num_rows == 5
+    recovered_writer.last_write_time -= 60
+    path = recovered_writer.close_if_idle()
+
+    assert path is not None and not os.path.exists(recovered_writer.temp_path)
+    _, timestamps, _ = storage.get_backend("csv").read(path)
+    assert len(timestamps) == 5
+    assert recovered_writer.close_if_idle() is None
+
+def test_durability_modes(tmp_path, monkeypatch):
+    """
+    #### Strict durability fsyncs each batch, batch durability holds rows until batch_rows or batch_ms is reached, and none never fsyncs
+    """
+    fsynced = []
+    monkeypatch.setattr(writers.os, "fsync", fsynced.append)
+    backend = storage.get_backend("csv")
+    num_fsyncs = {}
+    for durability in writers.DURABILITY_MODES:
+        folder = os.path.join(tmp_path, durability)
+        os.makedirs(folder)
+        writer = writers.LowFreqWriter(folder, "lowfreqdata", "lowfreqdata0", LOW_FREQ_HEADER, backend, 100, durability=durability, batch_rows=5, batch_ms=60_000)
+        fsynced.clear()
+        writer.write(make_batch(LOW_FREQ_HEADER, range(0, 3)))
+        if durability == "batch":
+            assert writer.num_pending_rows == 3 and fsynced == []
+            writer.flush()
+            assert backend.read_info(writer.temp_path)[0] == 3 and fsynced == []
+            writer.sync_if_due()
+            assert fsynced == []
+            writer._pending_since -= 60
+            writer.sync_if_due()
+            assert writer.num_pending_rows == 0 and len(fsynced) == 1
+        writer.write(make_batch(LOW_FREQ_HEADER, range(3, 9)))
+        num_fsyncs[durability] = len(fsynced)
+        writer.close()
+
+    assert num_fsyncs == {"none": 0, "batch": 2, "strict": 2}
+
+def test_unknown_durability_mode(tmp_path):
+    """
+    #### A durability mode other than DURABILITY_MODES is refused
+    """
+    with pytest.raises(ValueError):
+        writers.LowFreqWriter(str(tmp_path), "lowfreqdata", "lowfreqdata0", LOW_FREQ_HEADER, storage.get_backend("csv"), 10, durability="always")
@@ -2,73 +2,132 @@
 Functions for getting and formatting timestamps, for use for creating and naming the .csv data files.
 For use with the Python web application for CR1000 data logging.
 
+The writers keep the initial and final timestamps of their running files as integer epoch micro-seconds, taken from the parsed batches,
+and name the files from those integers, so the server never reads back its own output to name it.
+The file reading functions are for files from a previous run or another program.
+
 Author: Liam Eime
 Date: 12/12/2023
 """
 
 # Python imports
+from datetime import date
+import numpy as np
 import os
 
-def format_timestamp(entry: list[str]):
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+def to_microseconds(value: np.datetime64):
+    """
+    #### Convert a timestamp to integer epoch micro-seconds
+
+    ##### Parameters:
+    - value: np.datetime64
+        - timestamp to convert
+
+    ##### Returns:
+    - microseconds: int
+        - micro-seconds since the epoch
+    """
+    return int(np.datetime64(value, 'us').astype(np.int64))
+
+def format_microseconds(microseconds: int):
     """
-    #### Format timestamp string for desired appearance in file
+    #### Format an integer epoch micro-seconds timestamp for desired appearance in file
+
+    Formatted the same as the timestamps written by the logger with ':' and '-' replaced by '.' and ' ' by '_',
+    with trailing zeros of the fractional seconds removed, using integer arithmetic only.
 
     ##### Parameters:
-    - entry: list[str]
-        - entry from csv file containing timestamp information
+    - microseconds: int
+        - micro-seconds since the epoch
 
     ##### Returns:
     - formatted_timestamp: str
-        - timestamp from entry formatted for file name
+        - timestamp formatted for file name
     """
-    formatted_timestamp = entry[0].replace(':', '.').replace("-", ".").replace(" ", "_")
+    seconds, fraction = divmod(microseconds, 1_000_000)
+    days, seconds = divmod(seconds, 24 * 60 * 60)
+    hours, seconds = divmod(seconds, 60 * 60)
+    minutes, seconds = divmod(seconds, 60)
+    day = date.fromordinal(EPOCH_ORDINAL + days)
+    formatted_timestamp = f"{day.year:04d}.{day.month:02d}.{day.day:02d}_{hours:02d}.{minutes:02d}.{seconds:02d}"
+    if fraction:
+        formatted_timestamp += "." + f"{fraction:06d}".rstrip("0")
     return formatted_timestamp
 
-def get_initial_timestamp(file_path: str):
+def iter_lines_reversed(
+    file_path: str,
+    block_size: int = 65536
+):
     """
-    #### Get the initial timestamp from file
+    #### Read the lines of a file from the last line to the first, one block at a time from the end
+
+    ##### Parameters:
+    - file_path: str
+        - string containing the path to the file to read
+    - block_size: int = 65536
+        - number of bytes read at a time
+
+    ##### Yields:
+    - line: bytes
+        - each line without its \\n, starting with an empty line if the file ends with \\n
+    """
+    with open(file_path, 'rb') as f:
+        position = f.seek(0, os.SEEK_END)
+        remainder = b''
+        while position > 0:
+            read_size = min(block_size, position)
+            position -= read_size
+            f.seek(position)
+            lines = (f.read(read_size) + remainder).split(b'\n')
+            remainder = lines[0]
+            yield from reversed(lines[1:])
+        yield remainder
+
+def get_initial_datetime64(file_path: str):
+    """
+    #### Get the initial timestamp from file as a datetime64
+
+    Skips any empty rows after the header.
 
     ##### Parameters:
     - file_path: str
         - string containing the path to the file from which to get the initial timestamp from
 
     ##### Returns:
-    - initial_timestamp: str
-        - formatted initial timestamp
+    - initial_timestamp: np.datetime64
+        - initial timestamp, None if the file has no rows after the header
     """
     with open(file_path, 'r') as f:
         f.readline()  # skip over the header
-        first_entry = f.readline().strip("\r\n").split(",")
-    initial_timestamp = format_timestamp(first_entry)
+        first_row = next((line for line in f if line.strip("\r\n,")), None)
+    if first_row is None:
+        return None
+    first_entry = first_row.strip("\r\n").replace('"', '').split(",")
+    initial_timestamp = np.datetime64(first_entry[0], 'us')
     return initial_timestamp
 
-def get_final_timestamp(
-    file_path: str, 
-    row_pos: int
-):
+def get_final_datetime64(file_path: str):
     """
-    #### Get the final timestamp from file
+    #### Get the final timestamp from file as a datetime64
+
+    Reads the file back from the end one block at a time, rather than seeking back one byte at a time, skipping any empty trailing rows and stopping at the header.
+    Only used for files this process did not write, as the writers keep the final timestamp of their running files.
 
     ##### Parameters:
     - file_path: str
         - string containing the path to the file from which to get the final timestamp from
-    - row_pos: int
-        - integer value indicating which row from last in file to get timestamp from, 1 means last row and 2 means second last row.
 
     ##### Returns:
-    - final_timestamp: str
-        - formatted final timestamp
+    - final_timestamp: np.datetime64
+        - final timestamp, None if the file has no rows after the header
     """
-    num_newlines = 0
-    with open(file_path, 'rb') as f:
-        try:  # catch OSError in case of a one line file
-            f.seek(-2, os.SEEK_END)
-            while num_newlines < row_pos:
-                f.seek(-2, os.SEEK_CUR)
-                if f.read(1) == b'\n':
-                    num_newlines += 1
-        except OSError:
-            f.seek(0)
-        final_entry = f.readline().decode().strip("\r\n").split(",")
-    final_timestamp = format_timestamp(final_entry)
-    return final_timestamp
\ No newline at end of file
+    lines = iter_lines_reversed(file_path)
+    final_row = next((line for line in lines if line.strip(b'\r,')), None)
+    # the header is the first line, so the final row is only a data row if there is a line before it
+    if final_row is None or next(lines, None) is None:
+        return None
+    final_entry = final_row.decode().strip("\r").replace('"', '').split(",")
+    final_timestamp = np.datetime64(final_entry[0], 'us')
+    return final_timestamp
@@ -0,0 +1,642 @@
+"""
+Classes for writing the logger data to file.
+For use with the Python web application for CR1000 data logging.
+Files are written through the storage backend selected in the config settings.
+
+Author: Liam Eime
+Date: 12/12/2023
+"""
+
+# Python imports
+import os
+import time
+import logging
+import numpy as np
+
+# .py file imports
+import timestamp
+import files
+import payload
+import storage
+import index
+import metrics
+import continuity
+
+logger = logging.getLogger(__name__)
+
+# durability modes of the writers
+#   none: each batch is written to the operating system, which decides when it reaches the disk
+#   batch: batches are held in the write buffer and written with one fsync every batch_rows rows or batch_ms milliseconds
+#   strict: each batch is written and fsynced before the request is replied to
+DURABILITY_MODES = ("none", "batch", "strict")
+
+class DataFileWriter:
+    """
+    #### Base writer for a running data file
+
+    Keeps the running data file open under the temp filename along with its row count, initial and final timestamps
+    as integer epoch micro-seconds and channel minimums and maximums, taken from each batch as it is appended,
+    so that data is appended and the file named without re-reading the file.\n
+    The running file is renamed with its total timestamp once it is complete, and added to the file index.\n
+    How soon each batch reaches the disk is set by the durability mode, see DURABILITY_MODES.
+    """
+    # name of the stream written, used to label the metrics
+    stream = ""
+
+    def __init__(
+        self,
+        dir: str,
+        output_filename: str,
+        temp_filename: str,
+        header: list[str],
+        backend: storage.CsvBackend,
+        file_index: index.FileIndex = None,
+        durability: str = "none",
+        batch_rows: int = 0,
+        batch_ms: float = 0,
+        continuity_tracker: continuity.ContinuityTracker = None
+    ):
+        """
+        #### Create the writer
+
+        ##### Parameters:
+        - dir: str
+            - directory the data files are written to
+        - output_filename: str
+            - filename the timestamp is added to for complete files
+        - temp_filename: str
+            - filename of the running file, without extension
+        - header: list[str]
+            - header of the data file
+        - backend: storage.CsvBackend
+            - storage backend the data files are written with
+        - file_index: index.FileIndex = None
+            - index the completed data files are added to, not indexed if None
+        - durability: str = "none"
+            - one of DURABILITY_MODES
+        - batch_rows: int = 0
+            - in batch durability, the number of rows held before they are written and fsynced
+        - batch_ms: float = 0
+            - in batch durability, the milliseconds the oldest held row waits before it is written and fsynced
+        - continuity_tracker: continuity.ContinuityTracker = None
+            - tracker of the last sample written, checking each batch before it is written, not checked if None
+
+        ##### Raises:
+        - ValueError
+            - if the durability mode is not one of DURABILITY_MODES
+        """
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Unknown durability mode {durability!r}, expected one of {DURABILITY_MODES}")
+        self.durability = durability
+        self.batch_rows = batch_rows
+        self.batch_ms = batch_ms
+        self.num_pending_rows = 0
+        self._pending_since = None
+        self.dir = dir
+        self.output_filename = output_filename
+        self.backend = backend
+        self.temp_path = os.path.join(dir, temp_filename) + backend.temp_extension
+        self.header = header
+        self.file_index = file_index
+        self.continuity_tracker = continuity_tracker
+        self._file = None
+        self._reset_state()
+
+    def _reset_state(self):
+        """
+        #### Reset the state kept for the running file
+
+        ##### Returns:
+        - None
+        """
+        self.num_rows = 0
+        self.initial_us = None
+        self.final_us = None
+        self.channel_min = np.full(len(self.header) - 1, np.nan, dtype=np.float32)
+        self.channel_max = np.full(len(self.header) - 1, np.nan, dtype=np.float32)
+
+    def _recover_temp_file(self):
+        """
+        #### Rebuild the writer state from a temp file left over from a previous run
+
+        ##### Returns:
+        - None
+        """
+        self.backend.repair(self.temp_path)
+        _, timestamps, channels = self.backend.read(self.temp_path)
+        self._reset_state()
+        self.num_rows = len(timestamps)
+        if self.num_rows > 0:
+            self.initial_us = timestamp.to_microseconds(timestamps[0])
+            self.final_us = timestamp.to_microseconds(timestamps[-1])
+            self.channel_min, self.channel_max = index.channel_range(channels)
+        self._open()
+
+    def _open(self):
+        """
+        #### Open the temp file for appending, writing the header if the file is new
+
+        ##### Returns:
+        - None
+        """
+        if not os.path.exists(self.temp_path):
+            self._reset_state()
+        self._file = self.backend.open(self.temp_path, self.header)
+
+    def _append(self, batch: payload.DataBatch):
+        """
+        #### Append the rows of a batch to the running file with a single write
+
+        ##### Parameters:
+        - batch: payload.DataBatch
+            - parsed samples to write
+
+        ##### Returns:
+        - None
+        """
+        if self._file is None:
+            self._open()
+        self.backend.append(self._file, batch)
+        if self.num_pending_rows == 0:
+            self._pending_since = time.monotonic()
+        self.num_pending_rows += batch.num_rows
+        if self.durability != "batch" or self.num_pending_rows >= self.batch_rows:
+            self.sync()
+        if self.num_rows == 0:
+            self.initial_us = timestamp.to_microseconds(batch.timestamps[0])
+        self.final_us = timestamp.to_microseconds(batch.timestamps[-1])
+        self.num_rows += batch.num_rows
+        batch_min, batch_max = index.channel_range(batch.channels)
+        self.channel_min = np.fmin(self.channel_min, batch_min)
+        self.channel_max = np.fmax(self.channel_max, batch_max)
+
+    def sync(self):
+        """
+        #### Write the batches held in the write buffer to the running file, and fsync it unless the durability mode is none
+
+        ##### Returns:
+        - None
+        """
+        if self._file is None or self.num_pending_rows == 0:
+            return
+        self._file.flush()
+        if self.durability != "none":
+            with metrics.STAGE_SECONDS.time(stage="fsync", stream=self.stream):
+                os.fsync(self._file.fileno())
+        self.num_pending_rows = 0
+        self._pending_since = None
+
+    def flush(self):
+        """
+        #### Write the batches held in the write buffer to the running file so they can be read, leaving the fsync for later
+
+        ##### Returns:
+        - None
+        """
+        if self._file is not None and self.num_pending_rows > 0:
+            self._file.flush()
+
+    def sync_if_due(self):
+        """
+        #### Write and fsync the batches held in the write buffer once the oldest has waited batch_ms
+
+        ##### Returns:
+        - None
+        """
+        if self._pending_since is not None and (time.monotonic() - self._pending_since) * 1000 >= self.batch_ms:
+            self.sync()
+
+    def insert(self, batch: payload.DataBatch):
+        """
+        #### Merge samples into the running file in time order, rewriting it, such as samples imported from a table file
+
+        Samples with the timestamp of a sample already in the running file are dropped.
+
+        ##### Parameters:
+        - batch: payload.DataBatch
+            - samples to merge, which may be older than the samples already in the running file
+
+        ##### Returns:
+        - inserted: payload.DataBatch
+            - the samples merged into the running file
+        """
+        self.close()
+        batches = [batch]
+        if os.path.exists(self.temp_path):
+            running = self.backend.read_batch(self.temp_path)
+            is_new = ~np.isin(batch.timestamps.astype(np.int64), running.timestamps.astype(np.int64))
+            if not np.all(is_new):
+                batch = batch.take(np.flatnonzero(is_new))
+            if batch.num_rows == 0:
+                return batch
+            batches = [running, batch]
+        self._rewrite(payload.merge_batches(batches))
+        return batch
+
+    def _rewrite(self, batch: payload.DataBatch):
+        """
+        #### Replace the running file with the samples of a batch, writing a new file and renaming it over the running file
+
+        ##### Returns:
+        - None
+        """
+        part_path = self.temp_path + '.part'
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        with self.backend.open(part_path, self.header) as f:
+            self.backend.append(f, batch)
+            f.flush()
+            if self.durability != "none":
+                os.fsync(f.fileno())
+        os.replace(part_path, self.temp_path)
+        self._recover_temp_file()
+
+    def _write_completed(self, batch: payload.DataBatch):
+        """
+        #### Write the samples of a batch directly to a timestamped file and add it to the file index, the same as a rolled over running file
+
+        ##### Returns:
+        - path: str
+            - path to the timestamped file
+        """
+        initial_us = timestamp.to_microseconds(batch.timestamps[0])
+        final_us = timestamp.to_microseconds(batch.timestamps[-1])
+        path = files.create_timestamped_filepath(
+            timestamp.format_microseconds(initial_us),
+            timestamp.format_microseconds(final_us),
+            self.output_filename,
+            self.dir,
+            self.backend.extension
+        )
+        with metrics.STAGE_SECONDS.time(stage="roll_over", stream=self.stream):
+            self.backend.write_batch(path, batch, sync=self.durability != "none")
+            if self.file_index is not None:
+                channel_min, channel_max = index.channel_range(batch.channels)
+                self.file_index.add_file(path, self.header, batch.timestamps[0], batch.timestamps[-1], batch.num_rows, channel_min, channel_max)
+        metrics.FILES_COMPLETED.inc(stream=self.stream)
+        return path
+
+    def write_late(self, batch: payload.DataBatch):
+        """
+        #### Merge samples older than the final sample written into the running file in time order, for the reorder continuity policy
+
+        Samples older than the running file, which belong to files already completed, are dropped.
+
+        ##### Parameters:
+        - batch: payload.DataBatch
+            - late samples in time order, from continuity.ContinuityTracker.check
+
+        ##### Returns:
+        - paths: list[str]
+            - paths to the timestamped files the running file was rolled over to, empty if it was not
+        - inserted: payload.DataBatch
+            - the samples merged into the running file
+        """
+        first = batch.num_rows
+        if self.num_rows > 0:
+            first = int(np.searchsorted(batch.timestamps.astype(np.int64), self.initial_us, side='left'))
+        if first > 0:
+            metrics.OUT_OF_ORDER_ROWS.inc(first, stream=self.stream, action="dropped")
+        batch = batch.slice(first, batch.num_rows)
+        if batch.num_rows == 0:
+            return [], batch
+        inserted = self.insert(batch)
+        if inserted.num_rows < batch.num_rows:
+            metrics.DUPLICATE_ROWS.inc(batch.num_rows - inserted.num_rows, stream=self.stream)
+        if inserted.num_rows > 0:
+            metrics.OUT_OF_ORDER_ROWS.inc(inserted.num_rows, stream=self.stream, action="reordered")
+            if self.continuity_tracker is not None:
+                self.continuity_tracker.fill(inserted.timestamps.astype(np.int64))
+        return [], inserted
+
+    def recover_continuity(self):
+        """
+        #### Set the last sample of the continuity tracker to the final sample of the running file, or else of the newest indexed file
+
+        ##### Returns:
+        - None
+        """
+        if self.continuity_tracker is None:
+            return
+        last_us = self.final_us
+        if self.num_rows == 0 and self.file_index is not None:
+            _, end = self.file_index.time_range(self.dir)
+            last_us = timestamp.to_microseconds(end) if end is not None else None
+        self.continuity_tracker.last_us = last_us
+
+    def roll_over(self):
+        """
+        #### Close the running file and rename it with its total timestamp
+
+        ##### Returns:
+        - path: str
+            - path to the timestamped file, None if there was no running file
+        """
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
+        elif not os.path.exists(self.temp_path):
+            return None
+        if self.num_rows == 0:
+            os.remove(self.temp_path)
+            return None
+        initial_timestamp = timestamp.format_microseconds(self.initial_us)
+        final_timestamp = timestamp.format_microseconds(self.final_us)
+        path = files.create_timestamped_filepath(initial_timestamp, final_timestamp, self.output_filename, self.dir, self.backend.extension)
+        with metrics.STAGE_SECONDS.time(stage="roll_over", stream=self.stream):
+            self.backend.finalize(self.temp_path, path, sync=self.durability != "none")
+            if self.file_index is not None:
+                self.file_index.add_file(
+                    path,
+                    self.header,
+                    np.datetime64(self.initial_us, 'us'),
+                    np.datetime64(self.final_us, 'us'),
+                    self.num_rows,
+                    self.channel_min,
+                    self.channel_max
+                )
+        metrics.FILES_COMPLETED.inc(stream=self.stream)
+        self._reset_state()
+        return path
+
+    def dump_state(self):
+        """
+        #### Get the state kept for the running file, to share it with other processes writing the same stream
+
+        ##### Returns:
+        - state: dict
+            - json serialisable state
+        """
+        return {
+            "num_rows": self.num_rows,
+            "initial_us": self.initial_us,
+            "final_us": self.final_us,
+            "channel_min": self.channel_min.tolist(),
+            "channel_max": self.channel_max.tolist(),
+            "continuity": self.continuity_tracker.dump_state() if self.continuity_tracker is not None else None
+        }
+
+    def load_state(self, state: dict):
+        """
+        #### Replace the state kept for the running file with the state written by another process
+
+        The running file is closed, as the other process may have rolled it over, and is reopened on the next write.
+
+        ##### Parameters:
+        - state: dict
+            - state from dump_state
+
+        ##### Returns:
+        - None
+        """
+        self.close()
+        self.num_rows = state["num_rows"]
+        self.initial_us = state["initial_us"]
+        self.final_us = state["final_us"]
+        self.channel_min = np.array(state["channel_min"], dtype=np.float32)
+        self.channel_max = np.array(state["channel_max"], dtype=np.float32)
+        if self.continuity_tracker is not None and state.get("continuity") is not None:
+            self.continuity_tracker.load_state(state["continuity"])
+
+    def close(self):
+        """
+        #### Write the batches held in the write buffer and close the running file, leaving it under the temp filename to be continued on restart
+
+        ##### Returns:
+        - None
+        """
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
+
+class LowFreqWriter(DataFileWriter):
+    """
+    #### Writer for the low frequency data
+
+    Each sample is appended to the running file with a single write.\n
+    The running file is only renamed with its total timestamp once it holds max_rows samples.
+    """
+    stream = "low"
+
+    def __init__(
+        self,
+        dir: str,
+        output_filename: str,
+        temp_filename: str,
+        header: list[str],
+        backend: storage.CsvBackend,
+        max_rows: int,
+        file_index: index.FileIndex = None,
+        durability: str = "none",
+        batch_rows: int = 0,
+        batch_ms: float = 0,
+        continuity_tracker: continuity.ContinuityTracker = None
+    ):
+        """
+        #### Create the low frequency writer and rebuild its state from the newest file on disk
+
+        ##### Parameters:
+        - dir: str
+            - directory the low frequency data files are written to
+        - output_filename: str
+            - filename the timestamp is added to for full files
+        - temp_filename: str
+            - filename of the running file, without extension
+        - header: list[str]
+            - header of the low frequency data file
+        - backend: storage.CsvBackend
+            - storage backend the data files are written with
+        - max_rows: int
+            - number of samples written to a file before a new file is started
+        - file_index: index.FileIndex = None
+            - index the full data files are added to, not indexed if None
+        - durability: str = "none"
+            - one of DURABILITY_MODES
+        - batch_rows: int = 0
+            - in batch durability, the number of rows held before they are written and fsynced
+        - batch_ms: float = 0
+            - in batch durability, the milliseconds the oldest held row waits before it is written and fsynced
+        - continuity_tracker: continuity.ContinuityTracker = None
+            - tracker of the last sample written, checking each batch before it is written, not checked if None
+        """
+        super().__init__(dir, output_filename, temp_filename, header, backend, file_index, durability, batch_rows, batch_ms, continuity_tracker)
+        self.max_rows = max_rows
+        self.recover()
+
+    def recover(self):
+        """
+        #### Rebuild the writer state from the newest file on disk
+
+        A temp file left over from a previous run is continued.
+        Otherwise the newest timestamped file is continued if it is not yet full.
+
+        ##### Returns:
+        - None
+        """
+        if not os.path.exists(self.temp_path):
+            latest_path = files.get_latest_filepath(self.dir, self.backend.extension)
+            if latest_path is None:
+                logger.info("No previous low frequency data file could be found")
+                return
+            try:  # try to turn the newest file back into the running file to continue with it
+                if self.backend.read_info(latest_path)[0] >= self.max_rows:
+                    return
+                self.backend.reopen(latest_path, self.temp_path)
+            except OSError:
+                logger.error("There was an error continuing the previous low frequency data file", exc_info=True)
+                return
+        self._recover_temp_file()
+        logger.info("Continuing low frequency data file with %d samples", self.num_rows)
+        if self.num_rows >= self.max_rows:
+            self.roll_over()
+
+    def write(self, batch: payload.DataBatch):
+        """
+        #### Append samples to the running file, rolling over to a new file each time it is full
+
+        ##### Parameters:
+        - batch: payload.DataBatch
+            - parsed samples to write, usually a single sample
+
+        ##### Returns:
+        - paths: list[str]
+            - paths to the timestamped files the running file was rolled over to, empty if the file is not yet full
+        """
+        paths = []
+        start = 0
+        while start < batch.num_rows:
+            stop = start + self.max_rows - self.num_rows
+            self._append(batch.slice(start, stop))
+            if self.num_rows >= self.max_rows:
+                paths.append(self.roll_over())
+            start = stop
+        return paths
+
+    def write_late(self, batch: payload.DataBatch):
+        """
+        #### Merge late samples into the running file, then split it into files of max_rows samples the same as write
+
+        The full files are written before the running file is rewritten with the samples left over,
+        so a crash in between leaves samples in both rather than losing them.
+        """
+        paths, inserted = super().write_late(batch)
+        if self.num_rows == self.max_rows:
+            paths.append(self.roll_over())
+        elif self.num_rows > self.max_rows:
+            self.close()
+            running = self.backend.read_batch(self.temp_path)
+            num_full_rows = running.num_rows - running.num_rows % self.max_rows
+            for start in range(0, num_full_rows, self.max_rows):
+                paths.append(self._write_completed(running.slice(start, start + self.max_rows)))
+            if num_full_rows == running.num_rows:
+                os.remove(self.temp_path)
+                self._reset_state()
+            else:
+                self._rewrite(running.slice(num_full_rows, running.num_rows))
+        return paths, inserted
+
+class HighFreqEventWriter(DataFileWriter):
+    """
+    #### Writer for the high frequency acceleration events
+
+    Bursts that continue the open event, within scan_rate_micro_s of its final sample, are appended directly to the event file.\n
+    The event file is only renamed with its total timestamp once the event closes,
+    either when a burst arrives after a gap or when no burst has arrived for timeout_s.
+    """
+    stream = "high"
+
+    def __init__(
+        self,
+        dir: str,
+        output_filename: str,
+        temp_filename: str,
+        header: list[str],
+        backend: storage.CsvBackend,
+        scan_rate_micro_s: int,
+        timeout_s: float,
+        file_index: index.FileIndex = None,
+        durability: str = "none",
+        batch_rows: int = 0,
+        batch_ms: float = 0,
+        continuity_tracker: continuity.ContinuityTracker = None
+    ):
+        """
+        #### Create the high frequency event writer, continuing an event left open by a previous run
+
+        ##### Parameters:
+        - dir: str
+            - directory the high frequency data files are written to
+        - output_filename: str
+            - filename the timestamp is added to for closed events
+        - temp_filename: str
+            - filename of the open event file, without extension
+        - header: list[str]
+            - header of the high frequency data file
+        - backend: storage.CsvBackend
+            - storage backend the data files are written with
+        - scan_rate_micro_s: int
+            - maximum time between bursts, in micro-seconds, for them to be stitched into one event
+        - timeout_s: float
+            - time in seconds without a burst after which the open event is closed
+        - file_index: index.FileIndex = None
+            - index the closed event files are added to, not indexed if None
+        - durability: str = "none"
+            - one of DURABILITY_MODES
+        - batch_rows: int = 0
+            - in batch durability, the number of rows held before they are written and fsynced
+        - batch_ms: float = 0
+            - in batch durability, the milliseconds the oldest held row waits before it is written and fsynced
+        - continuity_tracker: continuity.ContinuityTracker = None
+            - tracker of the last sample written, checking each batch before it is written, not checked if None
+        """
+        super().__init__(dir, output_filename, temp_filename, header, backend, file_index, durability, batch_rows, batch_ms, continuity_tracker)
+        self.max_gap_us = scan_rate_micro_s
+        self.timeout_s = timeout_s
+        self.last_write_time = time.time()
+        if os.path.exists(self.temp_path):
+            self._recover_temp_file()
+            logger.info("Continuing high frequency event with %d samples", self.num_rows)
+
+    def write(self, batch: payload.DataBatch):
+        """
+        #### Write a burst, appending it to the open event if it is a continuation, otherwise starting a new event
+
+        ##### Parameters:
+        - batch: payload.DataBatch
+            - parsed samples of the burst to write
+
+        ##### Returns:
+        - paths: list[str]
+            - path to the timestamped file if the previous event was closed, otherwise empty
+        """
+        paths = []
+        if self.final_us is not None and timestamp.to_microseconds(batch.timestamps[0]) - self.final_us > self.max_gap_us:
+            paths.append(self.roll_over())
+        elif self.num_rows > 0:
+            metrics.EVENT_MERGES.inc()
+        self._append(batch)
+        self.last_write_time = time.time()
+        return paths
+
+    def close_if_idle(self):
+        """
+        #### Close the open event if no burst has been written for timeout_s
+
+        ##### Returns:
+        - path: str
+            - path to the timestamped file if the event was closed, otherwise None
+        """
+        if self.num_rows == 0 or time.time() - self.last_write_time < self.timeout_s:
+            return None
+        return self.roll_over()
+
+    def dump_state(self):
+        state = super().dump_state()
+        state["last_write_time"] = self.last_write_time
+        return state
+
+    def load_state(self, state: dict):
+        super().load_state(state)
+        self.last_write_time = state["last_write_time"]